@@ -0,0 +1,73 @@
+"""Benchmarks the fast line parser against ast.literal_eval on a recorded livetiming cache file
+
+Usage:
+    python benchmarks/bench_parser.py path/to/livetiming_cache.txt [--max-lines 200000]
+
+Without a cache file the lines in docs/debug_lines.md are used, which is fine for a smoke test
+but a recorded race session gives far more representative numbers.
+"""
+import argparse
+import ast
+import os
+import sys
+import time
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+from src.drs.line_parser import parse_line
+from src.drs.line_router import peek_category
+
+
+def load_lines(cache_file: str | None, max_lines: int) -> list[str]:
+    """Loads the lines to benchmark, either from a recorded cache or the debug lines"""
+    path = cache_file or os.path.join(PROJECT_ROOT, 'docs', 'debug_lines.md')
+    lines = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith("['"):
+                lines.append(line.rstrip('\n'))
+                if len(lines) >= max_lines:
+                    break
+    return lines
+
+def time_parser(parser, lines: list[str], repeat: int) -> float:
+    """Returns the best of `repeat` runs, in seconds, for parsing all lines"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            parser(line)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the livetiming line parser")
+    parser.add_argument('cache_file', nargs='?', default=None, help="Recorded livetiming cache file")
+    parser.add_argument('--max-lines', type=int, default=200_000, help="Maximum number of lines to load")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    lines = load_lines(args.cache_file, args.max_lines)
+    if not lines:
+        print("No cache lines found")
+        sys.exit(1)
+
+    # Correctness first, a fast parser returning something else is worthless
+    mismatches = sum(1 for line in lines if parse_line(line) != ast.literal_eval(line))
+
+    by_category = defaultdict(list)
+    for line in lines:
+        by_category[peek_category(line)].append(line)
+
+    print(f"{len(lines)} lines, {sum(len(line) for line in lines) / 1e6:.1f} MB, {mismatches} mismatches\n")
+    print(f"{'category':<24}{'lines':>8}{'literal_eval l/s':>20}{'parse_line l/s':>18}{'speedup':>10}")
+    for category, category_lines in sorted(by_category.items(), key=lambda item: -len(item[1])) + [('ALL', lines)]:
+        baseline = time_parser(ast.literal_eval, category_lines, args.repeat)
+        fast = time_parser(parse_line, category_lines, args.repeat)
+        print(f"{str(category):<24}{len(category_lines):>8}{len(category_lines) / baseline:>20,.0f}"
+              f"{len(category_lines) / fast:>18,.0f}{baseline / fast:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Benchmark suite: line processing, parsing and the MQTT publish queue, on a synthetic race weekend
+
+Usage:
+    python benchmarks/run_benchmarks.py                                  # prints a summary
+    python benchmarks/run_benchmarks.py --output results.json            # also writes the results as JSON
+    python benchmarks/run_benchmarks.py --compare old.json               # shows the change against an earlier run
+
+Measured:
+    * processors: lines/sec through each `process_*_line` function and the line router, over every line of the
+      weekend (as the main loop sees them, most lines belong to categories the processor ignores)
+    * parser: lines/sec of `parse_line` and `ast.literal_eval`
+    * telemetry: CarData.z lines/sec through the line router into `CarTelemetry`, Position.z lines/sec into
+      `BattleDetector` (along with the lines keeping the running order), and the percentage of one core each takes to keep up with the live feed (a line every ~0.27s, every car)
+    * publish queue: `MQTTHandler.queue_message` and publishing throughput, and how late the publisher thread
+      publishes messages compared to their due time (p50/p95/p99)
+
+Lower is better for anything in `_us` or `_ms`, higher is better for anything `_per_sec`.
+"""
+import argparse
+import ast
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from queue import Queue
+from typing import Callable, Dict, List
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+from benchmarks.synthetic import CATEGORY_INTERVALS, generate_weekend, load_driver_numbers
+from src.drs import f1_utils
+from src.drs.line_parser import parse_line
+from src.drs.mqtt_handler import MQTTHandler
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.publish_scheduler import MAIN_SINK
+from src.drs.replay import ReplayMQTTHandler, VirtualClock
+from src.drs.session_state import SessionState
+from src.drs.proximity import BattleDetector
+from src.drs.telemetry import CarTelemetry
+
+PROCESSORS = {
+    'process_session_data_line': f1_utils.process_session_data_line,
+    'process_race_lead_line': f1_utils.process_race_lead_line,
+    'process_lap_time_line': f1_utils.process_lap_time_line,
+    'process_race_control_line': f1_utils.process_race_control_line,
+}
+TOPICS = [MqttTopics.LEADER_TOPIC, MqttTopics.FLAG_TOPIC]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 and max of the samples"""
+    ordered = sorted(samples)
+    at = lambda share: ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+    return {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'max': ordered[-1]}
+
+def best_of(repeat: int, run: Callable[[], None]) -> float:
+    """Best time of `repeat` runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def load_drs_data() -> dict:
+    with open(os.path.join(PROJECT_ROOT, 'data', 'drs_data.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- processors and parser ---
+def bench_processors(weekend: Dict[str, List[str]], repeat: int) -> dict:
+    drs_data = load_drs_data()
+    results = {}
+    for session_type, lines in weekend.items():
+        def run_with(process):
+            def run():
+                clock = VirtualClock()
+                state = SessionState(session_type=session_type, drivers_data=drs_data['drivers'], teams_data=drs_data['teams'], clock=clock.monotonic)
+                mqtt_handler = ReplayMQTTHandler(delay=0, clock=clock)
+                for line in lines:
+                    process(line, state, mqtt_handler)
+            return run
+
+        router = f1_utils.create_line_router(session_type)
+        session_results = {name: {'lines_per_sec': len(lines) / best_of(repeat, run_with(process))}
+                           for name, process in PROCESSORS.items()}
+        session_results['line_router'] = {'lines_per_sec': len(lines) / best_of(repeat, run_with(router.dispatch))}
+        session_results['lines'] = len(lines)
+        session_results['megabytes'] = sum(len(line) for line in lines) / 1e6
+        results[session_type] = session_results
+    return results
+
+def bench_parser(weekend: Dict[str, List[str]], repeat: int) -> dict:
+    lines = [line for session_lines in weekend.values() for line in session_lines]
+    def run_with(parser):
+        def run():
+            for line in lines:
+                parser(line)
+        return run
+    return {'parse_line': {'lines_per_sec': len(lines) / best_of(repeat, run_with(parse_line))},
+            'literal_eval': {'lines_per_sec': len(lines) / best_of(repeat, run_with(ast.literal_eval))}}
+
+def bench_telemetry(weekend: Dict[str, List[str]], repeat: int) -> dict:
+    drs_data = load_drs_data()
+    results = {}
+    for name, category, stage in (('car_data', 'CarData.z', lambda: {'telemetry': CarTelemetry()}),
+                                  ('position', 'Position.z', lambda: {'battles': BattleDetector()})):
+        prefix = f"['{category}'"
+        # Battles are between cars next to each other in the running order, so the lines that keep the timing tower
+        # up to date (TopThree, TimingData Position patches) are dispatched along and count towards the time
+        lines = [line for line in weekend['race'] if line.startswith(prefix) or category == 'Position.z'
+                 and (line.startswith("['TopThree'") or line.startswith("['TimingData'") and "'Position'" in line)]
+        stage_lines = sum(line.startswith(prefix) for line in lines)
+        def run():
+            clock = VirtualClock()
+            state = SessionState(session_type='race', drivers_data=drs_data['drivers'], teams_data=drs_data['teams'], clock=clock.monotonic,
+                                 followed_driver=next(iter(drs_data['drivers'])))
+            state.set_true_session_start_time(clock.monotonic())
+            mqtt_handler = ReplayMQTTHandler(delay=0, clock=clock)
+            router = f1_utils.create_line_router('race', **stage())
+            for line in lines:
+                router.dispatch(line, state, mqtt_handler)
+
+        lines_per_sec = stage_lines / best_of(repeat, run)
+        live_lines_per_sec = 1 / dict(CATEGORY_INTERVALS)[category]
+        results[name] = {'lines_per_sec': lines_per_sec, 'live_core_percent': 100 * live_lines_per_sec / lines_per_sec, 'lines': stage_lines}
+    return results
+
+
+# --- publish queue ---
+class _LatencyMQTTHandler(MQTTHandler):
+    """MQTTHandler with the real publisher thread but no broker, records how late each message is published"""
+    CLIENT_ID = "f1_data_service_benchmark"
+
+    def __init__(self, *args, **kwargs):
+        self.lateness_ns: List[int] = []
+        self.due_times: Dict[str, int] = {}
+        self.all_published = threading.Event()
+        self.expected = 0
+        super().__init__(*args, **kwargs)
+
+    def _connect(self, broker_ip, port):
+        self.publisher_thread = threading.Thread(target=self._publisher_loop, daemon=True)
+        self.publisher_thread.start()
+
+    def _publish(self, topic: str, payload: str, sink: str = MAIN_SINK, force: bool = False) -> None:
+        self.lateness_ns.append(time.monotonic_ns() - self.due_times[payload])
+        if len(self.lateness_ns) >= self.expected:
+            self.all_published.set()
+
+    def disconnect(self):
+        with self._condition:
+            self._running = False
+            self._schedule_changed()
+        self.publisher_thread.join()
+
+def bench_publish_queue(messages: int, latency_messages: int, delay: float) -> dict:
+    # Throughput, on a virtual clock so it's only the queue being measured
+    clock = VirtualClock()
+    mqtt_handler = ReplayMQTTHandler(delay=delay, clock=clock)
+    payloads = [json.dumps({"driver": "VER", "driver_number": number, "team": "Red Bull"}) for number in load_driver_numbers()]
+    start = time.perf_counter()
+    for i in range(messages):
+        clock.advance_to(clock.monotonic_ns() + 1_000_000)
+        mqtt_handler.queue_message(TOPICS[i % len(TOPICS)], payloads[i % len(payloads)])
+    enqueue_seconds = time.perf_counter() - start
+
+    clock.advance_to(clock.monotonic_ns() + int(delay * 1e9) + 1)
+    start = time.perf_counter()
+    mqtt_handler.publish_due()
+    dequeue_seconds = time.perf_counter() - start
+    assert len(mqtt_handler.published) == messages
+
+    # Latency, with the real publisher thread sleeping until each message is due
+    latency_handler = _LatencyMQTTHandler(None, 0, None, None, delay, command_queue=Queue())
+    latency_handler.expected = latency_messages
+    enqueue_ns = []
+    for i in range(latency_messages):
+        payload = str(i)
+        queued = time.monotonic_ns()
+        latency_handler.due_times[payload] = queued + int(delay * 1e9)
+        latency_handler.queue_message(TOPICS[i % len(TOPICS)], payload)
+        enqueue_ns.append(time.monotonic_ns() - queued)
+        time.sleep(0.001)
+    latency_handler.all_published.wait(timeout=delay + 10)
+    latency_handler.disconnect()
+
+    return {
+        'enqueue_per_sec': messages / enqueue_seconds,
+        'dequeue_per_sec': messages / dequeue_seconds,
+        'enqueue_us': {key: value / 1e3 for key, value in percentiles(enqueue_ns).items()},
+        'publish_lateness_ms': {key: value / 1e6 for key, value in percentiles(latency_handler.lateness_ns).items()},
+        'published': len(latency_handler.lateness_ns),
+    }
+
+
+# --- output ---
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results: dict, prefix: str = '') -> Dict[str, float]:
+    """{'a': {'b': 1}} -> {'a.b': 1}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def print_results(results: dict, baseline: dict | None) -> None:
+    current = flatten(results['results'])
+    previous = flatten(baseline['results']) if baseline else {}
+    for key, value in current.items():
+        line = f"{key:<60}{value:>16,.2f}"
+        if previous.get(key):
+            line += f"{(value - previous[key]) / previous[key]:>+10.1%}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the DRS benchmarks on a synthetic race weekend")
+    parser.add_argument('--scale', type=float, default=0.1, help="Session length as a share of a real session (default 0.1)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Number of runs, the best one is reported")
+    parser.add_argument('--messages', type=int, default=100_000, help="Messages for the publish queue throughput")
+    parser.add_argument('--latency-messages', type=int, default=500, help="Messages for the publish latency")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="An earlier results JSON file to compare against")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)   # Benchmark the processing, not the logging
+
+    weekend = generate_weekend(args.scale, args.seed)
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'results': {
+            'processors': bench_processors(weekend, args.repeat),
+            'parser': bench_parser(weekend, args.repeat),
+            'telemetry': bench_telemetry(weekend, args.repeat),
+            'publish_queue': bench_publish_queue(args.messages, args.latency_messages, delay=0.05),
+        },
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""Synthetic livetiming sessions for the benchmarks
+
+Generates cache lines the way `fastf1.livetiming save` writes them (`str([category, payload, timestamp])`), with
+roughly the category mix, rates and line sizes of a real session: CarData.z and Position.z make up most of the
+bytes (base64 of raw deflated JSON, a few KB per line), TimingData most of the lines, and the categories DRS
+acts on the most (TopThree, RaceControlMessages, SessionData) are a small fraction of both. Cars overtake now and
+then, with Position patches on TimingData and the new top three on TopThree as the feed sends them.
+
+Usage:
+    python benchmarks/synthetic.py race --duration 7200 > race_cache.txt
+"""
+import argparse
+import base64
+import heapq
+import json
+import os
+import random
+import sys
+import zlib
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DRS_DATA_FILE = os.path.join(PROJECT_ROOT, 'data', 'drs_data.json')
+
+SESSION_DURATIONS = {'practice': 3600.0, 'qualifying': 3600.0, 'race': 7200.0}
+SESSION_NAMES = {'practice': 'Practice 1', 'qualifying': 'Qualifying', 'race': 'Race'}
+LAP_SECONDS = 90.0
+OVERTAKE_SHARE = 0.002  # Share of the TimingData lines that are an overtake (Position patches for two cars), one every ~20s
+
+# (category, mean seconds between lines), the interval gets some jitter per line
+CATEGORY_INTERVALS = [
+    ('CarData.z', 0.27),
+    ('Position.z', 0.28),
+    ('TimingData', 0.04),
+    ('TimingAppData', 1.5),
+    ('TimingStats', 0.6),
+    ('TopThree', 0.9),
+    ('ExtrapolatedClock', 5.0),
+    ('WeatherData', 60.0),
+    ('Heartbeat', 25.0),
+    ('TrackStatus', 300.0),
+    ('RaceControlMessages', 45.0),
+]
+
+
+def load_driver_numbers() -> List[str]:
+    """Driver numbers from data/drs_data.json, so the generated lines hit the real driver lookups"""
+    with open(DRS_DATA_FILE, 'r', encoding='utf-8') as f:
+        return list(json.load(f)['drivers'].keys())
+
+def _timestamp(start: datetime, offset: float) -> str:
+    return (start + timedelta(seconds=offset)).isoformat(timespec='milliseconds') + 'Z'
+
+def _compress(data: dict) -> str:
+    """Encodes like the .z categories: JSON, raw deflate, base64"""
+    compressor = zlib.compressobj(wbits=-15)
+    return base64.b64encode(compressor.compress(json.dumps(data).encode()) + compressor.flush()).decode()
+
+def _format_lap(seconds: float) -> str:
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}:{seconds:06.3f}"
+
+
+class SyntheticSession:
+    """Generates the lines of one session. Same session type, duration and seed, same lines."""
+
+    def __init__(self, session_type: str = 'race', duration: float | None = None, seed: int = 0,
+                 start: datetime = datetime(2025, 7, 6, 14, 0, 0)):
+        self.session_type = session_type
+        self.duration = duration if duration is not None else SESSION_DURATIONS[session_type]
+        self.start = start
+        self.random = random.Random(seed)
+        self.drivers = load_driver_numbers()
+        self.order = list(self.drivers)
+        self.top_three_sent: List[str] = []     # Top three as last sent on TopThree
+        self.base_lap = {number: 88.0 + self.random.uniform(0, 2.5) for number in self.drivers}
+        self.message_number = 0
+        self.status_number = 0
+        self.series_number = 0
+
+    # --- payload factories, each returns the payload of one line at session time `t` ---
+    def car_data(self, t: float):
+        entries = []
+        for i in range(3):
+            cars = {number: {'Channels': {'0': self.random.randint(9000, 12500), '2': self.random.randint(80, 340),
+                                          '3': self.random.randint(1, 8), '4': self.random.randint(0, 100),
+                                          '5': self.random.choice((0, 100)), '45': self.random.choice((0, 1, 8, 10, 12, 14))}}
+                    for number in self.drivers}
+            entries.append({'Utc': _timestamp(self.start, t + i * 0.09), 'Cars': cars})
+        return _compress({'Entries': entries})
+
+    def position(self, t: float):
+        positions = []
+        for i in range(2):
+            entries = {number: {'Status': 'OnTrack', 'X': self.random.randint(-9000, 9000),
+                                'Y': self.random.randint(-9000, 9000), 'Z': self.random.randint(-200, 200)}
+                       for number in self.drivers}
+            positions.append({'Timestamp': _timestamp(self.start, t + i * 0.14), 'Entries': entries})
+        return _compress({'Position': positions})
+
+    def timing_order(self, t: float):
+        # The full order the feed sends when the session starts
+        return {'Lines': {number: {'Position': str(position), 'Line': position} for position, number in enumerate(self.order, start=1)}}
+
+    def timing_data(self, t: float):
+        if self.random.random() < OVERTAKE_SHARE:
+            # A car passes the one ahead, only those two get a Position patch
+            position = self.random.randrange(1, len(self.order))
+            self.order[position - 1], self.order[position] = self.order[position], self.order[position - 1]
+            return {'Lines': {self.order[position - 1]: {'Position': str(position), 'Line': position},
+                              self.order[position]: {'Position': str(position + 1), 'Line': position + 1}}}
+        number = self.random.choice(self.drivers)
+        line = {'Sectors': {str(self.random.randint(0, 2)): {'Segments': {str(self.random.randint(0, 8)): {'Status': 2049}}}}}
+        roll = self.random.random()
+        if roll < 0.05:
+            # Laps get faster as the track rubbers in, so there are new fastest laps all session
+            lap = self.base_lap[number] - t / self.duration * 2.0 + self.random.uniform(-0.6, 0.6)
+            line['LastLapTime'] = {'Value': _format_lap(lap), 'PersonalFastest': self.random.random() < 0.3}
+            line['NumberOfLaps'] = int(t // LAP_SECONDS) + 1
+        elif roll < 0.3:
+            line['Speeds'] = {'I1': {'Value': str(self.random.randint(250, 320))}}
+            line['Sectors'] = {'1': {'Value': f"{self.random.uniform(25, 35):.3f}"}}
+        else:
+            line['IntervalToPositionAhead'] = {'Value': f"+{self.random.uniform(0.1, 5):.3f}"}
+            line['GapToLeader'] = f"+{self.random.uniform(1, 60):.3f}"
+        return {'Lines': {number: line}}
+
+    def timing_app_data(self, t: float):
+        number = self.random.choice(self.drivers)
+        return {'Lines': {number: {'Stints': {'0': {'LapTime': _format_lap(self.base_lap[number]), 'LapNumber': int(t // LAP_SECONDS) + 1}}}}}
+
+    def timing_stats(self, t: float):
+        number = self.random.choice(self.drivers)
+        return {'Lines': {number: {'BestSpeeds': {'ST': {'Position': self.random.randint(1, 20), 'Value': str(self.random.randint(300, 340))}}}}}
+
+    def top_three(self, t: float):
+        # The cars whose place in the top three changed since the last line (all three the first time), the rest of
+        # the time it's gap updates for P2 and P3
+        if self.order[:3] != self.top_three_sent:
+            changed = {str(index): {'RacingNumber': number, 'DiffToAhead': '', 'DiffToLeader': ''} for index, number in enumerate(self.order[:3])
+                       if index >= len(self.top_three_sent) or self.top_three_sent[index] != number}
+            self.top_three_sent = self.order[:3]
+            return {'Lines': changed}
+        position = self.random.choice(('1', '2'))
+        return {'Lines': {position: {'DiffToAhead': f"+{self.random.uniform(0.1, 3):.3f}", 'DiffToLeader': f"+{self.random.uniform(0.1, 6):.3f}"}}}
+
+    def extrapolated_clock(self, t: float):
+        remaining = max(0, int(self.duration - t))
+        return {'Utc': _timestamp(self.start, t), 'Remaining': f"{remaining // 3600:02}:{remaining // 60 % 60:02}:{remaining % 60:02}", 'Extrapolating': True}
+
+    def weather_data(self, t: float):
+        return {'AirTemp': f"{self.random.uniform(18, 30):.1f}", 'Humidity': '45.0', 'Pressure': '1012.3', 'Rainfall': '0',
+                'TrackTemp': f"{self.random.uniform(25, 50):.1f}", 'WindDirection': '270', 'WindSpeed': '1.2'}
+
+    def heartbeat(self, t: float):
+        return {'Utc': _timestamp(self.start, t)}
+
+    def track_status(self, t: float):
+        return {'Status': '1', 'Message': 'AllClear'}
+
+    def race_control(self, t: float):
+        self.message_number += 1
+        utc = _timestamp(self.start, t)[:19]
+        sector = self.random.randint(1, 20)
+        message = self.random.choice([
+            {'Category': 'Flag', 'Flag': 'YELLOW', 'Scope': 'Sector', 'Sector': sector, 'Message': f'YELLOW IN TRACK SECTOR {sector}'},
+            {'Category': 'Flag', 'Flag': 'CLEAR', 'Scope': 'Sector', 'Sector': sector, 'Message': f'CLEAR IN TRACK SECTOR {sector}'},
+            {'Category': 'Other', 'Message': f'CAR {self.random.choice(self.drivers)} TIME 1:29.123 DELETED - TRACK LIMITS AT TURN 4'},
+            {'Category': 'Drs', 'Status': 'ENABLED', 'Message': 'DRS ENABLED'},
+        ])
+        return {'Messages': {str(self.message_number): {'Utc': utc, **message}}}
+
+    def _scripted(self) -> List[Tuple[float, str, Callable[[float], object]]]:
+        """Session events at fixed times: start, flags, safety cars, the end"""
+        def status(state: str):
+            def factory(t: float):
+                self.status_number += 1
+                return {'StatusSeries': {str(self.status_number): {'Utc': _timestamp(self.start, t), 'SessionStatus': state}}}
+            return factory
+
+        def flag(flag: str, scope: str = 'Track'):
+            def factory(t: float):
+                self.message_number += 1
+                return {'Messages': {str(self.message_number): {'Utc': _timestamp(self.start, t)[:19], 'Category': 'Flag', 'Flag': flag,
+                                                                'Scope': scope, 'Message': f'{flag} FLAG'}}}
+            return factory
+
+        def safety_car(status: str, mode: str = 'SAFETY CAR'):
+            def factory(t: float):
+                self.message_number += 1
+                return {'Messages': {str(self.message_number): {'Utc': _timestamp(self.start, t)[:19], 'Category': 'SafetyCar',
+                                                                'Status': status, 'Mode': mode, 'Message': f'{mode} {status}'}}}
+            return factory
+
+        def series(**entry):
+            def factory(t: float):
+                self.series_number += 1
+                return {'Series': {str(self.series_number): {'Utc': _timestamp(self.start, t), **entry}}}
+            return factory
+
+        def session_info(t: float):
+            name = SESSION_NAMES[self.session_type]
+            return {'Meeting': {'Name': 'Synthetic Grand Prix', 'Location': 'Synthetic'}, 'Key': 9999,
+                    'Type': name.split(' ')[0], 'Name': name, 'StartDate': _timestamp(self.start, 0)[:19]}
+
+        d = self.duration
+        events = [(0.0, 'SessionInfo', session_info), (0.5, 'TimingData', self.timing_order), (1.0, 'SessionData', status('Started')),
+                  (d - 1.0, 'SessionData', status('Finished')),
+                  (d - 0.5, 'SessionData', status('Ends'))]
+        if self.session_type == 'race':
+            events += [(d * 0.2, 'RaceControlMessages', safety_car('DEPLOYED', 'VIRTUAL SAFETY CAR')),
+                       (d * 0.22, 'RaceControlMessages', safety_car('ENDING', 'VIRTUAL SAFETY CAR')),
+                       (d * 0.4, 'RaceControlMessages', safety_car('DEPLOYED')),
+                       (d * 0.45, 'RaceControlMessages', safety_car('IN THIS LAP')),
+                       (d * 0.6, 'RaceControlMessages', flag('RED')),
+                       (d * 0.65, 'SessionData', status('Started')),
+                       (d - 2.0, 'RaceControlMessages', flag('CHEQUERED'))]
+            events += [(1.5 + lap * LAP_SECONDS, 'SessionData', series(Lap=lap + 1)) for lap in range(int(d // LAP_SECONDS))]
+        elif self.session_type == 'qualifying':
+            events += [(d * share, 'RaceControlMessages', flag('CHEQUERED')) for share in (0.3, 0.65)]
+            events += [(d * share, 'SessionData', status('Started')) for share in (0.4, 0.75)]
+            events += [(d * share + 0.5, 'SessionData', series(QualifyingPart=part)) for part, share in ((1, 0.0), (2, 0.4), (3, 0.75))]
+            events += [(d - 2.0, 'RaceControlMessages', flag('CHEQUERED'))]
+        else:
+            events += [(d * 0.5, 'RaceControlMessages', flag('RED')), (d * 0.55, 'SessionData', status('Started')),
+                       (d - 2.0, 'RaceControlMessages', flag('CHEQUERED'))]
+        return events
+
+    def lines(self) -> Iterator[str]:
+        """The session's lines in timestamp order"""
+        factories: Dict[str, Callable[[float], object]] = {
+            'CarData.z': self.car_data, 'Position.z': self.position, 'TimingData': self.timing_data,
+            'TimingAppData': self.timing_app_data, 'TimingStats': self.timing_stats, 'TopThree': self.top_three,
+            'ExtrapolatedClock': self.extrapolated_clock, 'WeatherData': self.weather_data, 'Heartbeat': self.heartbeat,
+            'TrackStatus': self.track_status, 'RaceControlMessages': self.race_control,
+        }
+        # Heap of (time, tie breaker, category, factory, mean interval), an interval of None is a one off scripted event
+        upcoming = [(self.random.uniform(0, interval), i, category, factories[category], interval)
+                    for i, (category, interval) in enumerate(CATEGORY_INTERVALS)]
+        upcoming += [(t, len(upcoming) + i, category, factory, None) for i, (t, category, factory) in enumerate(self._scripted())]
+        heapq.heapify(upcoming)
+        tie_breaker = len(upcoming)
+
+        while upcoming:
+            t, _, category, factory, interval = heapq.heappop(upcoming)
+            if t > self.duration:
+                continue
+            yield str([category, factory(t), _timestamp(self.start, t)])
+            if interval is not None:
+                tie_breaker += 1
+                heapq.heappush(upcoming, (t + self.random.uniform(0.5, 1.5) * interval, tie_breaker, category, factory, interval))
+
+
+def generate_weekend(duration_scale: float = 1.0, seed: int = 0) -> Dict[str, List[str]]:
+    """Lines for a practice, qualifying and race session, `duration_scale` shortens (or lengthens) all of them"""
+    return {session_type: list(SyntheticSession(session_type, duration * duration_scale, seed=seed + i).lines())
+            for i, (session_type, duration) in enumerate(SESSION_DURATIONS.items())}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic livetiming cache to stdout")
+    parser.add_argument('session_type', choices=list(SESSION_DURATIONS))
+    parser.add_argument('--duration', type=float, default=None, help="Session length in seconds (default: a full session)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for line in SyntheticSession(args.session_type, args.duration, args.seed).lines():
+        sys.stdout.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
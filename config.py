@@ -9,4 +9,77 @@ CACHE_FILENAME = 'livetiming_cache.txt'
 # the MQTT Broker. This is because messages are received 
 # x - seconds before you see them on the broadcast.
 # Default of 30s fits for the F1TV Broadcast we receive.
-PUBLISH_DELAY = 30 # Seconds
\ No newline at end of file
+PUBLISH_DELAY = 30 # Seconds
+
+# Topics where only the latest message matters (retained state). If a newer
+# message for one of these topics is due within COALESCE_WINDOW seconds of an
+# older one, the older one is dropped instead of flickering the lights through
+# stale states. Set to an empty list to publish everything.
+COALESCE_TOPICS = ['f1/race/leader']
+COALESCE_WINDOW = 1.0 # Seconds
+# Latency diagnostics: how far behind the feed timestamps the service reads, parses,
+# handles, queues and publishes events. Rolling p50/p95/p99 over the last
+# LATENCY_WINDOW samples per stage are published on f1/service/latency at most
+# every LATENCY_REPORT_INTERVAL seconds. Set LATENCY_WINDOW to 0 to turn it off.
+LATENCY_WINDOW = 500
+LATENCY_REPORT_INTERVAL = 10 # Seconds
+
+# Where the stack samples of the PROFILE:SAMPLE:<seconds> command are written,
+# as collapsed stack files (e.g. for flamegraph.pl or speedscope.app)
+PROFILE_DIR = 'profiles'
+
+# Snapshot of the session state (leader, flags, qualifying segment, calibrated
+# delay, pending messages) and how far into the cache file it got. On restart
+# DRS carries on from the snapshot if it's from the same session type and at
+# most SNAPSHOT_MAX_AGE seconds old (start with --fresh to ignore it). Written
+# when the state changes (at most every SNAPSHOT_MIN_INTERVAL seconds), every
+# SNAPSHOT_INTERVAL seconds otherwise, and on shutdown.
+SNAPSHOT_FILENAME = 'drs_snapshot.json'
+SNAPSHOT_INTERVAL = 30 # Seconds
+SNAPSHOT_MIN_INTERVAL = 5 # Seconds
+SNAPSHOT_MAX_AGE = 1800 # Seconds
+
+# Extra screens to publish for, each with its own broadcast delay (e.g. a satellite
+# TV box lagging behind F1TV). Every queued event is also published to each of these,
+# calibrated with CALIBRATE_START / ADJUST:<seconds> on f1/service/control/<name>.
+# A sink without a broker_ip publishes to the main broker, under its topic_prefix:
+# PUBLISH_SINKS = [
+#     {'name': 'satellite', 'delay': 45, 'topic_prefix': 'satellite/'},
+#     {'name': 'stream', 'delay': 8, 'broker_ip': '192.168.1.20', 'port': 1883, 'username': 'drs', 'password': '...'},
+# ]
+PUBLISH_SINKS = []
+
+# While the MQTT broker is unreachable messages wait in an outbox of at most
+# OUTBOX_SIZE messages, and are replayed in order at OUTBOX_REPLAY_RATE messages
+# per second once it's back (the counters are then published on f1/service/outbox).
+# Per topic only the latest message is kept, unless OUTBOX_POLICIES says otherwise
+# ('drop_oldest' or 'drop_newest' keep every message, dropping when full).
+# Held messages are also written to OUTBOX_SPILL_FILE so they survive a restart,
+# set it to None to keep them in memory only.
+OUTBOX_SIZE = 500
+OUTBOX_REPLAY_RATE = 10 # Messages per second
+OUTBOX_POLICIES = {}
+OUTBOX_SPILL_FILE = 'drs_outbox.jsonl'
+
+# Decode the CarData.z telemetry of every car, publishing when the leader opens
+# or closes DRS (f1/race/drs) and every new top speed of the session (f1/race/top_speed)
+TELEMETRY = True
+
+# Decode the Position.z stream in races, publishing when P1 and P2 (f1/race/battle/lead)
+# or FOLLOW_DRIVER and the car ahead or behind (f1/race/battle/driver) are close on
+# track. A battle starts once the cars are within BATTLE_START_DISTANCE metres for
+# BATTLE_FRAMES frames in a row and ends once they're over BATTLE_END_DISTANCE apart
+# for as long.
+BATTLES = True
+BATTLE_START_DISTANCE = 50 # Metres
+BATTLE_END_DISTANCE = 90 # Metres
+BATTLE_FRAMES = 3
+
+# Racing number of "my driver": its position, gap and interval are published on
+# f1/race/driver whenever its position changes. None to turn it off.
+FOLLOW_DRIVER = None
+
+# Keep an index of the cache file next to it (CACHE_FILENAME + '.idx'), mapping
+# session starts, status changes, laps and timestamps to byte offsets so tools
+# (and --catch-up) can go straight to a session instead of reading the whole file.
+CACHE_INDEX = True
@@ -1,7 +1,6 @@
-import time
 import logging
 import argparse
-from datetime import timedelta, datetime
+import asyncio
 import json
 import queue
 from pathlib import Path
@@ -9,9 +8,19 @@ from pathlib import Path
 import config
 import mqtt_config
 from src.drs.session_state import SessionState
+from src.drs.cache_index import CacheIndex
+from src.drs.cache_tailer import CacheTailer
+from src.drs.latency import LatencyTracker
+from src.drs.outbox import Outbox
+from src.drs.profiler import Profiler
+from src.drs.proximity import BattleDetector
+from src.drs.snapshot import Snapshotter
+from src.drs.telemetry import CarTelemetry
+from src.drs.catch_up import catch_up
 import src.drs.f1_utils as f1_utils
-from src.drs.mqtt_handler import MQTTHandler
+from src.drs.mqtt_handler import MQTTHandler, PublishSink
 from src.drs.mqtt_topics import MqttTopics
+from src.drs.async_service import run_service
 
 DRS_VERSION = "0.6.1"
 
@@ -42,6 +51,21 @@ parser.add_argument(
     default=None,
     help="(Optional) Force an initial leader state on startup. E.g., --force-leader Ferrari",
 )
+parser.add_argument(
+    '--asyncio',
+    action='store_true',
+    help="(Optional) Run the service on a single asyncio event loop instead of the threaded main loop",
+)
+parser.add_argument(
+    '--fresh',
+    action='store_true',
+    help="(Optional) Start with a clean state, ignoring the snapshot of an earlier run",
+)
+parser.add_argument(
+    '--catch-up',
+    action='store_true',
+    help="(Optional) Rebuild the state from what's already in the cache file instead of starting at its end",
+)
 
 args = parser.parse_args()
 
@@ -65,6 +89,13 @@ def load_drs_data(filename : str = "drs_data.json") -> dict:
         logging.error(f"Could not decode JSON from {data_path}. Check for syntax errors: {e}")
         return {}
 
+def force_lead(session_state: SessionState, mqtt: MQTTHandler, team: str) -> None:
+    """Sets and immediately publishes a forced leader (--force-lead)"""
+    logging.info(f"Setting initial leading team as {team}")
+    session_state.set_session_lead(driver='FORCE', driver_number='0', team=team)
+    forced_lead_payload = json.dumps({"driver": "FORCE", "drivcer_number": "0","team": team})
+    mqtt.queue_message(MqttTopics.LEADER_TOPIC, forced_lead_payload, immediate=True, force=True)
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -73,72 +104,102 @@ if __name__ == "__main__":
         logging.error("Could not load DRS data. Exiting.")
         exit(1)
 
-    session_state = SessionState(session_type=normalized_session, teams_data=drs_data.get("teams", {}), drivers_data=drs_data.get("drivers", {}))
+    session_state = SessionState(session_type=normalized_session, teams_data=drs_data.get("teams", {}), drivers_data=drs_data.get("drivers", {}),
+                                 followed_driver=config.FOLLOW_DRIVER)
 
-    if session_state.session_type == 'race':
-        race_lead_process = f1_utils.process_race_lead_line
-    else:
-        race_lead_process = f1_utils.process_lap_time_line
+    latency = LatencyTracker(window=config.LATENCY_WINDOW, report_interval=config.LATENCY_REPORT_INTERVAL) if config.LATENCY_WINDOW else None
+    profiler = Profiler(output_dir=config.PROFILE_DIR)
+    telemetry = CarTelemetry() if config.TELEMETRY else None
+    battles = BattleDetector(config.BATTLE_START_DISTANCE, config.BATTLE_END_DISTANCE, config.BATTLE_FRAMES) if config.BATTLES else None
+    line_router = f1_utils.create_line_router(session_state.session_type, latency, profiler, telemetry, battles)
 
-    command_queue = queue.Queue()
-
-    mqtt = MQTTHandler(
+    mqtt_settings = dict(
         broker_ip=mqtt_config.MQTT_BROKER_IP,
         port=mqtt_config.MQTT_PORT,
         username=mqtt_config.MQTT_USERNAME,
         password=mqtt_config.MQTT_PASSWORD,
         delay=config.PUBLISH_DELAY,
-        command_queue=command_queue,
+        coalesce_topics=config.COALESCE_TOPICS,
+        coalesce_window=config.COALESCE_WINDOW,
+        latency=latency,
+        profiler=profiler,
+        sinks=[PublishSink(**sink) for sink in config.PUBLISH_SINKS],
+        outbox=Outbox(max_messages=config.OUTBOX_SIZE, spill_path=config.OUTBOX_SPILL_FILE, replay_rate=config.OUTBOX_REPLAY_RATE,
+                      policies=config.OUTBOX_POLICIES),
     )
 
-    if args.force_lead:
-        logging.info(f"Setting initial leading team as {args.force_lead}")
-        session_state.set_session_lead(driver='FORCE', driver_number='0', team=args.force_lead)
-        forced_lead_payload = json.dumps({"driver": "FORCE", "drivcer_number": "0","team": args.force_lead})
-        mqtt.queue_message(MqttTopics.LEADER_TOPIC, forced_lead_payload, immediate=True)
+    snapshots = Snapshotter(config.SNAPSHOT_FILENAME, interval=config.SNAPSHOT_INTERVAL, min_interval=config.SNAPSHOT_MIN_INTERVAL,
+                            max_age=config.SNAPSHOT_MAX_AGE)
+    snapshot = None if args.fresh or args.catch_up else snapshots.load(session_state.session_type)
+    resume_from = snapshot and snapshot['position']
+
+    cache_index = CacheIndex(config.CACHE_FILENAME) if config.CACHE_INDEX else None
+    caught_up = None
+    if args.catch_up:
+        try:
+            caught_up = catch_up(config.CACHE_FILENAME, session_state, index=cache_index)
+            resume_from = caught_up.position
+        except FileNotFoundError:
+            logging.warning(f"No cache file at '{config.CACHE_FILENAME}' to catch up from")
+
+    def on_connected(mqtt: MQTTHandler) -> None:
+        if snapshot:
+            snapshots.restore(snapshot, session_state, mqtt)
+        if caught_up:
+            for topic, payload in caught_up.latest.items():
+                mqtt.queue_message(topic, payload, immediate=True)
+        if args.force_lead:
+            force_lead(session_state, mqtt, args.force_lead)
+
+    if args.asyncio:
+        logging.info(f"DRS {DRS_VERSION} started {session_state.session_type} session.")
+        try:
+            asyncio.run(run_service(session_state, line_router, config.CACHE_FILENAME, mqtt_settings, on_connected,
+                                    snapshots=snapshots, resume_from=resume_from, cache_index=cache_index))
+        except KeyboardInterrupt:
+            logging.info("Service stopped by user.")
+        except FileNotFoundError:
+            logging.error(f"[FATAL] Data file not found: {config.CACHE_FILENAME}")
+        exit(0)
+
+    command_queue = queue.Queue()
+    tailer = CacheTailer(config.CACHE_FILENAME, resume_from=resume_from, index=cache_index)
+
+    mqtt = MQTTHandler(command_queue=command_queue, command_notify=tailer.wake, **mqtt_settings)
+    on_connected(mqtt)
 
     try:
         cache_file = config.CACHE_FILENAME
-        with open(cache_file, 'r', encoding='utf-8', errors='replace') as f:
+        with tailer:
             logging.info(f"DRS {DRS_VERSION} started {session_state.session_type} session. Reading live data from '{cache_file}'...")
-            f.seek(0, 2)
-            while True:
-            # Try block to look for user input delay from HA-
-                try:
-                    command = command_queue.get_nowait()
-                    if command == "CALIBRATE_START":
-
-                        # Ignore calibration after time limit as to avoid any "accidental presses"
-                        if session_state.true_session_start_time and (time.monotonic() - session_state.true_session_start_time) > 300:
-                            continue
-
-                        if session_state.true_session_start_time:
-                            new_delay = time.monotonic() - session_state.true_session_start_time
-                            mqtt.set_delay(new_delay)
-                            logging.info(f"received 'CALIBRATE_START' command from HA and set it to {new_delay}s")
-                except queue.Empty:
-                    pass
-
-                line = f.readline()
-                if not line:
-                    time.sleep(0.1)
-                else:
+            try:
+                while True:
+                # Try block to look for user input delay from HA-
                     try:
-                        f1_utils.process_session_data_line(line, session_state, mqtt)
-                        race_lead_process(line, session_state, mqtt)
-                        f1_utils.process_race_control_line(line, session_state, mqtt)
-                    except Exception as e:
-                        logging.error(f"Error processing line: {e}")
-
-                # Check if we're in qualifying, and that we're in-between sessions
-                if (session_state.session_type == 'qualifying' and 
-                    session_state.cooldown_active and 
-                    session_state.session_end_time and 
-                    session_state.quali_session != 'Q3'):
-                    if (time.monotonic() - session_state.session_end_time) > 180:
-                        logging.info("Resetting for next Qualifying session")
-                        session_state.reset_for_next_quali_segment()
-    
+                        command = command_queue.get_nowait()
+                        f1_utils.handle_command(command, session_state, mqtt)
+                    except queue.Empty:
+                        pass
+
+                    # Commands and the quali timer are checked once per batch, so a backlog is worked through in one go
+                    lines = tailer.read_batch()
+                    if not lines:
+                        # Sleeps until the cache is written to or a command arrives, but at least once a second for the quali timer
+                        tailer.wait(timeout=1.0)
+                    elif latency:
+                        latency.lines_read()
+                    for line in lines:
+                        try:
+                            line_router.dispatch(line, session_state, mqtt)
+                        except Exception as e:
+                            logging.error(f"Error processing line: {e}")
+
+                    # Check if we're in qualifying, and that we're in-between sessions
+                    f1_utils.check_quali_segment_reset(session_state)
+                    snapshots.maybe_save(session_state, mqtt, tailer)
+            finally:
+                snapshots.maybe_save(session_state, mqtt, tailer, force=True)
+
 
     except KeyboardInterrupt:
         logging.info("Service stopped by user.")
@@ -147,5 +208,6 @@ if __name__ == "__main__":
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
     finally:
+        logging.info(f"Lines skipped by category: {line_router.skip_counts}")
         mqtt.disconnect()
         logging.info("MQTT client disconnected.")
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""Async Service - Runs DRS on a single asyncio event loop
+
+Instead of the main loop, the paho network thread and the publisher thread, everything runs as callbacks and
+tasks on one event loop:
+    * The cache tailer wakes up on inotify (or polls when inotify is unavailable)
+    * The paho clients' sockets are driven by the event loop (no `loop_start()` threads), also for publish sinks with their own broker
+    * Delayed publishes are timers on the loop, re-armed whenever the queue or the delay changes
+    * The qualifying segment reset is a timer set when the chequered flag is seen
+    * Control commands from HA are handled as soon as they arrive
+
+`AsyncMQTTHandler` keeps the `MQTTHandler` API (queue_message, set_delay, disconnect...) so the f1_utils
+processors work unchanged.
+"""
+import asyncio
+import logging
+import queue
+from typing import Callable, Dict, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+from .cache_index import CacheIndex
+from .cache_tailer import CacheTailer
+from .line_router import LineRouter
+from .mqtt_handler import MQTTHandler
+from .session_state import SessionState
+from .snapshot import Snapshotter
+from . import f1_utils
+
+RECONNECT_DELAY = 5     # Seconds between reconnect attempts when the broker is gone
+
+
+class AsyncMQTTHandler(MQTTHandler):
+    """MQTTHandler whose network traffic and delayed publishing run on an asyncio event loop.
+    Must be created from within a running event loop."""
+
+    def __init__(self, *args, **kwargs):
+        self._loop = asyncio.get_running_loop()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._misc_tasks: Dict[mqtt.Client, asyncio.Task] = {}
+        super().__init__(*args, **kwargs)
+
+    def _hook_client(self, client: mqtt.Client) -> None:
+        """Hooks the paho socket into the event loop instead of starting paho's network thread"""
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _connect(self, broker_ip, port):
+        self._hook_client(self.client)
+        logging.info(f"Connecting to MQTT Broker at {broker_ip}...")
+        self.client.connect(broker_ip, port)
+        for name, client in self._sink_clients.items():
+            if client is not self.client:
+                self._connect_sink(name, client)
+
+    def _connect_sink(self, name: str, client: mqtt.Client) -> None:
+        self._hook_client(client)
+        sink = self.sinks[name]
+        logging.info(f"Connecting publish sink '{name}' to MQTT Broker at {sink.broker_ip}...")
+        try:
+            client.connect(sink.broker_ip, sink.port)
+        except OSError as e:
+            logging.error(f"Could not connect publish sink '{name}' to {sink.broker_ip}: {e}")
+
+    # --- paho socket callbacks ---
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+        self._misc_tasks[client] = self._loop.create_task(self._misc_loop(client))
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    async def _misc_loop(self, client: mqtt.Client):
+        """Keepalives and retries for paho, and reconnects if the broker goes away"""
+        while self._running:
+            if client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                logging.warning(f"MQTT connection lost, reconnecting in {RECONNECT_DELAY}s")
+                await asyncio.sleep(RECONNECT_DELAY)
+                try:
+                    client.reconnect()     # Opens a new socket, which starts a new misc loop
+                    return
+                except OSError as e:
+                    logging.warning(f"MQTT reconnect failed: {e}")
+                    continue
+            await asyncio.sleep(1)
+
+    # --- delayed publishing ---
+    def _schedule_changed(self):
+        # May be called from other threads, the timer itself is always handled on the loop
+        self._loop.call_soon_threadsafe(self._arm_timer)
+
+    def _arm_timer(self):
+        """(Re)arms the publish timer for the next due message, or the next one to replay from the outbox"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._running:
+            return
+        with self._condition:
+            next_due = self._next_wake(self._clock())
+        if next_due is not None:
+            delay = max(0, (next_due - self._clock()) / 1e9)
+            self._timer = self._loop.call_later(delay, self._publish_due)
+
+    def _publish_due(self):
+        self._timer = None
+        self.publish_due()
+        self._arm_timer()
+
+    def disconnect(self):
+        """Gracefully Disconnect from MQTT"""
+        super().disconnect()
+        for client in self._clients():
+            try:
+                client.loop_write()     # Nothing drives the socket after this, flush the OFF status and DISCONNECT now
+            except OSError:
+                pass
+        if self._timer:
+            self._timer.cancel()
+        for task in self._misc_tasks.values():
+            task.cancel()
+
+
+async def _follow_cache(tailer: CacheTailer, on_lines: Callable[[list], None]) -> None:
+    """Reads the cache whenever it's written to and hands over each batch of lines"""
+    loop = asyncio.get_running_loop()
+    written = asyncio.Event()
+    fileno = tailer.event_fileno()
+    if fileno is not None:
+        def on_file_event():
+            if tailer.clear_events():   # Not for writes to the other files in the directory
+                written.set()
+        loop.add_reader(fileno, on_file_event)
+
+    try:
+        while True:
+            lines = tailer.read_batch()
+            if lines:
+                on_lines(lines)
+                await asyncio.sleep(0)  # Let timers and commands in between batches of a backlog
+                continue
+            if fileno is None:
+                await asyncio.sleep(tailer.poll_interval)
+            else:
+                await written.wait()
+                written.clear()
+    finally:
+        if fileno is not None:
+            loop.remove_reader(fileno)
+
+
+async def run_service(session_state: SessionState, line_router: LineRouter, cache_file: str, mqtt_settings: dict,
+                      on_connected: Optional[Callable[[MQTTHandler], None]] = None, snapshots: Optional[Snapshotter] = None,
+                      resume_from: Optional[Tuple[int, int]] = None, cache_index: Optional[CacheIndex] = None) -> None:
+    """Runs the service until cancelled. `mqtt_settings` are the MQTTHandler keyword arguments (broker_ip, port,
+    username, password, delay, coalescing...), `on_connected` is called once the handler exists (e.g. --force-lead).
+    With `snapshots` the state is saved after batches of lines that changed it and on shutdown, `resume_from` is the cache position to continue from.
+    `cache_index` is kept up to date with the lines read, if given."""
+    tailer: Optional[CacheTailer] = None
+    loop = asyncio.get_running_loop()
+    command_queue = queue.Queue()
+    command_arrived = asyncio.Event()
+    quali_timer: Optional[asyncio.TimerHandle] = None
+
+    mqtt_handler = AsyncMQTTHandler(command_queue=command_queue,
+                                    command_notify=lambda: loop.call_soon_threadsafe(command_arrived.set),
+                                    **mqtt_settings)
+    if on_connected:
+        on_connected(mqtt_handler)
+
+    def reset_quali_segment():
+        nonlocal quali_timer
+        quali_timer = None
+        f1_utils.check_quali_segment_reset(session_state)
+
+    def on_lines(lines):
+        nonlocal quali_timer
+        if line_router.latency:
+            line_router.latency.lines_read()
+        for line in lines:
+            try:
+                line_router.dispatch(line, session_state, mqtt_handler)
+            except Exception as e:
+                logging.error(f"Error processing line: {e}")
+
+        # A chequered flag in Q1/Q2 starts the countdown to the next segment
+        reset_time = f1_utils.quali_reset_time(session_state)
+        if reset_time is not None and quali_timer is None:
+            quali_timer = loop.call_later(max(0, reset_time - session_state.now()) + 0.001, reset_quali_segment)
+        if snapshots:
+            snapshots.maybe_save(session_state, mqtt_handler, tailer)
+
+    async def handle_commands():
+        while True:
+            await command_arrived.wait()
+            command_arrived.clear()
+            while True:
+                try:
+                    command = command_queue.get_nowait()
+                except queue.Empty:
+                    break
+                f1_utils.handle_command(command, session_state, mqtt_handler)
+
+    commands_task = loop.create_task(handle_commands())
+    try:
+        with CacheTailer(cache_file, resume_from=resume_from, index=cache_index) as tailer:
+            logging.info(f"Reading live data from '{cache_file}' on the asyncio runtime...")
+            try:
+                await _follow_cache(tailer, on_lines)
+            finally:
+                if snapshots:
+                    snapshots.maybe_save(session_state, mqtt_handler, tailer, force=True)
+    finally:
+        commands_task.cancel()
+        if quali_timer:
+            quali_timer.cancel()
+        logging.info(f"Lines skipped by category: {line_router.skip_counts}")
+        mqtt_handler.disconnect()
+        logging.info("MQTT client disconnected.")
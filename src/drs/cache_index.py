@@ -0,0 +1,258 @@
+"""Cache Index - Sidecar index of byte offsets into the livetiming cache file
+
+With `fastf1.livetiming save --append` one cache file holds the whole weekend, hundreds of MB over several
+sessions. The index (`<cache file>.idx`, next to it) maps the cache to byte offsets, so tools can seek straight
+to "the race" or "lap 40" instead of reading everything before it:
+    * a checkpoint (offset and feed timestamp of a line) every `spacing` bytes
+    * every session announced in `SessionInfo` (its name)
+    * every session status change from the `SessionData` `StatusSeries` (Started, Finished, Aborted...)
+    * every new lap and qualifying part from the `SessionData` `Series`
+
+The index file is JSON lines: a header with the inode of the cache it belongs to, then one
+`[offset, timestamp, kind, value]` entry per line, appended as the cache is read. Everything before the last
+checkpoint is known to be indexed, anything after it is indexed again after a restart.
+"""
+import bisect
+import json
+import logging
+import mmap
+import os
+from dataclasses import dataclass
+from typing import Any, List, Optional, Union
+
+from .line_parser import parse_line
+
+INDEX_VERSION = 1
+
+CHECKPOINT = 'checkpoint'
+SESSION = 'session'
+STATUS = 'status'
+LAP = 'lap'
+QUALIFYING_PART = 'part'
+
+# Categories whose lines end up in the index, found by searching the raw bytes instead of decoding every line
+_MARKERS = (b"['SessionInfo'", b"['SessionData'")
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    """A byte offset of a line in the cache, what's there and when it was written"""
+    offset: int
+    timestamp: Optional[str]
+    kind: str
+    value: Any = None
+
+
+def _line_timestamp(line: bytes) -> Optional[str]:
+    """The trailing 'timestamp'] of a raw line, without decoding the rest of it"""
+    end = line.rfind(b"'")
+    start = line.rfind(b"'", 0, end)
+    if start == -1 or not line[start + 1:start + 2].isdigit():
+        return None
+    return line[start + 1:end].decode('ascii', errors='replace')
+
+def _marker_entries(offset: int, line: bytes) -> List[IndexEntry]:
+    """The index entries for a SessionInfo or SessionData line"""
+    try:
+        category, payload, timestamp = parse_line(line.decode('utf-8', errors='replace'))
+    except (ValueError, SyntaxError, TypeError):
+        return []
+    if not isinstance(payload, dict):
+        return []
+
+    if category == 'SessionInfo':
+        name = payload.get('Name') or payload.get('Type')
+        return [IndexEntry(offset, timestamp, SESSION, name)] if name else []
+
+    entries = []
+    for status in (payload.get('StatusSeries') or {}).values():
+        if isinstance(status, dict) and status.get('SessionStatus'):
+            entries.append(IndexEntry(offset, timestamp, STATUS, status['SessionStatus']))
+    for series in (payload.get('Series') or {}).values():
+        if isinstance(series, dict):
+            if 'Lap' in series:
+                entries.append(IndexEntry(offset, timestamp, LAP, series['Lap']))
+            if 'QualifyingPart' in series:
+                entries.append(IndexEntry(offset, timestamp, QUALIFYING_PART, series['QualifyingPart']))
+    return entries
+
+
+class CacheIndex:
+    """Keeps the index file of a cache up to date, and answers where things are in the cache"""
+
+    def __init__(self, cache_path: str, index_path: Optional[str] = None, spacing: int = 1 << 18):
+        self.cache_path = cache_path
+        self.index_path = index_path or f"{cache_path}.idx"
+        self.spacing = spacing      # Bytes between checkpoints
+        self.entries: List[IndexEntry] = []
+        self.indexed_to = 0         # Offset up to which the cache is indexed
+
+        self._inode: Optional[int] = None
+        self._checkpoint_timestamps: List[str] = []
+        self._checkpoint_offsets: List[int] = []
+        self._last_checkpoint: Optional[int] = None
+        self._load()
+
+    # --- index file ---
+    def _load(self) -> None:
+        """Loads the index file if it belongs to the current cache file, starts a new one otherwise"""
+        try:
+            inode = os.stat(self.cache_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        entries = []
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('version') == INDEX_VERSION and header.get('inode') == inode and header.get('spacing') == self.spacing:
+                    entries = [IndexEntry(*json.loads(line)) for line in f if line.endswith('\n')]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f"Rebuilding unreadable cache index '{self.index_path}': {e}")
+            entries = []
+
+        # Only what's before the last checkpoint is known to be complete
+        checkpoints = [entry.offset for entry in entries if entry.kind == CHECKPOINT]
+        indexed_to = checkpoints[-1] if checkpoints else 0
+        if inode is not None and indexed_to > os.stat(self.cache_path).st_size:
+            entries, indexed_to = [], 0
+        kept = [entry for entry in entries if entry.offset < indexed_to or (entry.kind == CHECKPOINT and entry.offset == indexed_to)]
+        self._reset(inode)
+        self._add(kept, write=False)
+        self.indexed_to = indexed_to
+        self._last_checkpoint = indexed_to if checkpoints else None
+        self._rewrite()
+        if kept:
+            logging.info(f"Loaded cache index '{self.index_path}' up to byte {indexed_to}")
+
+    def _reset(self, inode: Optional[int]) -> None:
+        self._inode = inode
+        self.entries = []
+        self.indexed_to = 0
+        self._checkpoint_timestamps, self._checkpoint_offsets = [], []
+        self._last_checkpoint = None
+
+    def _rewrite(self) -> None:
+        """Writes the whole index file, header and entries"""
+        try:
+            with open(self.index_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'version': INDEX_VERSION, 'inode': self._inode, 'spacing': self.spacing}) + '\n')
+                f.writelines(json.dumps([entry.offset, entry.timestamp, entry.kind, entry.value]) + '\n' for entry in self.entries)
+        except OSError as e:
+            logging.warning(f"Could not write cache index '{self.index_path}': {e}")
+
+    def _add(self, entries: List[IndexEntry], write: bool = True) -> None:
+        entries.sort(key=lambda entry: entry.offset)
+        for entry in entries:
+            if entry.kind == CHECKPOINT and entry.timestamp:
+                self._checkpoint_timestamps.append(entry.timestamp)
+                self._checkpoint_offsets.append(entry.offset)
+        self.entries.extend(entries)
+        if write and entries:
+            try:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps([entry.offset, entry.timestamp, entry.kind, entry.value]) + '\n' for entry in entries)
+            except OSError as e:
+                logging.warning(f"Could not write cache index '{self.index_path}': {e}")
+
+    # --- indexing ---
+    def _scan(self, data: Union[bytes, mmap.mmap], start: int, end: int, base: int) -> List[IndexEntry]:
+        """Entries for the complete lines in data[start:end], which sits at byte `base` of the cache"""
+        entries = []
+        for marker in _MARKERS:
+            position = data.find(marker, start, end)
+            while position != -1:
+                line_end = data.find(b'\n', position, end)
+                line_end = end if line_end == -1 else line_end
+                if position == 0 or data[position - 1:position] == b'\n':
+                    entries.extend(_marker_entries(base + position, data[position:line_end]))
+                position = data.find(marker, line_end, end)
+
+        target = start if self._last_checkpoint is None else max(start, self._last_checkpoint + self.spacing - base)
+        while target < end:
+            if target == 0 or data[target - 1:target] == b'\n':
+                line_start = target
+            else:
+                newline = data.find(b'\n', target, end)
+                if newline == -1 or newline + 1 >= end:
+                    break
+                line_start = newline + 1
+            line_end = data.find(b'\n', line_start, end)
+            timestamp = _line_timestamp(data[line_start:end if line_end == -1 else line_end])
+            entries.append(IndexEntry(base + line_start, timestamp, CHECKPOINT))
+            self._last_checkpoint = base + line_start
+            target = line_start + self.spacing
+        return entries
+
+    def update(self, inode: int, offset: int, data: bytes) -> None:
+        """Indexes `data`, complete lines read from byte `offset` of the cache with inode `inode` (see CacheTailer)"""
+        if inode != self._inode or (offset < self.indexed_to and os.stat(self.cache_path).st_size < self.indexed_to):
+            logging.info(f"Cache file was replaced or truncated, rebuilding cache index '{self.index_path}'")
+            self._reset(inode)
+            self._rewrite()
+        elif offset < self.indexed_to:
+            # Re-reading lines that are already indexed, e.g. resuming from an older snapshot
+            if offset + len(data) <= self.indexed_to:
+                return
+            data, offset = data[self.indexed_to - offset:], self.indexed_to
+        if offset > self.indexed_to:
+            self.sync(until=offset)     # Catch up on whatever was written before the tailer started
+            if offset != self.indexed_to:
+                return
+        self._add(self._scan(data, 0, len(data), offset))
+        self.indexed_to = offset + len(data)
+
+    def sync(self, until: Optional[int] = None) -> None:
+        """Indexes the complete lines written to the cache since the last update, up to byte `until`"""
+        try:
+            with open(self.cache_path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                size = os.fstat(f.fileno()).st_size
+                if inode != self._inode or size < self.indexed_to:
+                    self._reset(inode)
+                    self._rewrite()
+                end = size if until is None else min(until, size)
+                if end <= self.indexed_to:
+                    return
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    end = data.rfind(b'\n', self.indexed_to, end) + 1
+                    if end <= self.indexed_to:
+                        return
+                    self._add(self._scan(data, self.indexed_to, end, 0))
+                    logging.info(f"Indexed '{self.cache_path}' up to byte {end}")
+                    self.indexed_to = end
+        except FileNotFoundError:
+            return
+
+    # --- lookups ---
+    def find(self, kind: str, value: Any = None, after: int = 0) -> Optional[IndexEntry]:
+        """The first entry of `kind` (with `value`, if given) at or after byte `after`"""
+        for entry in self.entries:
+            if entry.offset >= after and entry.kind == kind and (value is None or entry.value == value):
+                return entry
+        return None
+
+    def sessions(self) -> List[IndexEntry]:
+        """The sessions in the cache, in order"""
+        return [entry for entry in self.entries if entry.kind == SESSION]
+
+    def session_offset(self, name: Optional[str] = None) -> Optional[int]:
+        """Offset of the last session called `name` (case insensitive), of the last session at all without a name.
+        None if there's no such session"""
+        for entry in reversed(self.sessions()):
+            if name is None or str(entry.value).lower() == name.lower():
+                return entry.offset
+        return None
+
+    def lap_offset(self, lap: int, after: int = 0) -> Optional[int]:
+        """Offset where lap `lap` (or the first one after it) starts, looking from byte `after`"""
+        for entry in self.entries:
+            if entry.offset >= after and entry.kind == LAP and isinstance(entry.value, int) and entry.value >= lap:
+                return entry.offset
+        return None
+
+    def offset_at(self, timestamp: str) -> int:
+        """Offset of the last checkpoint at or before the ISO `timestamp`, reading on from it gets to the timestamp"""
+        position = bisect.bisect_right(self._checkpoint_timestamps, timestamp)
+        return self._checkpoint_offsets[position - 1] if position else 0
@@ -0,0 +1,228 @@
+"""Cache Tailer - Follows the livetiming cache file as the FastF1 client writes to it
+
+On Linux the tailer blocks on inotify and only wakes up when the cache file is written to, everywhere else
+(or if inotify is unavailable) it falls back to polling. It also notices when the file is truncated or
+replaced, which happens when the livetiming client is restarted, and starts reading the new file from the top.
+Every batch read can be handed to a `CacheIndex`, keeping the sidecar index of the cache up to date.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .cache_index import CacheIndex
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')   # wd, mask, cookie, len
+
+
+class _Inotify:
+    """Minimal ctypes wrapper around inotify, watching a directory for changes to one file name"""
+
+    def __init__(self, path: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # The directory is watched rather than the file, so a replaced or re-created file is noticed too
+        directory = os.path.dirname(os.path.abspath(path))
+        self.filename = os.fsencode(os.path.basename(path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def drain(self) -> bool:
+        """Reads all pending events, returns True if any of them were for the watched file"""
+        touched = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return touched
+            offset = 0
+            while offset < len(buffer):
+                _, _, _, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + name_length].rstrip(b'\0')
+                offset += name_length
+                if name == self.filename:
+                    touched = True
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class CacheTailer:
+    """Reads batches of complete lines appended to the cache file, and blocks until more are written"""
+
+    def __init__(self, path: str, poll_interval: float = 0.1, from_end: bool = True, chunk_size: int = 1 << 20,
+                 resume_from: Optional[Tuple[int, int]] = None, index: Optional[CacheIndex] = None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.from_end = from_end
+        self.resume_from = resume_from  # (inode, offset) of an earlier position() to continue from, if it's still the same file
+        self.index = index              # Index updated with every batch read, if any
+
+        self._file = None
+        self._inode: Optional[int] = None
+        self._partial = b''
+        self._inotify: Optional[_Inotify] = None
+        self._wake_event = threading.Event()
+        self._wake_read, self._wake_write = (None, None)
+
+    @property
+    def offset(self) -> int:
+        """Byte offset of the next line to be returned"""
+        return self._file.tell() - len(self._partial) if self._file else 0
+
+    @property
+    def position(self) -> Optional[Tuple[int, int]]:
+        """(inode, offset) of the next line to be returned, can be handed to a later tailer as `resume_from`"""
+        return (self._inode, self.offset) if self._file else None
+
+    def open(self) -> "CacheTailer":
+        """Opens the cache file, raises FileNotFoundError if it doesn't exist"""
+        if sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify(self.path)
+            except (OSError, AttributeError) as e:
+                logging.warning(f"inotify unavailable, polling '{self.path}' every {self.poll_interval}s instead: {e}")
+            else:
+                self._wake_read, self._wake_write = os.pipe()
+                os.set_blocking(self._wake_read, False)
+                os.set_blocking(self._wake_write, False)
+
+        self._open_file(seek_end=self.from_end)
+        if self.resume_from:
+            inode, offset = self.resume_from
+            if inode == self._inode and offset <= os.fstat(self._file.fileno()).st_size:
+                logging.info(f"Resuming '{self.path}' at byte {offset}")
+                self._file.seek(offset)
+            else:
+                logging.info(f"'{self.path}' is not the file to resume, {'reading from the end' if self.from_end else 'reading from the start'}")
+        return self
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+        if self._wake_read is not None:
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._wake_read, self._wake_write = (None, None)
+
+    def __enter__(self) -> "CacheTailer":
+        return self.open()
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _open_file(self, seek_end: bool) -> None:
+        self._file = open(self.path, 'rb', buffering=0)
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._partial = b''
+        if seek_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _check_rotation(self) -> bool:
+        """Reopens the file if it was replaced or truncated, returns True if the read position was reset"""
+        try:
+            path_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False    # Being replaced, keep the old file until the new one shows up
+
+        if path_stat.st_ino != self._inode:
+            logging.info(f"'{self.path}' was replaced, reading the new file from the start")
+            self._file.close()
+            self._open_file(seek_end=False)
+            return True
+        if path_stat.st_size < self._file.tell():
+            logging.info(f"'{self.path}' was truncated, reading from the start")
+            self._file.seek(0)
+            self._partial = b''
+            return True
+        return False
+
+    def read_batch(self) -> List[str]:
+        """Returns all complete lines written since the last call (up to `chunk_size` bytes), without newlines.
+        An unfinished line at the end of the file is held back until the writer completes it."""
+        chunk = self._file.read(self.chunk_size)
+        if not chunk:
+            if self._check_rotation():
+                return self.read_batch()
+            return []
+
+        data = self._partial + chunk if self._partial else chunk
+        end = data.rfind(b'\n')
+        if end == -1:
+            self._partial = data
+            return []
+        self._partial = data[end + 1:]
+        if self.index:
+            self.index.update(self._inode, self._file.tell() - len(data), data[:end + 1])
+        return data[:end].decode('utf-8', errors='replace').split('\n')
+
+    def event_fileno(self) -> Optional[int]:
+        """File descriptor that becomes readable when the cache is written to, None when polling.
+        For callers doing their own waiting (e.g. an asyncio event loop) instead of calling wait()"""
+        return self._inotify.fd if self._inotify else None
+
+    def clear_events(self) -> bool:
+        """Consumes the pending file events signalled on event_fileno(), returns True if any were for the cache file
+        (the directory also holds other files, e.g. the cache index and the snapshot)"""
+        return self._inotify.drain() if self._inotify else False
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Blocks until the file is written to, wake() is called or the timeout runs out"""
+        if self._inotify is None:
+            interval = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+            self._wake_event.wait(interval)
+            self._wake_event.clear()
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._inotify.fd, self._wake_read], [], [], remaining)
+            woken = self._wake_read in ready
+            if woken:
+                try:
+                    while os.read(self._wake_read, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            touched = self._inotify.fd in ready and self._inotify.drain()
+            # Writes to other files in the directory (the cache index, the snapshot...) keep waiting
+            if woken or touched or not ready:
+                return
+
+    def wake(self) -> None:
+        """Interrupts wait(), safe to call from other threads (e.g. the MQTT network thread)"""
+        if self._inotify is None:
+            self._wake_event.set()
+            return
+        try:
+            os.write(self._wake_write, b'\0')
+        except BlockingIOError:
+            pass    # Pipe is full, wait() is going to wake up anyway
@@ -0,0 +1,136 @@
+"""Catch Up - Rebuilds the session state from the cache already on disk, instead of starting blind at its end
+
+Only a tiny share of a cache matters for the state, so instead of decoding every line the memory mapped file is
+searched (in C, by `mmap.find`) for the few lines that do:
+    * every RaceControlMessages and SessionData line (flags, safety cars, session starts and ends)
+    * in races only the last TopThree line with a new leader, found scanning back from the end
+    * otherwise the TimingData lines holding a LastLapTime (the fastest lap decides the leader)
+    * the TimingData lines holding a Position, so the timing tower ends up with the latest position of every car
+
+With a `CacheIndex` only the current session is searched, a cache appended to all weekend also holds the earlier
+ones. Those lines are replayed in file order through the normal handlers on the feed's own time (see `replay`), with nothing
+published. Afterwards the latest leader, flag, top three and followed driver messages are handed back to be published once, and the service
+carries on tailing the cache from exactly where the scan stopped.
+"""
+import logging
+import mmap
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .cache_index import CacheIndex
+from .line_parser import parse_timestamp
+from .line_router import peek_timestamp
+from .mqtt_topics import MqttTopics
+from .replay import ReplayMQTTHandler, VirtualClock, replay_lines
+from .session_state import SessionState
+from . import f1_utils
+
+STATE_CATEGORIES = (b'RaceControlMessages', b'SessionData')
+RACE_LEADER_MARKER = b"{'Lines': {'0': {'RacingNumber'"
+LAP_TIME_MARKER = b"'LastLapTime': {'Value'"
+POSITION_MARKER = b"'Position': '"
+CATCH_UP_TOPICS = (MqttTopics.LEADER_TOPIC, MqttTopics.FLAG_TOPIC, MqttTopics.TOP_THREE_TOPIC, MqttTopics.DRIVER_TOPIC)
+
+
+@dataclass
+class CatchUpResult:
+    """What the catch up found"""
+    position: Tuple[int, int]                                   # (inode, offset) to carry on tailing the cache from
+    latest: Dict[str, str] = field(default_factory=dict)        # Latest payload per topic, to publish once
+    lines: int = 0                                              # Lines replayed
+    seconds: float = 0.0                                        # How long the catch up took
+
+
+def _line_at(data: mmap.mmap, position: int, end: int) -> Tuple[int, int]:
+    """(start, end) of the line containing `position`"""
+    start = data.rfind(b'\n', 0, position) + 1
+    line_end = data.find(b'\n', position, end)
+    return start, line_end if line_end != -1 else end
+
+def _find_lines(data: mmap.mmap, needle: bytes, category: bytes, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    """(offset, line) of every line of `category` containing `needle` between `start` and `end`, in file order"""
+    prefix = b"['" + category + b"'"
+    position = data.find(needle, start, end)
+    while position != -1:
+        line_start, line_end = _line_at(data, position, end)
+        if data[line_start:line_start + len(prefix)] == prefix:
+            yield line_start, data[line_start:line_end]
+        position = data.find(needle, line_end, end)
+
+def _find_last_line(data: mmap.mmap, needle: bytes, category: bytes, start: int, end: int) -> Optional[Tuple[int, bytes]]:
+    """(offset, line) of the last line of `category` containing `needle`, scanning back from `end` to `start`"""
+    prefix = b"['" + category + b"'"
+    position = data.rfind(needle, start, end)
+    while position != -1:
+        line_start, line_end = _line_at(data, position, end)
+        if data[line_start:line_start + len(prefix)] == prefix:
+            return line_start, data[line_start:line_end]
+        position = data.rfind(needle, start, line_start)
+    return None
+
+def select_lines(data: mmap.mmap, session_type: str, end: int, start: int = 0) -> List[str]:
+    """The lines between `start` and `end` that make up the session state, in file order"""
+    selected: Dict[int, bytes] = {}     # By offset, a TimingData line can hold both a lap time and a position
+    for category in STATE_CATEGORIES:
+        selected.update(_find_lines(data, b"['" + category + b"'", category, start, end))
+    if session_type == 'race':
+        leader_line = _find_last_line(data, RACE_LEADER_MARKER, b'TopThree', start, end)
+        if leader_line:
+            selected.update([leader_line])
+    else:
+        selected.update(_find_lines(data, LAP_TIME_MARKER, b'TimingData', start, end))
+    selected.update(_find_lines(data, POSITION_MARKER, b'TimingData', start, end))
+    return [selected[offset].decode('utf-8', errors='replace') for offset in sorted(selected)]
+
+
+def catch_up(cache_file: str, state: SessionState, index: Optional[CacheIndex] = None) -> CatchUpResult:
+    """Rebuilds `state` from the complete lines in the cache (of the current session, with an `index`), returns
+    where to carry on from and what to publish. Raises FileNotFoundError if there is no cache."""
+    started = time.perf_counter()
+    start = 0
+    if index:
+        index.sync()
+        start = index.session_offset() or 0
+    with open(cache_file, 'rb') as f:
+        inode = os.fstat(f.fileno()).st_ino
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return CatchUpResult(position=(inode, 0))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = data.rfind(b'\n', 0, size) + 1    # A line still being written is left for the tailer
+            lines = select_lines(data, state.session_type, end, start)
+
+    # Replay on the feed's time with a muted handler, so timers like the qualifying reset work out as they did live
+    clock = VirtualClock()
+    muted_handler = ReplayMQTTHandler(delay=0, clock=clock)
+    live_clock, state.clock = state.clock, clock.monotonic
+    try:
+        replay_lines(lines, state, f1_utils.create_line_router(state.session_type), muted_handler, clock)
+    finally:
+        state.clock = live_clock
+
+    # Times in the state are now on the feed's clock, move them to the live clock by matching the last feed
+    # timestamp up with the wall clock
+    last_timestamp = next((timestamp for line in reversed(lines) if (timestamp := peek_timestamp(line))), None)
+    if last_timestamp:
+        try:
+            feed_age = time.time() - parse_timestamp(last_timestamp)
+            shift = state.now() - feed_age - clock.monotonic()
+            if state.session_end_time is not None:
+                state.session_end_time += shift
+            if state.true_session_start_time is not None:
+                state.true_session_start_time += shift
+        except ValueError:
+            pass
+    f1_utils.check_quali_segment_reset(state)
+
+    result = CatchUpResult(position=(inode, end), lines=len(lines))
+    for _, topic, payload in muted_handler.published:
+        if topic in CATCH_UP_TOPICS:
+            result.latest[topic] = payload
+    result.seconds = time.perf_counter() - started
+    logging.info(f"Caught up on {(end - start) / 1e6:.1f}MB of cache in {result.seconds:.3f}s ({result.lines} lines replayed): "
+                 f"{state.race_state}, leader {state.current_session_lead.driver}")
+    return result
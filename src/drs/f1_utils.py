@@ -1,18 +1,29 @@
-from datetime import timedelta, datetime
+from datetime import datetime
+from functools import lru_cache
 import json
-import ast
-import time
 import logging
+from typing import Optional, Set
 
+from .latency import LatencyTracker
+from .line_router import LineRouter, LineHandler, decode_line, peek_category
 from .mqtt_handler import MQTTHandler
 from .mqtt_topics import MqttTopics
+from .profiler import Profiler
+from .publish_scheduler import MAIN_SINK
 from .session_state import SessionState
+from .proximity import BattleDetector
+from .telemetry import CarTelemetry
+
+# Ignore calibration this long after the session start, as to avoid any "accidental presses"
+CALIBRATION_WINDOW = 300    # Seconds
+# How long after the chequered flag in Q1/Q2 the state is reset for the next qualifying segment
+QUALI_RESET_DELAY = 180     # Seconds
 
 def rebroadcast_leader(state: SessionState, mqtt_handler: MQTTHandler) -> None:
-    """Resends the lead, usefull after flag or Safety Car events"""
+    """Resends the lead, usefull after flag or Safety Car events. Forced, as it's the same payload HA has to react to again"""
     if not state.current_session_lead.team: return #Early return if no leader has been set
     payload = json.dumps({"driver": state.current_session_lead.driver, "driver_number": state.current_session_lead.driver_number, "team": state.current_session_lead.team})
-    mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, payload)
+    mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, payload, force=True)
 
 def return_to_green(state: SessionState, mqtt_handler: MQTTHandler, payload_message: str) -> None:
     """Returns the session to GREEN flag status"""
@@ -22,68 +33,91 @@ def return_to_green(state: SessionState, mqtt_handler: MQTTHandler, payload_mess
     mqtt_handler.queue_message(MqttTopics.FLAG_TOPIC, payload)
     rebroadcast_leader(state, mqtt_handler)
 
-def parse_lap_time(time_str: str) -> timedelta | None:
-    """Converts a time string to a timedelta object"""
-    if not (isinstance(time_str, str) or ':' not in time_str):
+@lru_cache(maxsize=1024)
+def _parse_lap_time_ms(time_str: str) -> int | None:
+    *larger_parts, seconds_part = time_str.split(':')
+    if len(larger_parts) > 2:
         return None
-    try:
-        datetime_object = datetime.strptime(time_str, '%M:%S.%f')
-        return timedelta(
-            minutes = datetime_object.minute,
-            seconds = datetime_object.second,
-            microseconds = datetime_object.microsecond
-        )
-    except ValueError:
+    seconds, dot, fraction = seconds_part.partition('.')
+    if dot and not fraction:
         return None
 
-def process_lap_time_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
-    category, payload, _ = ast.literal_eval(line)
+    total_seconds = 0
+    for i, part in enumerate(larger_parts + [seconds]):
+        if not (part.isascii() and part.isdigit()):
+            return None
+        value = int(part)
+        if i > 0 and value >= 60:   # Minutes and seconds after a larger unit
+            return None
+        total_seconds = total_seconds * 60 + value
+
+    if fraction and not (fraction.isascii() and fraction.isdigit()):
+        return None
+    return total_seconds * 1000 + int(fraction[:3].ljust(3, '0') if fraction else 0)
 
-    if category == 'TimingData' and 'Lines' in payload:
+def parse_lap_time(time_str: str) -> int | None:
+    """Converts a lap time string ('SS.mmm', 'M:SS.mmm' or 'H:MM:SS.mmm') to integer milliseconds, None if it isn't one.
+    Digits past milliseconds are dropped."""
+    if not isinstance(time_str, str):
+        return None
+    return _parse_lap_time_ms(time_str)
+
+def handle_lap_time(payload: dict, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Handles a TimingData payload, looking for a new fastest lap (leader in practice and qualifying)"""
+    if 'Lines' in payload:
         for num, data in payload['Lines'].items():
             if 'LastLapTime' in data and isinstance(data['LastLapTime'], dict):
                 lap_time_str = data['LastLapTime'].get('Value')
                 if lap_time_str and (lap_time := parse_lap_time(lap_time_str)) and lap_time < state.fastest_lap_info.time:
-                    try:
-                        driver_info = state.drivers_data[num]
-                        driver_abbreviation = driver_info['abbreviation']
-                        team_key = driver_info['team_key']
-                        team_name = state.teams_data[team_key]['name']
-                    except KeyError:
-                        logging.warning(f"Could not find driver or team for {num}, setting unknown")
-                        driver_abbreviation = "UNK"
-                        team_name = "UNKNOWN"
-                    state.set_fastest_lap(lap_time, driver_abbreviation, team_name)
-                    state.set_session_lead(driver=driver_abbreviation, driver_number=num, team=team_name)
-                    payload = json.dumps({"driver": driver_abbreviation, "driver_number": num, "team": team_name})
-                    mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, payload)
+                    driver = state.driver(num)
+                    state.set_fastest_lap(lap_time, driver.abbreviation, driver.team)
+                    state.set_session_lead(driver=driver.abbreviation, driver_number=num, team=driver.team)
+                    mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, driver.leader_payload)
 
-def process_race_lead_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
-    category, payload, _ = ast.literal_eval(line)
-    if category == 'TopThree' and 'Lines' in payload and '0' in payload['Lines']:
+def handle_timing_data(payload: dict, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Handles a TimingData payload, merging it into the timing tower. Publishes the top three and the followed driver when their positions change"""
+    lines = payload.get('Lines')
+    if not isinstance(lines, dict):
+        return
+    publish_position_changes(state.timing_tower.apply(lines), state, mqtt_handler)
+
+def publish_position_changes(changed: Set[int], state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Publishes the top three and the followed driver if any of their positions changed car"""
+    if not changed:
+        return
+
+    if min(changed) <= 3:
+        top_three = [{"position": position, "driver": driver.abbreviation, "driver_number": driver.driver_number, "team": driver.team}
+                     for position, number in enumerate(state.timing_tower.top(3), start=1) if number is not None and (driver := state.driver(number))]
+        mqtt_handler.queue_message(MqttTopics.TOP_THREE_TOPIC, json.dumps(top_three))
+
+    followed = state.timing_tower.cars.get(state.followed_driver) if state.followed_driver else None
+    if followed is not None and followed.position in changed:
+        driver = state.driver(followed.number)
+        mqtt_handler.queue_message(MqttTopics.DRIVER_TOPIC, json.dumps({"driver": driver.abbreviation, "driver_number": driver.driver_number, "team": driver.team,
+                                                                        "position": followed.position, "gap_to_leader": followed.gap_to_leader, "interval": followed.interval}))
+
+def handle_race_lead(payload: dict, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Handles a TopThree payload, looking for a new race leader. Also seeds the timing tower with the top three
+    it hasn't had a Position patch for"""
+    if isinstance(payload.get('Lines'), dict):
+        changed = set()
+        for index, line in payload['Lines'].items():
+            if isinstance(line, dict) and line.get('RacingNumber') and str(index).isdigit():
+                changed.update(state.timing_tower.seed(int(index) + 1, line['RacingNumber']))
+        publish_position_changes(changed, state, mqtt_handler)
+
+    if 'Lines' in payload and '0' in payload['Lines']:
         p1_data = payload['Lines']['0']
         new_leader_num = p1_data.get('RacingNumber')
         if new_leader_num and new_leader_num != state.current_session_lead.driver_number:
-            # state['current_leader_num'] = new_leader_num
-            try:
-                driver_info = state.drivers_data[new_leader_num]
-                driver_abbreviation = driver_info['abbreviation']
-                team_key = driver_info['team_key']
-
-                team_name = state.teams_data[team_key]['name']
-            except KeyError:
-                logging.warning(f"Could not find driver or team for {new_leader_num}")
-                driver_abbreviation = "UNK"
-                team_name = "UNKNOWN"
-            state.set_session_lead(driver=driver_abbreviation, driver_number=new_leader_num, team=team_name)
-            payload = json.dumps({"driver": driver_abbreviation, "driver_number": new_leader_num, "team": team_name})
-            mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, payload)
+            driver = state.driver(new_leader_num)
+            state.set_session_lead(driver=driver.abbreviation, driver_number=new_leader_num, team=driver.team)
+            mqtt_handler.queue_message(MqttTopics.LEADER_TOPIC, driver.leader_payload)
 
-def process_race_control_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
-    """Evaluates Race Control Lines, these include Flags and Safety Cars"""
-    category, payload, _ = ast.literal_eval(line)
-
-    if category == 'RaceControlMessages' and 'Messages' in payload:
+def handle_race_control(payload: dict, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Evaluates Race Control payloads, these include Flags and Safety Cars"""
+    if 'Messages' in payload:
         for msg_data in payload.get('Messages', {}).values():
             if not isinstance(msg_data, dict): continue
 
@@ -119,7 +153,7 @@ def process_race_control_line(line: str, state: SessionState, mqtt_handler: MQTT
                 elif flag == 'CHEQUERED' and state.session_type == 'qualifying' and not state.cooldown_active:
                     logging.info(f'CHEQUERED Flag for {state.quali_session}')
                     state.set_cooldown_active(True)
-                    state.set_session_end_time(time.monotonic())
+                    state.set_session_end_time(state.now())
             ## --- SAFETY CAR ---
             elif msg_data['Category'] == 'SafetyCar':
                 if msg_data['Status'] == 'DEPLOYED' and state.race_state != "SAFETY CAR":
@@ -130,20 +164,90 @@ def process_race_control_line(line: str, state: SessionState, mqtt_handler: MQTT
                 elif msg_data['Status'] == 'ENDING' or msg_data['Status'] == 'IN THIS LAP':
                     return_to_green(state, mqtt_handler, "SAFETY CAR ENDING")
 
-def process_session_data_line(line:str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
-    """Processing the Session Data Lines, like session start and red flag restarts"""
-    try:
-        category, payload, _ = ast.literal_eval(line)
-    except (ValueError, SyntaxError):
+def handle_session_data(payload: dict, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Processing the Session Data payloads, like session start and red flag restarts"""
+    for series_data in payload.get('StatusSeries', {}).values():
+        if isinstance(series_data, dict) and series_data.get('SessionStatus') == 'Started':
+            if not state.true_session_start_time:
+                logging.info(f'Start detected from livefeed at {datetime.now()}')
+                state.set_true_session_start_time(state.now())
+                break
+            elif state.race_state == 'RED':
+                return_to_green(state, mqtt_handler, "GREEN FLAG, RED flag cleared")
+                break
+
+def _process_line(line: str, category: str, handler: LineHandler, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Decodes a single line and runs the handler if the line belongs to the category"""
+    if peek_category(line) not in (None, category):
         return
+    decoded = decode_line(line)
+    if decoded is None:
+        return
+    line_category, payload, _ = decoded
+    if line_category == category:
+        handler(payload, state, mqtt_handler)
+
+def process_lap_time_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Processes a single TimingData line, see handle_lap_time"""
+    _process_line(line, 'TimingData', handle_lap_time, state, mqtt_handler)
+
+def process_race_lead_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Processes a single TopThree line, see handle_race_lead"""
+    _process_line(line, 'TopThree', handle_race_lead, state, mqtt_handler)
+
+def process_race_control_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Processes a single RaceControlMessages line, see handle_race_control"""
+    _process_line(line, 'RaceControlMessages', handle_race_control, state, mqtt_handler)
+
+def process_session_data_line(line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Processes a single SessionData line, see handle_session_data"""
+    _process_line(line, 'SessionData', handle_session_data, state, mqtt_handler)
+
+def create_line_router(session_type: str, latency: Optional[LatencyTracker] = None, profiler: Optional[Profiler] = None,
+                       telemetry: Optional[CarTelemetry] = None, battles: Optional[BattleDetector] = None) -> LineRouter:
+    """Creates the line router with the handlers needed for the session type, CarData.z if `telemetry` is set
+    and Position.z in races if `battles` is set"""
+    router = LineRouter(latency, profiler)
+    router.register('SessionData', handle_session_data)
+    router.register('TimingData', handle_timing_data)
+    if session_type == 'race':
+        router.register('TopThree', handle_race_lead)
+    else:
+        router.register('TimingData', handle_lap_time)
+    router.register('RaceControlMessages', handle_race_control)
+    if telemetry is not None:
+        router.register('CarData.z', telemetry.handle_car_data)
+    if battles is not None and session_type == 'race':
+        router.register('Position.z', battles.handle_position)
+    return router
+
+def handle_command(command: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+    """Handles a control command put on the command queue by the MQTT handler (e.g. CALIBRATE_START,
+    or CALIBRATE_START:<sink> for a publish sink other than the main one)"""
+    command, _, sink = command.partition(':')
+    if command == "CALIBRATE_START":
+        if not state.true_session_start_time:
+            return
+        # Ignore calibration after time limit as to avoid any "accidental presses"
+        if (state.now() - state.true_session_start_time) > CALIBRATION_WINDOW:
+            return
+
+        new_delay = state.now() - state.true_session_start_time
+        mqtt_handler.set_delay(new_delay, sink or MAIN_SINK)
+        logging.info(f"received 'CALIBRATE_START' command from HA and set {sink or 'the'} delay to {new_delay}s")
+
+def quali_reset_time(state: SessionState) -> float | None:
+    """The monotonic time at which the state should reset for the next qualifying segment, None if no reset is pending"""
+    if (state.session_type == 'qualifying' and
+        state.cooldown_active and
+        state.session_end_time and
+        state.quali_session != 'Q3'):
+        return state.session_end_time + QUALI_RESET_DELAY
+    return None
 
-    if category == 'SessionData':
-        for series_data in payload.get('StatusSeries', {}).values():
-            if isinstance(series_data, dict) and series_data.get('SessionStatus') == 'Started':
-                if not state.true_session_start_time:
-                    logging.info(f'Start detected from livefeed at {datetime.now()}')
-                    state.set_true_session_start_time(time.monotonic())
-                    break
-                elif state.race_state == 'RED':
-                    return_to_green(state, mqtt_handler, "GREEN FLAG, RED flag cleared")
-                    break
+def check_quali_segment_reset(state: SessionState) -> None:
+    """Resets for the next qualifying segment once we're far enough past the chequered flag"""
+    reset_time = quali_reset_time(state)
+    if reset_time is not None and state.now() > reset_time:
+        logging.info("Resetting for next Qualifying session")
+        state.reset_for_next_quali_segment()
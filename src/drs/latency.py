@@ -0,0 +1,104 @@
+"""Latency - How far behind the feed each stage of the pipeline is
+
+Every handled line is traced against its own feed timestamp (UTC, the last element of the line) through the stages:
+    * read: the batch holding the line was read from the cache
+    * parse: the line was decoded
+    * handle: its handlers finished
+    * queue: an event from it was queued for publishing
+    * publish: the event was published, less the publish delay (so only the service's own overhead is left)
+
+Rolling p50/p95/p99 per stage are published on `MqttTopics.LATENCY_TOPIC` every `report_interval` seconds.
+The feed timestamps come from the livetiming client's clock, so a skewed system clock shows up as an offset on
+every stage, while jitter between stages is the service's own.
+"""
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from .line_parser import parse_timestamp
+
+STAGES = ('read', 'parse', 'handle', 'queue', 'publish')
+
+
+class LineTrace:
+    """The feed time of a line, carried by the events queued while handling it"""
+    __slots__ = ('feed_ns', 'immediate')
+
+    def __init__(self, feed_ns: int, immediate: bool = False):
+        self.feed_ns = feed_ns
+        self.immediate = immediate
+
+
+class LatencyTracker:
+    """Rolling latency samples per stage. Lines are traced from the main loop (or event loop),
+    publishes from the publisher thread."""
+
+    def __init__(self, window: int = 500, report_interval: float = 10.0, clock: Callable[[], int] = time.time_ns):
+        self.report_interval = report_interval
+        self.current: Optional[LineTrace] = None    # Trace of the line being handled right now
+        self._clock = clock      # Wall clock nanoseconds, compared against the UTC feed timestamps
+        self._read_ns: Optional[int] = None
+        self._samples: Dict[str, Deque[int]] = {stage: deque(maxlen=window) for stage in STAGES}
+        self._lock = threading.Lock()
+        self._next_report = time.monotonic() + report_interval
+
+    def _record(self, stage: str, feed_ns: int) -> None:
+        with self._lock:
+            self._samples[stage].append(self._clock() - feed_ns)
+
+    def lines_read(self) -> None:
+        """Marks a batch of lines as just read from the cache"""
+        self._read_ns = self._clock()
+
+    def start_line(self, timestamp: str) -> Optional[LineTrace]:
+        """Starts tracing a decoded line, recording its read and parse stages"""
+        try:
+            feed_ns = int(parse_timestamp(timestamp) * 1e9)
+        except (ValueError, TypeError):
+            self.current = None
+            return None
+        with self._lock:
+            if self._read_ns is not None:
+                self._samples['read'].append(self._read_ns - feed_ns)
+            self._samples['parse'].append(self._clock() - feed_ns)
+        self.current = LineTrace(feed_ns)
+        return self.current
+
+    def end_line(self) -> None:
+        """Records the handle stage of the current line, events queued after this are no longer traced"""
+        if self.current is not None:
+            self._record('handle', self.current.feed_ns)
+            self.current = None
+
+    def queued(self, immediate: bool) -> Optional[LineTrace]:
+        """Records the queue stage, returns the trace to publish the event with"""
+        if self.current is None:
+            return None
+        self._record('queue', self.current.feed_ns)
+        return LineTrace(self.current.feed_ns, immediate)
+
+    def published(self, trace: LineTrace, delay_ns: int) -> None:
+        """Records the publish stage of a traced event, `delay_ns` being the publish delay it waited for"""
+        self._record('publish', trace.feed_ns + (0 if trace.immediate else delay_ns))
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 in milliseconds and the number of samples, per stage"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        summary = {}
+        for stage, ordered in samples.items():
+            if not ordered:
+                continue
+            at = lambda share: round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] / 1e6, 1)
+            summary[stage] = {'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99), 'samples': len(ordered)}
+        return summary
+
+    def report(self) -> Optional[str]:
+        """The JSON report if one is due and there's anything to report, otherwise None"""
+        now = time.monotonic()
+        if now < self._next_report or not (summary := self.percentiles()):
+            return None
+        self._next_report = now + self.report_interval
+        return json.dumps(summary)
@@ -0,0 +1,47 @@
+"""Line Parser - Fast decoder for the Python-repr lines written by `fastf1.livetiming save`
+
+The livetiming client writes every message as `str([category, payload, timestamp])`, i.e. a Python literal
+using single quoted strings and True/False/None. For the lines we actually see this is JSON in all but quoting
+and the three keywords, so instead of building a full Python AST with `ast.literal_eval` the line is rewritten
+to JSON and handed to the C accelerated `json` decoder. Anything the rewrite can't guarantee to be exact
+(escapes, double quotes inside strings, tuples, nan/inf etc.) falls back to `ast.literal_eval`.
+"""
+import ast
+import calendar
+import json
+import time
+from functools import lru_cache
+from typing import Any
+
+_json_loads = json.loads
+
+def parse_line(line: str) -> Any:
+    """Parses a livetiming cache line, returning the same object as `ast.literal_eval` would"""
+    # A double quote or backslash means repr had to escape or switch quoting for some string,
+    # splitting on single quotes below would then no longer separate strings from structure.
+    if '"' in line or '\\' in line:
+        return ast.literal_eval(line)
+
+    # Even parts are outside of strings (structure, numbers and keywords), odd parts are string contents
+    parts = line.split("'")
+    if len(parts) % 2 == 0:
+        return ast.literal_eval(line)  # Unbalanced quotes, let literal_eval raise the proper error
+    for i in range(0, len(parts), 2):
+        part = parts[i]
+        if 'e' in part:  # Cheap check, True, False and None all contain an 'e'
+            parts[i] = part.replace('True', 'true').replace('False', 'false').replace('None', 'null')
+
+    try:
+        return _json_loads('"'.join(parts))
+    except ValueError:
+        return ast.literal_eval(line)
+
+
+@lru_cache(maxsize=256)
+def _parse_whole_seconds(timestamp: str) -> int:
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%dT%H:%M:%S'))
+
+def parse_timestamp(timestamp: str) -> float:
+    """Converts a feed timestamp (e.g. '2025-07-05T10:38:19.212Z') to UTC epoch seconds, raises ValueError if malformed"""
+    fraction = timestamp[19:].rstrip('Z')
+    return _parse_whole_seconds(timestamp[:19]) + (float(fraction) if fraction else 0.0)
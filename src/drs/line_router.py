@@ -0,0 +1,114 @@
+"""Line Router - Decodes each livetiming cache line once and dispatches it to the handlers for its category"""
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .latency import LatencyTracker
+from .line_parser import parse_line
+from .mqtt_handler import MQTTHandler
+from .profiler import Profiler
+from .session_state import SessionState
+
+# A handler receives the already decoded payload of a line
+LineHandler = Callable[[Any, SessionState, MQTTHandler], None]
+
+def decode_line(line: str) -> Optional[Tuple[str, Any, str]]:
+    """Decodes a cache line into (category, payload, timestamp), returns None if the line can't be decoded"""
+    try:
+        category, payload, timestamp = parse_line(line)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return None
+    if not isinstance(category, str):
+        return None
+    return category, payload, timestamp
+
+def peek_category(line: str) -> Optional[str]:
+    """Reads only the leading ['Category', token of a line without decoding the rest of it"""
+    if not line.startswith("['"):
+        return None
+    end = line.find("'", 2)
+    if end == -1:
+        return None
+    return line[2:end]
+
+def peek_timestamp(line: str) -> Optional[str]:
+    """Reads only the trailing 'timestamp'] token of a line without decoding the rest of it"""
+    end = line.rfind("'")
+    start = line.rfind("'", 0, end)
+    if start == -1 or not line[start + 1:start + 2].isdigit():
+        return None
+    return line[start + 1:end]
+
+class LineRouter:
+    """Maps livetiming categories (TimingData, RaceControlMessages etc.) to the handlers interested in them"""
+
+    def __init__(self, latency: Optional[LatencyTracker] = None, profiler: Optional[Profiler] = None):
+        self._handlers: Dict[str, List[LineHandler]] = {}
+        self._skip_counts: Counter = Counter()
+        self.latency = latency  # Traces the handled lines, if set (shared with the MQTTHandler)
+        self.profiler = profiler    # Times parsing and handlers while enabled, if set (shared with the MQTTHandler)
+
+    def register(self, category: str, handler: LineHandler) -> None:
+        """Registers a handler for a category, handlers run in the order they are registered"""
+        self._handlers.setdefault(category, []).append(handler)
+
+    def handles(self, category: str) -> bool:
+        """Whether any handler is registered for the category"""
+        return category in self._handlers
+
+    @property
+    def skip_counts(self) -> Dict[str, int]:
+        """Number of lines dropped by the category prefilter, per category"""
+        return dict(self._skip_counts)
+
+    def dispatch(self, line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Decodes the line once and runs only the handlers registered for its category.
+        Lines of categories without handlers are dropped before the (expensive) decode."""
+        category = peek_category(line)
+        if category is not None and category not in self._handlers:
+            self._skip_counts[category] += 1
+            return
+
+        if self.profiler is not None and self.profiler.enabled:
+            self._dispatch_profiled(line, state, mqtt_handler)
+            return
+
+        decoded = decode_line(line)
+        if decoded is None:
+            return
+
+        category, payload, timestamp = decoded
+        handlers = self._handlers.get(category, ())
+        if self.latency is None or not handlers:
+            for handler in handlers:
+                handler(payload, state, mqtt_handler)
+            return
+
+        self.latency.start_line(timestamp)
+        try:
+            for handler in handlers:
+                handler(payload, state, mqtt_handler)
+        finally:
+            self.latency.end_line()
+
+    def _dispatch_profiled(self, line: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """dispatch(), timing the decode and each handler"""
+        start = time.perf_counter_ns()
+        decoded = decode_line(line)
+        if decoded is None:
+            self.profiler.record(peek_category(line) or '?', 'parse', time.perf_counter_ns() - start)
+            return
+
+        category, payload, timestamp = decoded
+        self.profiler.record(category, 'parse', time.perf_counter_ns() - start)
+        handlers = self._handlers.get(category, ())
+        if self.latency is not None and handlers:
+            self.latency.start_line(timestamp)
+        try:
+            for handler in handlers:
+                start = time.perf_counter_ns()
+                handler(payload, state, mqtt_handler)
+                self.profiler.record(category, getattr(handler, '__name__', repr(handler)), time.perf_counter_ns() - start)
+        finally:
+            if self.latency is not None and handlers:
+                self.latency.end_line()
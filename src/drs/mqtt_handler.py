@@ -1,107 +1,388 @@
-"""MQTT Handler - Handles publishing queue and background publishing to the Broker"""
+"""MQTT Handler - Handles publishing queue and background publishing to the Broker
+
+Every queued event is published to the main sink (the broker from mqtt_config.py with the configured delay) and
+to any extra `PublishSink`, one per screen that shows the session with a different broadcast lag. Each sink has
+its own delay, calibrated through its own control topic (`f1/service/control/<sink name>`), and publishes either
+to its own broker or to the main one under a topic prefix. All sinks share one publish queue and one publisher.
+
+Messages due for a sink whose broker is unreachable go to the `Outbox` instead of paho's queue, and are replayed
+in order (rate limited) once it's back.
+
+Every topic is published retained, so a message identical to the last one published on its topic (per sink) is
+skipped, the broker already holds it. Messages queued with `force` are always published, for when HA has to be
+triggered again by the same payload.
+"""
 import paho.mqtt.client as mqtt
+import json
 import logging
 import threading
 import time
+from collections import Counter
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from queue import Queue
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
+from .latency import LatencyTracker
 from .mqtt_topics import MqttTopics
+from .outbox import Outbox
+from .profiler import Profiler
+from .publish_scheduler import MAIN_SINK, PublishScheduler
+
+
+def _to_ns(seconds: float) -> int:
+    """Converts seconds to integer nanoseconds, the unit of the publish scheduler"""
+    return int(seconds * 1_000_000_000)
+
+
+@dataclass
+class PublishSink:
+    """An extra screen to publish for, with its own delay. Without a broker_ip it publishes through the main
+    broker connection, so it needs a topic_prefix to keep its topics apart from the main ones"""
+    name: str
+    delay: float
+    broker_ip: Optional[str] = None
+    port: int = 1883
+    username: Optional[str] = None
+    password: Optional[str] = None
+    topic_prefix: str = ''      # Put in front of every topic, e.g. 'satellite/' publishes 'satellite/f1/race/leader'
 
 
 class MQTTHandler:
-    def __init__(self, broker_ip, port, username, password, delay, command_queue: Queue):
-        self.client = mqtt.Client(client_id="f1_data_service_publisher")
+    CLIENT_ID = "f1_data_service_publisher"
+
+    def __init__(self, broker_ip, port, username, password, delay, command_queue: Queue, command_notify: Optional[Callable[[], None]] = None,
+                 coalesce_topics: Iterable[str] = (), coalesce_window: float = 0.0, clock: Callable[[], int] = time.monotonic_ns,
+                 latency: Optional[LatencyTracker] = None, profiler: Optional[Profiler] = None, sinks: Iterable[PublishSink] = (),
+                 outbox: Optional[Outbox] = None):
+        self.client = mqtt.Client(client_id=self.CLIENT_ID)
         self.client.will_set(MqttTopics.RUNNING_STATUS_TOPIC, payload="OFF", qos=1, retain=True)
 
         self.client.username_pw_set(username, password)
         self.client.on_message = self._on_message
         self.command_queue = command_queue
+        self.command_notify = command_notify    # Called after a command is queued, e.g. to wake up the main loop
         self.client.on_connect = self._on_connect
-        
-        self.publish_delay = timedelta(seconds=delay)
-        self._pending_messages = []
-        self._lock = threading.Lock()
-        
+        self.client.on_disconnect = self._on_disconnect
+
+        self.sinks: Dict[str, PublishSink] = {MAIN_SINK: PublishSink(MAIN_SINK, delay, broker_ip, port, username, password)}
+        for sink in sinks:
+            if sink.name in self.sinks:
+                raise ValueError(f"There's more than one publish sink called '{sink.name}'")
+            if not sink.broker_ip and not sink.topic_prefix:
+                raise ValueError(f"Publish sink '{sink.name}' uses the main broker, so it needs a topic_prefix")
+            self.sinks[sink.name] = sink
+        self._sink_clients: Dict[str, mqtt.Client] = {name: self.client if name == MAIN_SINK or not sink.broker_ip else self._create_sink_client(sink)
+                                                      for name, sink in self.sinks.items()}
+
+        self._clock = clock     # Monotonic nanoseconds, injectable so e.g. a replay can run faster than real time
+        self.latency = latency  # Traces events from their line to the publish, if set (shared with the LineRouter)
+        self.profiler = profiler    # Switched on and off with PROFILE commands, if set (shared with the LineRouter)
+        self._pending_messages = PublishScheduler(delay_ns=_to_ns(delay), coalesce_topics=coalesce_topics, coalesce_window_ns=_to_ns(coalesce_window),
+                                                  sinks=self.sinks)
+        for name, sink in self.sinks.items():
+            self._pending_messages.delays[name] = _to_ns(sink.delay)
+        self.outbox = outbox if outbox is not None else Outbox()    # Messages held while a broker is unreachable
+        self.outbox.keep_sinks(self.sinks)     # A spill file from a run with other sinks may hold messages for sinks that are gone
+        self._last_published: Dict[Tuple[str, str], Tuple[int, bool]] = {}     # (sink, topic) -> (payload hash, retained) of the last publish
+        self.unchanged_counts: Counter = Counter()  # Publishes skipped because the broker already retained the same payload, per topic
+        self._condition = threading.Condition()     # Guards _pending_messages, the outbox and _last_published, notified on new messages, delay changes and reconnects
+        self._running = True
+
+        self._connect(broker_ip, port)
+
+    def _create_sink_client(self, sink: PublishSink) -> mqtt.Client:
+        """The client of a sink with its own broker"""
+        client = mqtt.Client(client_id=f"{self.CLIENT_ID}_{sink.name}")
+        client.will_set(self._sink_topic(sink.name, MqttTopics.RUNNING_STATUS_TOPIC), payload="OFF", qos=1, retain=True)
+        client.username_pw_set(sink.username, sink.password)
+        client.on_message = self._on_message
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        return client
+
+    def _connect(self, broker_ip, port):
+        """Connects to the broker(s) and starts the network and publisher threads"""
         logging.info(f"Connecting to MQTT Broker at {broker_ip}...")
         self.client.connect(broker_ip, port)
         self.client.loop_start()
+        for name, client in self._sink_clients.items():
+            if client is not self.client:
+                self._connect_sink(name, client)
 
-        # Start the background publisher thread
+        # Start the background publisher thread, one for all sinks
         self.publisher_thread = threading.Thread(target=self._publisher_loop, daemon=True)
         self.publisher_thread.start()
 
+    def _connect_sink(self, name: str, client: mqtt.Client) -> None:
+        """Connects the client of a sink with its own broker"""
+        sink = self.sinks[name]
+        logging.info(f"Connecting publish sink '{name}' to MQTT Broker at {sink.broker_ip}...")
+        try:
+            client.connect(sink.broker_ip, sink.port)
+        except OSError as e:
+            logging.error(f"Could not connect publish sink '{name}' to {sink.broker_ip}: {e}")
+        client.loop_start()
+
+    def _schedule_changed(self):
+        """Called (with the lock held) whenever the pending messages or the delay change"""
+        self._condition.notify()
+
+    def _sink_topic(self, sink: str, topic: str) -> str:
+        return self.sinks[sink].topic_prefix + str(topic)
+
+    def _client_sinks(self, client) -> List[str]:
+        """The sinks publishing through `client`"""
+        client = client or self.client
+        return [name for name, sink_client in self._sink_clients.items() if sink_client is client]
+
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             client.subscribe(MqttTopics.CONTROL_TOPIC)
-            self.client.publish(MqttTopics.RUNNING_STATUS_TOPIC, payload="ON", qos=1, retain=True)
-            self.client.publish(MqttTopics.PUBLISHING_DELAY_TOPIC, payload=self.publish_delay.total_seconds(), qos=1, retain=True)
+            client.subscribe(f"{MqttTopics.CONTROL_TOPIC}/+")
+            for sink in self._client_sinks(client):
+                client.publish(self._sink_topic(sink, MqttTopics.RUNNING_STATUS_TOPIC), payload="ON", qos=1, retain=True)
+                client.publish(self._sink_topic(sink, MqttTopics.PUBLISHING_DELAY_TOPIC), payload=self.sink_delays[sink], qos=1, retain=True)
 
             logging.info("MQTT Connection Succseful!")
+            with self._condition:
+                # The broker may have lost its retained messages, everything gets published again
+                sinks = set(self._client_sinks(client))
+                self._last_published = {key: value for key, value in self._last_published.items() if key[0] not in sinks}
+                if self.outbox:
+                    logging.info(f"Replaying {len(self.outbox)} messages held in the outbox")
+                self._schedule_changed()    # Wakes the publisher for the outbox
         else:
             logging.error(f"Failed to connect to MQTT, return code {rc}")
 
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != 0 and self._running:
+            logging.warning(f"MQTT connection lost (return code {rc}), holding messages in the outbox until it's back")
+
+    def _sink_connected(self, sink: str) -> bool:
+        client = self._sink_clients.get(sink)
+        return client is not None and client.is_connected()
+
+    def _control_sink(self, client, topic: str) -> Optional[str]:
+        """The sink a control message is for: named by the subtopic, or the (first) sink of the client it came in on"""
+        if topic == MqttTopics.CONTROL_TOPIC:
+            return self._client_sinks(client)[0]
+        name = topic[len(MqttTopics.CONTROL_TOPIC) + 1:] if topic.startswith(f"{MqttTopics.CONTROL_TOPIC}/") else None
+        if name not in self.sinks:
+            if name is not None:
+                logging.warning(f"Ignoring command for unknown publish sink '{name}'")
+            return None
+        return name
+
     def _on_message(self, client, userdata, msg):
         """Handles incoming MQTT messages. Mainly for DRS CONTROL"""
         # logging.info(f"Received message on control topic: {msg.topic}")
-        if msg.topic != MqttTopics.CONTROL_TOPIC:
+        sink = self._control_sink(client, msg.topic)
+        if sink is None:
             return
         
         try:
             command = msg.payload.decode('utf-8')
 
             if command == "CALIBRATE_START":
-                self.command_queue.put("CALIBRATE_START")
+                self.command_queue.put("CALIBRATE_START" if sink == MAIN_SINK else f"CALIBRATE_START:{sink}")
+                if self.command_notify:
+                    self.command_notify()
 
             elif command.startswith("ADJUST:"):
                 _, value_str = command.split(":")
                 adjustment = float(value_str)
-                current_delay_sec = self.publish_delay.total_seconds()
-                self.set_delay(current_delay_sec + adjustment)
+                current_delay_sec = self.sink_delays[sink]
+                self.set_delay(current_delay_sec + adjustment, sink)
+
+            elif command.startswith("PROFILE:"):
+                self._handle_profile_command(command)
 
         except Exception as e:
             logging.warning(f"Could not process command from paylod '{msg.payload}' : {e}")
 
-    def set_delay(self, new_delay_seconds: float):
+    def _handle_profile_command(self, command: str) -> None:
+        """PROFILE:ON, PROFILE:OFF (publishes the timings) or PROFILE:SAMPLE:<seconds>"""
+        if self.profiler is None:
+            logging.warning(f"Profiling is not available, ignoring '{command}'")
+            return
+
+        action = command.split(":")
+        if action[1] == "ON":
+            self.profiler.start()
+        elif action[1] == "OFF":
+            self._publish(MqttTopics.PROFILE_TOPIC, json.dumps(self.profiler.stop()))
+        elif action[1] == "SAMPLE":
+            self.profiler.start_sampling(float(action[2]))
+        else:
+            logging.warning(f"Unknown profiling command '{command}'")
+
+    @property
+    def publish_delay(self) -> timedelta:
+        """The delay between an event being queued and published"""
+        return timedelta(microseconds=self._pending_messages.delay_ns / 1_000)
+
+    @property
+    def sink_delays(self) -> Dict[str, float]:
+        """The publish delay in seconds per sink"""
+        return {sink: delay_ns / 1e9 for sink, delay_ns in self._pending_messages.delays.items()}
+
+    @property
+    def outbox_stats(self) -> Dict[str, object]:
+        """Depth of the outbox, and how many messages it held, replayed, dropped and superseded"""
+        with self._condition:
+            return self.outbox.stats()
+
+    @property
+    def coalesced_counts(self) -> Dict[str, int]:
+        """Messages dropped because a newer message for the same topic superseded them, per topic"""
+        with self._condition:
+            return dict(self._pending_messages.coalesced_counts)
+
+    def set_delay(self, new_delay_seconds: float, sink: str = MAIN_SINK):
+        """Sets the publish delay of a sink, also re-timing the messages already waiting in the queue"""
         if new_delay_seconds < 0:
             logging.warning(f'Received less than 0 new_delay_seconds: {new_delay_seconds}')
             new_delay_seconds = 0
 
-        logging.info(f'Setting delay to {new_delay_seconds}s')
-        self.publish_delay = timedelta(seconds=new_delay_seconds)
-        self.client.publish(MqttTopics.PUBLISHING_DELAY_TOPIC, payload=round(new_delay_seconds, 2), qos=1, retain=True)
+        logging.info(f'Setting delay to {new_delay_seconds}s' + ('' if sink == MAIN_SINK else f" for '{sink}'"))
+        with self._condition:
+            self._pending_messages.delays[sink] = _to_ns(new_delay_seconds)
+            self._schedule_changed()
+        self._sink_clients[sink].publish(self._sink_topic(sink, MqttTopics.PUBLISHING_DELAY_TOPIC), payload=round(new_delay_seconds, 2), qos=1, retain=True)
 
     def _publisher_loop(self):
+        """Sleeps until the next message is due (or a new message or delay change arrives), then publishes it"""
         while True:
-            messages_to_publish = []
-
-            with self._lock:
-                for i in range(len(self._pending_messages) - 1, -1, -1):
-                    publish_time, topic, payload = self._pending_messages[i]
-                    
-                    if datetime.now() >= publish_time:
-                        messages_to_publish.append((topic, payload))
-                        self._pending_messages.pop(i)
-
-            for topic, payload in messages_to_publish:
-                self.client.publish(topic, payload, retain=True)
-                logging.info(f"Published to {topic} : {payload}")
-
-            time.sleep(0.5)
-
-    def queue_message(self, topic: str, payload: str, immediate : bool = False) -> None:
-        """Adds a message to the Publishing Queue"""
-        if immediate:
-            publish_time = datetime.now()
-        else:
-            publish_time = datetime.now() + self.publish_delay
-        
-        with self._lock:
-            self._pending_messages.append((publish_time, topic, payload))
-        logging.info(f"Event queued for topic '{topic}' with payload '{payload}'. Will be sent at {publish_time.strftime('%H:%M:%S')}")
+            with self._condition:
+                while self._running:
+                    now = self._clock()
+                    next_due = self._next_wake(now)
+                    if next_due is not None and next_due <= now:
+                        break
+                    self._condition.wait(None if next_due is None else (next_due - now) / 1e9)
+                if not self._running:
+                    return
+
+            self.publish_due()
+
+    def _next_wake(self, now: int) -> Optional[int]:
+        """(With the lock held) When the next message is due, or the next held one can be replayed"""
+        next_due = self._pending_messages.next_due()
+        next_release = self.outbox.next_release(now, self._sink_connected) if self.outbox else None
+        if next_due is None or next_release is None:
+            return next_release if next_due is None else next_due
+        return min(next_due, next_release)
+
+    def publish_due(self) -> None:
+        """Publishes every pending message that is due by now, to every sink it's due for"""
+        self._replay_outbox()
+        with self._condition:
+            messages_to_publish = self._pending_messages.pop_due_messages(self._clock())
+            delay_ns = self._pending_messages.delay_ns
+        for sink, topic, payload, trace, force in messages_to_publish:
+            self._publish(topic, payload, sink, force)
+            if trace is not None:
+                self.latency.published(trace, delay_ns)
+
+        if self.latency and messages_to_publish and (report := self.latency.report()):
+            self._publish(MqttTopics.LATENCY_TOPIC, report)
+
+    def _replay_outbox(self) -> None:
+        """Publishes the held messages the replay rate allows by now, for sinks that are connected again"""
+        with self._condition:
+            if not self.outbox:
+                return
+            messages = self.outbox.take(self._clock(), self._sink_connected)
+        for sink, topic, payload in messages:
+            if not self._send(topic, payload, sink):
+                self._hold(topic, payload, sink)
+        if messages and not self.outbox:
+            logging.info(f"Outbox replayed: {self.outbox_stats}")
+            self._send(MqttTopics.OUTBOX_TOPIC, json.dumps(self.outbox_stats), MAIN_SINK)
+
+    def _hold(self, topic: str, payload: str, sink: str) -> None:
+        with self._condition:
+            if not self.outbox.put(sink, topic, payload):
+                logging.warning(f"Outbox is full, dropped message for '{topic}'")
+                return
+            logging.info(f"Holding message for '{topic}' in the outbox until the broker is back ({len(self.outbox)} held)")
+
+    def _send(self, topic: str, payload: str, sink: str, force: bool = False, retain: bool = True) -> bool:
+        """Hands a message to paho, unless it's the payload the broker already retains for the topic (and not `force`).
+        False if it was refused because the connection is gone"""
+        key = (sink, str(topic))
+        last_published = (hash(payload), retain)
+        with self._condition:   # Also cleared from the paho network thread on reconnect
+            unchanged = retain and not force and self._last_published.get(key) == last_published
+        if unchanged:
+            self.unchanged_counts[str(topic)] += 1
+            logging.debug("Skipped unchanged %s : %s", topic, payload)
+            return True
+
+        info = self._sink_clients[sink].publish(self._sink_topic(sink, topic) if sink != MAIN_SINK else topic, payload, retain=retain)
+        if getattr(info, 'rc', mqtt.MQTT_ERR_SUCCESS) in (mqtt.MQTT_ERR_NO_CONN, mqtt.MQTT_ERR_QUEUE_SIZE):
+            return False
+        with self._condition:
+            self._last_published[key] = last_published
+        logging.info("Published to %s : %s", topic, payload)
+        return True
+
+    def _publish(self, topic: str, payload: str, sink: str = MAIN_SINK, force: bool = False) -> None:
+        with self._condition:
+            held_back = self.outbox.holds(sink)     # Behind the messages already held for the sink, so they stay in order
+        if held_back or not self._sink_connected(sink) or not self._send(topic, payload, sink, force):
+            self._hold(topic, payload, sink)
+
+    def pending_messages(self) -> List[Tuple[int, str, str, bool, List[str]]]:
+        """(queued at, topic, payload, immediate, sinks still waiting for it) of the messages waiting to be published,
+        times are the handler's clock"""
+        with self._condition:
+            return self._pending_messages.pending()
+
+    def restore_pending_messages(self, messages: Iterable[Tuple[int, str, str, bool, Optional[List[str]]]]) -> None:
+        """Queues messages taken from pending_messages() (e.g. of a snapshot) as they were, only for the sinks that
+        were still waiting for them (every sink if None). Sinks that no longer exist are left out"""
+        with self._condition:
+            for queued_at, topic, payload, immediate, sinks in messages:
+                if sinks is not None:
+                    sinks = [sink for sink in sinks if sink in self.sinks]
+                    if not sinks:
+                        continue
+                self._pending_messages.push(queued_at, topic, payload, immediate=immediate, sinks=sinks)
+            self._schedule_changed()
+
+    def queue_message(self, topic: str, payload: str, immediate : bool = False, force: bool = False) -> None:
+        """Adds a message to the Publishing Queue. With `force` it's published even if the broker already retains the same payload"""
+        event_time = self._clock()
+        trace = self.latency.queued(immediate) if self.latency else None
+        with self._condition:
+            self._pending_messages.push(event_time, topic, payload, immediate=immediate, trace=trace, force=force)
+            self._schedule_changed()
+
+        # Wall clock time is only worked out for the log, and only if the log line is actually written
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            delay_ns = 0 if immediate else self._pending_messages.delay_ns
+            publish_time = datetime.now() + timedelta(microseconds=delay_ns / 1_000)
+            logging.info("Event queued for topic '%s' with payload '%s'. Will be sent at %s", topic, payload, publish_time.strftime('%H:%M:%S'))
 
     def disconnect(self):
         """Gracefully Disconnect from MQTT"""
-        self.client.publish(MqttTopics.RUNNING_STATUS_TOPIC, payload="OFF", qos=1, retain=True)
-        self.client.disconnect()
-        self.client.loop_stop()
\ No newline at end of file
+        with self._condition:
+            self._running = False
+            self._schedule_changed()
+        if self.coalesced_counts:
+            logging.info(f"Superseded messages dropped per topic: {self.coalesced_counts}")
+        if self.unchanged_counts:
+            logging.info(f"Unchanged retained messages skipped per topic: {dict(self.unchanged_counts)}")
+        if self.outbox.held:
+            logging.info(f"Outbox: {self.outbox_stats}")
+        for sink, client in self._sink_clients.items():
+            client.publish(self._sink_topic(sink, MqttTopics.RUNNING_STATUS_TOPIC), payload="OFF", qos=1, retain=True)
+        for client in self._clients():
+            client.disconnect()
+            client.loop_stop()
+
+    def _clients(self) -> List[mqtt.Client]:
+        """The main client and those of the sinks with their own broker"""
+        return [self.client] + [client for client in self._sink_clients.values() if client is not self.client]
\ No newline at end of file
@@ -10,9 +10,18 @@ class MqttTopics(str, Enum):
     ## Race related
     LEADER_TOPIC = "f1/race/leader"
     FLAG_TOPIC = "f1/race/flag_status"
+    DRS_TOPIC = "f1/race/drs"
+    TOP_THREE_TOPIC = "f1/race/top_three"
+    DRIVER_TOPIC = "f1/race/driver"
+    LEAD_BATTLE_TOPIC = "f1/race/battle/lead"
+    DRIVER_BATTLE_TOPIC = "f1/race/battle/driver"
+    TOP_SPEED_TOPIC = "f1/race/top_speed"
     ## Service related
     RUNNING_STATUS_TOPIC = "f1/service/running_status"
     PUBLISHING_DELAY_TOPIC = "f1/service/publishing_delay"
+    LATENCY_TOPIC = "f1/service/latency"
+    PROFILE_TOPIC = "f1/service/profile"
+    OUTBOX_TOPIC = "f1/service/outbox"
 
     # LISTENING
     CONTROL_TOPIC = "f1/service/control"
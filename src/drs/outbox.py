@@ -0,0 +1,184 @@
+"""Outbox - Holds the messages that couldn't be published while the broker was unreachable
+
+Instead of handing messages to paho while it's disconnected (where QoS 0 messages are lost and QoS 1 messages
+pile up in an unbounded queue), the MQTT handler puts them in the outbox and replays them in order once the
+broker is back, rate limited so a long outage doesn't hit the broker and HA with a burst.
+
+The outbox is bounded. What happens to a message depends on the policy of its topic:
+    * LATEST: only the newest message per topic (and sink) is kept, for retained state topics like the leader
+      and flag, where an older value is wrong anyway once there's a newer one. This is the default.
+    * DROP_OLDEST: every message is kept, when full the oldest message is dropped to make room
+    * DROP_NEWEST: every message is kept, when full new messages are refused
+
+With a spill file every message put in the outbox is also appended to it, so messages held during an outage
+survive a restart of DRS. The file is emptied whenever the outbox is.
+"""
+import itertools
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+LATEST = 'latest'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class Outbox:
+    """Messages waiting for their broker to come back, (sink, topic, payload) in the order they were held"""
+
+    def __init__(self, max_messages: int = 500, spill_path: Optional[str] = None, replay_rate: float = 10.0,
+                 policies: Optional[Dict[str, str]] = None, default_policy: str = LATEST, max_age: float = 1800.0):
+        self.max_messages = max_messages
+        self.spill_path = spill_path
+        self.replay_rate = replay_rate      # Messages per second replayed after a reconnect
+        self.policies = {str(topic): policy for topic, policy in (policies or {}).items()}
+        self.default_policy = default_policy
+        self.max_age = max_age              # Spilled messages older than this (seconds) aren't loaded
+        self.dropped: Counter = Counter()       # Messages dropped because the outbox was full, per topic
+        self.superseded: Counter = Counter()    # Messages replaced by a newer one for a LATEST topic, per topic
+        self.replayed = 0                       # Messages taken out to be published again
+        self.held = 0                           # Messages put in the outbox
+
+        self._messages: OrderedDict = OrderedDict()     # key -> (sink, topic, payload), key is (sink, topic) for LATEST topics
+        self._per_sink: Counter = Counter()
+        self._sequence = itertools.count()
+        self._tokens = 1.0
+        self._last_refill_ns: Optional[int] = None
+        self._spilled_lines = 0
+        self._load_spill()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def holds(self, sink: str) -> bool:
+        """Whether there are messages waiting for `sink`, new messages for it have to queue up behind them"""
+        return self._per_sink[sink] > 0
+
+    def stats(self) -> Dict[str, object]:
+        """Queue depth and counters"""
+        return {'depth': len(self._messages), 'held': self.held, 'replayed': self.replayed,
+                'dropped': dict(self.dropped), 'superseded': dict(self.superseded)}
+
+    def keep_sinks(self, sinks: Iterable[str]) -> None:
+        """Drops the held messages for sinks other than `sinks`, e.g. loaded from the spill file of a run with other sinks"""
+        sinks = set(sinks)
+        unknown = Counter(sink for sink, _, _ in self._messages.values() if sink not in sinks)
+        if not unknown:
+            return
+        for key, (sink, _, _) in list(self._messages.items()):
+            if sink not in sinks:
+                del self._messages[key]
+        for sink in unknown:
+            del self._per_sink[sink]
+        self._compact_spill(force=True)
+        logging.warning(f"Dropped messages held in the outbox for unknown publish sinks: {dict(unknown)}")
+
+    # --- holding ---
+    def put(self, sink: str, topic: str, payload: str, spill: bool = True) -> bool:
+        """Holds a message, returns False if it was refused because the outbox is full"""
+        topic = str(topic)
+        policy = self.policies.get(topic, self.default_policy)
+        if policy == LATEST:
+            key = (sink, topic)
+            if key in self._messages:
+                del self._messages[key]
+                self._per_sink[sink] -= 1
+                self.superseded[topic] += 1
+        else:
+            key = (sink, topic, next(self._sequence))
+
+        if len(self._messages) >= self.max_messages:
+            if policy == DROP_NEWEST:
+                self.dropped[topic] += 1
+                return False
+            _, (oldest_sink, oldest_topic, _) = self._messages.popitem(last=False)
+            self._per_sink[oldest_sink] -= 1
+            self.dropped[oldest_topic] += 1
+
+        self._messages[key] = (sink, topic, payload)
+        self._per_sink[sink] += 1
+        self.held += 1
+        if spill:
+            self._spill([[time.time(), sink, topic, payload]])
+        return True
+
+    # --- replaying ---
+    def _refill(self, now_ns: int) -> None:
+        if self._last_refill_ns is not None:
+            self._tokens = min(1.0, self._tokens + (now_ns - self._last_refill_ns) / 1e9 * self.replay_rate)
+        self._last_refill_ns = now_ns
+
+    def next_release(self, now_ns: int, ready: Callable[[str], bool]) -> Optional[int]:
+        """When the next message can be taken, None if there's nothing for a sink that's `ready` (connected)"""
+        if not any(count and ready(sink) for sink, count in self._per_sink.items()):
+            return None
+        self._refill(now_ns)
+        return now_ns + max(0, int((1.0 - self._tokens) / self.replay_rate * 1e9))
+
+    def take(self, now_ns: int, ready: Callable[[str], bool]) -> List[Tuple[str, str, str]]:
+        """Removes and returns, oldest first, the messages for sinks that are `ready` the replay rate allows by now"""
+        self._refill(now_ns)
+        taken = []
+        ready_sinks = {sink: ready(sink) for sink, count in self._per_sink.items() if count}
+        for key, (sink, topic, payload) in list(self._messages.items()):
+            if self._tokens < 1.0:
+                break
+            if ready_sinks.get(sink):
+                del self._messages[key]
+                self._per_sink[sink] -= 1
+                self._tokens -= 1.0
+                taken.append((sink, topic, payload))
+        self.replayed += len(taken)
+        if taken:
+            self._compact_spill()
+        return taken
+
+    # --- spill file ---
+    def _spill(self, records: List[list]) -> None:
+        if not self.spill_path:
+            return
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(record) + '\n' for record in records)
+            self._spilled_lines += len(records)
+        except OSError as e:
+            logging.warning(f"Could not write outbox spill file '{self.spill_path}': {e}")
+
+    def _compact_spill(self, force: bool = False) -> None:
+        """Empties the spill file once the outbox is empty, rewrites it once it's mostly replayed or superseded lines (or when forced)"""
+        if not self.spill_path or not force and self._spilled_lines <= 2 * len(self._messages) + 64 and self._messages:
+            return
+        try:
+            with open(self.spill_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps([time.time(), sink, topic, payload]) + '\n' for sink, topic, payload in self._messages.values())
+            self._spilled_lines = len(self._messages)
+        except OSError as e:
+            logging.warning(f"Could not write outbox spill file '{self.spill_path}': {e}")
+
+    def _load_spill(self) -> None:
+        """Holds the messages of an earlier run that were still waiting"""
+        if not self.spill_path:
+            return
+        try:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.endswith('\n')]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable outbox spill file '{self.spill_path}': {e}")
+            records = []
+
+        oldest = time.time() - self.max_age
+        for record in records:
+            if isinstance(record, list) and len(record) == 4 and record[0] >= oldest:
+                self.put(*record[1:], spill=False)
+        self.held = 0
+        self._spilled_lines = len(records)
+        if self._messages:
+            self._compact_spill()
+            logging.info(f"Loaded {len(self._messages)} messages still waiting in the outbox from '{self.spill_path}'")
+        else:
+            os.remove(self.spill_path)
@@ -0,0 +1,115 @@
+"""Profiler - Timings and stack sampling that can be switched on while the service runs
+
+Controlled with commands on `MqttTopics.CONTROL_TOPIC`:
+    * PROFILE:ON            times the parse step and every handler, per category
+    * PROFILE:OFF           stops timing, the timings are logged and published on `MqttTopics.PROFILE_TOPIC`
+    * PROFILE:SAMPLE:<N>    samples the stacks of all threads for N seconds and writes them to a collapsed stack
+                            file (one `frame;frame;frame count` line per stack), for flamegraph.pl or speedscope
+
+With timing off the line router only checks `enabled`, sampling runs in its own thread and only while asked to.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SAMPLE_INTERVAL = 0.005     # Seconds between stack samples
+MAX_SAMPLE_SECONDS = 600    # Longest sampling run accepted from a command
+
+
+class Profiler:
+    """Per category timings of the line router, and an on demand sampling profiler"""
+
+    def __init__(self, output_dir: str = '.', sample_interval: float = SAMPLE_INTERVAL):
+        self.enabled = False        # Checked by the line router before timing anything
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self._timings: Dict[Tuple[str, str], List[int]] = {}   # (category, step) -> [count, total ns, max ns]
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    # --- timings ---
+    def start(self) -> None:
+        """Starts timing, clearing the timings of the previous run"""
+        with self._lock:
+            self._timings.clear()
+        self.enabled = True
+        logging.info("Profiling enabled")
+
+    def stop(self) -> Dict[str, Dict[str, dict]]:
+        """Stops timing and returns the timings"""
+        self.enabled = False
+        timings = self.timings()
+        logging.info(f"Profiling disabled, timings: {timings}")
+        return timings
+
+    def record(self, category: str, step: str, elapsed_ns: int) -> None:
+        """Adds one timing of a step (parse, or a handler's name) for a category"""
+        with self._lock:
+            timing = self._timings.get((category, step))
+            if timing is None:
+                self._timings[(category, step)] = [1, elapsed_ns, elapsed_ns]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed_ns
+                if elapsed_ns > timing[2]:
+                    timing[2] = elapsed_ns
+
+    def timings(self) -> Dict[str, Dict[str, dict]]:
+        """{category: {step: {count, total_ms, mean_us, max_us}}}"""
+        with self._lock:
+            timings = {key: list(value) for key, value in self._timings.items()}
+        summary: Dict[str, Dict[str, dict]] = {}
+        for (category, step), (count, total_ns, max_ns) in sorted(timings.items()):
+            summary.setdefault(category, {})[step] = {
+                'count': count,
+                'total_ms': round(total_ns / 1e6, 3),
+                'mean_us': round(total_ns / count / 1e3, 1),
+                'max_us': round(max_ns / 1e3, 1),
+            }
+        return summary
+
+    # --- stack sampling ---
+    @property
+    def sampling(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def start_sampling(self, seconds: float) -> Optional[str]:
+        """Samples all threads for `seconds` in the background, returns the file the stacks will be written to.
+        Returns None if a sampling run is already going."""
+        if self.sampling:
+            logging.warning("Stack sampling already running, ignoring")
+            return None
+        seconds = min(seconds, MAX_SAMPLE_SECONDS)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"drs-profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+        self._sampler = threading.Thread(target=self._sample, args=(seconds, path), name="drs-profiler", daemon=True)
+        self._sampler.start()
+        logging.info(f"Sampling stacks for {seconds}s into '{path}'")
+        return path
+
+    def _sample(self, seconds: float, path: str) -> None:
+        stacks: Counter = Counter()
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.sample_interval)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"Wrote {sum(stacks.values())} stack samples to '{path}'")
@@ -0,0 +1,150 @@
+"""Proximity - Decodes the Position.z stream into NumPy arrays and detects on-track battles
+
+Position.z lines hold base64 of raw deflated JSON, a couple of frames of the X/Y/Z coordinates (in 1/10 m) of every car:
+    {'Position': [{'Timestamp': ..., 'Entries': {'1': {'Status': 'OnTrack', 'X': ..., 'Y': ..., 'Z': ...}}}]}
+
+Every frame is loaded into a fixed (cars x 2) array, a row per racing number in `SessionState.drivers_data` (NaN for a
+car that's missing or off track), and the distances between all cars are worked out in one vectorised pass. Two
+battles are followed, with the pairs taken from the timing tower's running order (seeded from TopThree until the
+Position patches come in, see `timing_tower`):
+    * the lead battle, P1 and P2
+    * the battle of the followed driver (`SessionState.followed_driver`) with the closer of the cars just ahead and behind
+
+A battle starts once the cars have been within `start_distance` for `frames` frames in a row, and ends once they've been
+further apart than `end_distance` (or one of them is gone) for `frames` frames, so cars hovering around one distance
+don't make the lights flicker. Battles are only followed in green flag racing.
+"""
+import json
+import logging
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .mqtt_handler import MQTTHandler
+from .mqtt_topics import MqttTopics
+from .session_state import SessionState
+from .telemetry import decode_compressed
+
+COORDINATE_SCALE = 0.1  # Metres per coordinate unit
+
+
+class Battle:
+    """The state of one followed battle"""
+    __slots__ = ('topic', 'pair', 'active', 'streak', 'distance')
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.pair: Optional[Tuple[str, str]] = None     # Racing numbers, the car ahead first
+        self.active = False
+        self.streak = 0     # Frames in a row the battle looked like it started (or ended, if active)
+        self.distance = float('nan')    # Metres between the cars in the last frame
+
+
+class BattleDetector:
+    """Follows the lead battle and the followed driver's battle from Position.z lines (register handle_position on the router)"""
+
+    def __init__(self, start_distance: float = 50.0, end_distance: float = 90.0, frames: int = 3):
+        self.start_distance = start_distance    # Metres
+        self.end_distance = end_distance        # Metres, more than start_distance
+        self.frames = frames
+        self.numbers: List[str] = []            # Racing number of every row
+        self.slots: Dict[str, int] = {}         # Racing number -> row
+        self.positions = np.zeros((0, 2))       # X/Y in metres per car of the last frame, NaN if unknown
+        self.distances = np.zeros((0, 0))       # Metres between every two cars of the last frame
+        self.lead = Battle(MqttTopics.LEAD_BATTLE_TOPIC)
+        self.driver = Battle(MqttTopics.DRIVER_BATTLE_TOPIC)
+
+    def _build_slots(self, state: SessionState) -> None:
+        self.numbers = list(state.drivers_data)
+        self.slots = {number: slot for slot, number in enumerate(self.numbers)}
+        self.positions = np.full((len(self.numbers), 2), np.nan)
+
+    def handle_position(self, payload: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Handles a Position.z payload"""
+        if len(self.numbers) != len(state.drivers_data):
+            self._build_slots(state)
+        try:
+            frames = decode_compressed(payload)['Position']
+        except (ValueError, TypeError, KeyError, zlib.error) as e:
+            logging.debug(f"Could not decode Position.z payload: {e}")
+            return
+        for frame in frames or ():
+            if isinstance(frame, dict) and self.numbers:
+                self.update(self.load_frame(frame.get('Entries') or {}), state, mqtt_handler)
+
+    def load_frame(self, entries: Dict[str, dict]) -> np.ndarray:
+        """(cars x 2) X/Y in metres of the cars on track in a frame, NaN for the others"""
+        rows = [(self.slots[number], car.get('X'), car.get('Y')) for number, car in entries.items()
+                if number in self.slots and car.get('Status', 'OnTrack') == 'OnTrack']
+        positions = np.full((len(self.numbers), 2), np.nan)
+        if rows:
+            frame = np.array(rows, dtype=float)
+            positions[frame[:, 0].astype(int)] = frame[:, 1:] * COORDINATE_SCALE
+        return positions
+
+    def update(self, positions: np.ndarray, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Takes in the positions of a frame and starts or ends battles"""
+        self.positions = positions
+        difference = positions[:, None, :] - positions[None, :, :]
+        self.distances = np.hypot(difference[..., 0], difference[..., 1])
+
+        if state.race_state != 'GREEN' or state.cooldown_active or not state.true_session_start_time:
+            for battle in (self.lead, self.driver):
+                self._end(battle, state, mqtt_handler)
+            return
+
+        tower = state.timing_tower
+        self._follow(self.lead, tuple(tower.top(2)), state, mqtt_handler)
+        self._follow(self.driver, self._driver_pair(state), state, mqtt_handler)
+
+    def _driver_pair(self, state: SessionState) -> Optional[Tuple[str, str]]:
+        """The followed driver and the closer of the cars just ahead and behind them"""
+        car = state.timing_tower.cars.get(state.followed_driver) if state.followed_driver else None
+        if car is None or car.position is None or car.number not in self.slots:
+            return None
+        ahead, behind = state.timing_tower.at(car.position - 1), state.timing_tower.at(car.position + 1)
+        pairs = [(other.number, car.number) if other is ahead else (car.number, other.number)
+                 for other in (ahead, behind) if other is not None and other.number in self.slots]
+        return min(pairs, key=self._distance, default=None)
+
+    def _distance(self, pair: Optional[Tuple[Optional[str], Optional[str]]]) -> float:
+        """Metres between the cars of a pair, NaN if either is unknown"""
+        if not pair or pair[0] not in self.slots or pair[1] not in self.slots:
+            return float('nan')
+        return float(self.distances[self.slots[pair[0]], self.slots[pair[1]]])
+
+    def _follow(self, battle: Battle, pair: Optional[Tuple[str, str]], state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Moves a battle along by one frame"""
+        if pair is not None and None in pair:
+            pair = None
+        if (frozenset(pair) if pair else None) != (frozenset(battle.pair) if battle.pair else None):
+            self._end(battle, state, mqtt_handler)
+            battle.pair, battle.streak = pair, 0
+        if pair is None:
+            return
+        distance = battle.distance = self._distance(pair)
+        battle.pair = pair      # Keeps the order up to date if they swapped places
+        if not battle.active:
+            battle.streak = battle.streak + 1 if distance < self.start_distance else 0
+            if battle.streak >= self.frames:
+                battle.active, battle.streak = True, 0
+                self._publish(battle, state, mqtt_handler)
+        else:
+            battle.streak = battle.streak + 1 if not distance <= self.end_distance else 0     # NaN counts as apart
+            if battle.streak >= self.frames:
+                self._end(battle, state, mqtt_handler)
+
+    def _end(self, battle: Battle, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        if battle.active:
+            battle.active, battle.streak = False, 0
+            self._publish(battle, state, mqtt_handler)
+
+    def _publish(self, battle: Battle, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        drivers = [state.driver(number) for number in battle.pair]
+        logging.info(f"Battle {'started' if battle.active else 'ended'}: {drivers[0].abbreviation} - {drivers[1].abbreviation}")
+        mqtt_handler.queue_message(battle.topic, json.dumps({
+            "state": "ON" if battle.active else "OFF",
+            "drivers": [{"driver": driver.abbreviation, "driver_number": driver.driver_number, "team": driver.team} for driver in drivers],
+            "distance": None if np.isnan(battle.distance) else round(battle.distance, 1),
+        }))
@@ -0,0 +1,147 @@
+"""Publish Scheduler - Queue of messages waiting for their publish time, shared by every publish sink
+
+Messages are published to one or more sinks (screens watching the session with different broadcast lags), each
+with its own publish delay. Delayed messages are stored once, by the time their event happened rather than by
+when they should be published, in a list kept in event order. Every sink publishes them in that same order, so a
+sink only needs to remember how far down the list it got, and a new delay for a sink (calibration or an
+adjustment from HA) re-times its whole queue by changing a single number. A message is dropped once every sink
+has published it.
+
+Topics can be set to coalesce: when the next delayed message for the same topic is due within `coalesce_window_ns`
+of an older one, the older one is dropped instead of being published just before it is overwritten. This is meant for retained state topics like the leader, where only the latest value matters.
+
+The scheduler only keeps the order, it does no locking or sleeping itself. The owner (e.g. MQTTHandler)
+guards it with its own lock and sleeps until `next_due()`, whichever sink that is for.
+"""
+import bisect
+import heapq
+import itertools
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+MAIN_SINK = 'main'
+
+
+class PublishScheduler:
+    """Pending messages, all times are integer nanoseconds on a monotonic clock (time.monotonic_ns)"""
+
+    def __init__(self, delay_ns: int = 0, coalesce_topics: Iterable[str] = (), coalesce_window_ns: int = 0,
+                 sinks: Iterable[str] = (MAIN_SINK,)):
+        self.delays: Dict[str, int] = {sink: delay_ns for sink in sinks} or {MAIN_SINK: delay_ns}   # Publish delay per sink
+        self.main_sink = next(iter(self.delays))    # Gets the traces handed back, and is the sink `delay_ns` is about
+        self.coalesce_topics = {str(topic) for topic in coalesce_topics}
+        self.coalesce_window_ns = coalesce_window_ns
+        self.coalesced_counts: Counter = Counter()  # Messages dropped because a newer one superseded them, per topic (summed over sinks)
+        self._delayed: List[Tuple[int, int, str, str, Any, bool, Optional[FrozenSet[str]]]] = []  # (event time, sequence, topic, payload, trace, force, sinks), in that order
+        self._cursors: Dict[str, int] = {sink: 0 for sink in self.delays}  # Per sink, index in _delayed of its next message
+        self._pending_by_topic: Dict[str, List[Tuple[int, int]]] = {}    # (event time, sequence) of delayed messages per coalescing topic
+        self._immediate: List[Tuple[int, int, str, str, Any, bool, Optional[FrozenSet[str]]]] = []    # (due time, sequence, topic, payload, trace, force, sinks)
+        self._sequence = itertools.count()  # Keeps messages due at the same time in the order they were queued
+
+    def __len__(self) -> int:
+        return len(self._delayed) - min(self._cursors.values()) + len(self._immediate)
+
+    @property
+    def delay_ns(self) -> int:
+        """Publish delay of the main sink"""
+        return self.delays[self.main_sink]
+
+    @delay_ns.setter
+    def delay_ns(self, delay_ns: int) -> None:
+        self.delays[self.main_sink] = delay_ns
+
+    def push(self, event_time: int, topic: str, payload: str, immediate: bool = False, trace: Any = None, force: bool = False,
+             sinks: Optional[Iterable[str]] = None) -> None:
+        """Schedules a message for `event_time` + delay of every sink (or only `sinks`), or for `event_time` itself if immediate.
+        `trace` and `force` are handed back with the message by pop_due_messages(), the trace only to the main sink"""
+        sequence = next(self._sequence)
+        message = (event_time, sequence, topic, payload, trace, force, None if sinks is None else frozenset(sinks))
+        if immediate:
+            heapq.heappush(self._immediate, message)
+            return
+        # Events are nearly always queued in order, anything else (e.g. restoring a snapshot) is sorted in
+        if not self._delayed or self._delayed[-1][0] <= event_time:
+            self._delayed.append(message)
+        else:
+            index = bisect.bisect(self._delayed, message)
+            self._delayed.insert(index, message)
+            for sink, cursor in self._cursors.items():
+                if cursor > index:
+                    self._cursors[sink] = cursor + 1    # Sinks already past it don't go back for it
+        if str(topic) in self.coalesce_topics and sinks is None:    # A message for only some sinks can't supersede one for all
+            bisect.insort(self._pending_by_topic.setdefault(str(topic), []), (event_time, sequence))
+
+    def _is_superseded(self, sink: str, topic: str, key: Tuple[int, int], now: int) -> bool:
+        """True if the next message for the topic is due for `sink` within the coalesce window"""
+        pending = self._pending_by_topic[topic]
+        next_index = bisect.bisect_right(pending, key)
+        return next_index < len(pending) and pending[next_index][0] + self.delays[sink] <= now + self.coalesce_window_ns
+
+    def _next(self) -> Optional[Tuple[int, int, Optional[str]]]:
+        """(due time, sequence, sink) of the next message, the sink is None for an immediate message (due for every sink).
+        None if nothing is scheduled"""
+        best = (self._immediate[0][0], self._immediate[0][1], None) if self._immediate else None
+        for sink, cursor in self._cursors.items():
+            if cursor < len(self._delayed):
+                event_time, sequence = self._delayed[cursor][:2]
+                candidate = (event_time + self.delays[sink], sequence, sink)
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+        return best
+
+    def _forget_published(self) -> None:
+        """Drops the delayed messages every sink is done with. Only once there's a few of them, as every
+        drop moves the rest of the list"""
+        done = min(self._cursors.values())
+        if done > 64 or done * 2 >= len(self._delayed):
+            first_pending = self._delayed[done][:2] if done < len(self._delayed) else (float('inf'), 0)
+            del self._delayed[:done]
+            for sink in self._cursors:
+                self._cursors[sink] -= done
+            for pending in self._pending_by_topic.values():
+                del pending[:bisect.bisect_left(pending, first_pending)]
+
+    def next_due(self) -> Optional[int]:
+        """The due time of the next message, or None if nothing is scheduled"""
+        next_message = self._next()
+        return next_message[0] if next_message else None
+
+    def pending(self) -> List[Tuple[int, str, str, bool, List[str]]]:
+        """(event time or due time if immediate, topic, payload, immediate, sinks still waiting for it) of every message
+        still waiting for any sink, in queue order"""
+        messages = []
+        for index in range(min(self._cursors.values()), len(self._delayed)):
+            time, sequence, topic, payload, _, _, sinks = self._delayed[index]
+            waiting = [sink for sink, cursor in self._cursors.items() if cursor <= index and (sinks is None or sink in sinks)]
+            if waiting:
+                messages.append((sequence, time, topic, payload, False, waiting))
+        messages += [(sequence, time, topic, payload, True, [sink for sink in self.delays if sinks is None or sink in sinks])
+                     for time, sequence, topic, payload, _, _, sinks in self._immediate]
+        return [message[1:] for message in sorted(messages)]
+
+    def pop_due_messages(self, now: int) -> List[Tuple[str, str, str, Any, bool]]:
+        """Removes and returns (sink, topic, payload, trace, force) of every message due for a sink at or before `now`, oldest first.
+        An immediate message comes out once per sink, the trace only with the main sink's copy. Superseded messages on
+        coalescing topics are dropped"""
+        due_messages = []
+        popped_delayed = False
+        while (next_message := self._next()) and next_message[0] <= now:
+            sink = next_message[2]
+            if sink is None:
+                _, _, topic, payload, trace, force, sinks = heapq.heappop(self._immediate)
+                due_messages.extend((each, topic, payload, trace if each == self.main_sink else None, force) for each in self.delays
+                                    if sinks is None or each in sinks)
+                continue
+
+            event_time, sequence, topic, payload, trace, force, sinks = self._delayed[self._cursors[sink]]
+            self._cursors[sink] += 1
+            popped_delayed = True
+            if sinks is not None and sink not in sinks:
+                continue
+            if str(topic) in self.coalesce_topics and self._is_superseded(sink, str(topic), (event_time, sequence), now):
+                self.coalesced_counts[str(topic)] += 1
+                continue
+            due_messages.append((sink, topic, payload, trace if sink == self.main_sink else None, force))
+        if popped_delayed:
+            self._forget_published()
+        return due_messages
@@ -0,0 +1,148 @@
+"""Replay - Feeds a recorded livetiming cache through the real processors, in real time or faster
+
+Time during a replay comes from the feed's own timestamps: a `VirtualClock` is moved to the timestamp of every
+line, and both the session state and the MQTT publish queue run on that clock. With no throttling a full race
+replays as fast as the lines can be processed, while the publish delay, coalescing and qualifying timers behave
+as they would have live.
+"""
+import logging
+import time
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Iterable, List, Optional, Tuple
+
+from .line_parser import parse_timestamp
+from .line_router import LineRouter, peek_timestamp
+from .mqtt_handler import MQTTHandler
+from .publish_scheduler import MAIN_SINK
+from .session_state import SessionState
+from . import f1_utils
+
+
+class VirtualClock:
+    """Monotonic clock that only moves when told to, never goes backwards.
+    Starts at the real monotonic time, as the session state treats a time of 0 as not set."""
+
+    def __init__(self, start_ns: Optional[int] = None):
+        self._now_ns = time.monotonic_ns() if start_ns is None else start_ns
+
+    def monotonic_ns(self) -> int:
+        return self._now_ns
+
+    def monotonic(self) -> float:
+        return self._now_ns / 1e9
+
+    def advance_to(self, now_ns: int) -> None:
+        """Moves the clock forward to `now_ns`, earlier times (out of order feed lines) are ignored"""
+        if now_ns > self._now_ns:
+            self._now_ns = now_ns
+
+
+class ReplayMQTTHandler(MQTTHandler):
+    """MQTTHandler without background threads, messages are published when the replay calls publish_due().
+    Without a broker the published messages are only recorded."""
+    CLIENT_ID = "f1_data_service_replay"
+
+    def __init__(self, delay: float, clock: VirtualClock, broker_ip: Optional[str] = None, port: int = 1883,
+                 username: Optional[str] = None, password: Optional[str] = None, **kwargs):
+        self.published: List[Tuple[int, str, str]] = []     # (virtual time ns, topic, payload)
+        self._connected = bool(broker_ip)
+        super().__init__(broker_ip, port, username, password, delay, command_queue=Queue(), clock=clock.monotonic_ns, **kwargs)
+
+    def _connect(self, broker_ip, port):
+        if self._connected:
+            super()._connect(broker_ip, port)
+
+    def _publisher_loop(self):
+        pass    # Publishing is driven by the replay
+
+    def _schedule_changed(self):
+        pass
+
+    def next_due(self) -> Optional[int]:
+        """Virtual time the next queued message is due at, None if the queue is empty"""
+        with self._condition:
+            return self._pending_messages.next_due()
+
+    def _publish(self, topic: str, payload: str, sink: str = MAIN_SINK, force: bool = False) -> None:
+        self.published.append((self._clock(), self._sink_topic(sink, topic), payload))
+        if self._connected:
+            super()._publish(topic, payload, sink, force)
+        else:
+            logging.debug("Published to %s : %s", topic, payload)
+
+    def disconnect(self):
+        if self._connected:
+            super().disconnect()
+
+
+@dataclass
+class ReplayStats:
+    """Summary of a replay run"""
+    lines: int = 0
+    clock_start_ns: int = 0         # Virtual time the replay started at
+    feed_seconds: float = 0.0       # Session time covered by the replayed lines
+    wall_seconds: float = 0.0       # Time the replay took
+    published: List[Tuple[int, str, str]] = field(default_factory=list)
+
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def speedup(self) -> float:
+        return self.feed_seconds / self.wall_seconds if self.wall_seconds else 0.0
+
+
+def _advance(clock: VirtualClock, mqtt_handler: ReplayMQTTHandler, until_ns: Optional[int] = None) -> None:
+    """Moves the clock to `until_ns`, stopping at every message due on the way so it's published on time.
+    Without `until_ns` it runs until the queue is empty."""
+    while (next_due := mqtt_handler.next_due()) is not None and (until_ns is None or next_due <= until_ns):
+        clock.advance_to(next_due)
+        mqtt_handler.publish_due()
+    if until_ns is not None:
+        clock.advance_to(until_ns)
+
+def replay_lines(lines: Iterable[str], state: SessionState, router: LineRouter, mqtt_handler: ReplayMQTTHandler,
+                 clock: VirtualClock, speed: float = 0.0) -> ReplayStats:
+    """Replays cache lines through the router. `speed` is the playback rate: 1.0 for real time,
+    N for N times faster and 0 for as fast as possible. `state.clock` and the handler must use `clock`."""
+    stats = ReplayStats()
+    wall_start = time.monotonic()
+    first_feed_time: Optional[float] = None
+    clock_start_ns = stats.clock_start_ns = clock.monotonic_ns()
+
+    for line in lines:
+        stats.lines += 1
+        timestamp = peek_timestamp(line)
+        if timestamp:
+            try:
+                feed_time = parse_timestamp(timestamp)
+            except ValueError:
+                feed_time = None
+            if feed_time is not None:
+                if first_feed_time is None:
+                    first_feed_time = feed_time
+                elapsed = feed_time - first_feed_time
+                if speed > 0:
+                    ahead = wall_start + elapsed / speed - time.monotonic()
+                    if ahead > 0:
+                        time.sleep(ahead)
+                # Anything that fell due before this line goes out first
+                _advance(clock, mqtt_handler, clock_start_ns + int(elapsed * 1e9))
+
+        f1_utils.check_quali_segment_reset(state)
+        try:
+            router.dispatch(line, state, mqtt_handler)
+        except Exception as e:
+            logging.error(f"Error processing line: {e}")
+        mqtt_handler.publish_due()     # Immediate messages
+
+    stats.feed_seconds = (clock.monotonic_ns() - clock_start_ns) / 1e9
+
+    # Let the tail of the queue run out, as the delay would have live
+    _advance(clock, mqtt_handler)
+
+    stats.wall_seconds = time.monotonic() - wall_start
+    stats.published = mqtt_handler.published
+    return stats
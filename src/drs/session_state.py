@@ -1,11 +1,15 @@
+import json
+import logging
+import time
 from dataclasses import dataclass, field
-from datetime import timedelta
-from typing import Dict, Set, Optional, Any
+from typing import Callable, Dict, List, Set, Optional, Any
+
+from .timing_tower import TimingTower
 
 @dataclass
 class FastestLapInfo:
     """Stores information about the current fastest lap holder"""
-    time: timedelta = timedelta(days=1)
+    time: int = 86_400_000      # Lap time in milliseconds, a day until the first lap is set
     driver: Optional[str] = None
     team: Optional[str] = None
 
@@ -16,6 +20,49 @@ class SessionLeaderInfo:
     driver_number: Optional[str] = None
     team: Optional[str] = None
 
+@dataclass(frozen=True)
+class DriverRecord:
+    """A driver as needed for a lead change, with the leader payload already serialised"""
+    driver_number: str
+    abbreviation: str
+    team: str
+    leader_payload: str     # json.dumps({"driver", "driver_number", "team"}), as published on the leader topic
+
+    @classmethod
+    def create(cls, driver_number: str, abbreviation: str, team: str) -> 'DriverRecord':
+        payload = json.dumps({"driver": abbreviation, "driver_number": driver_number, "team": team})
+        return cls(driver_number, abbreviation, team, payload)
+
+def build_driver_index(drivers_data: Dict[str, Dict[str, str]], teams_data: Dict[str, Dict[str, Any]]) -> Dict[str, DriverRecord]:
+    """Racing number -> DriverRecord, drivers with an unknown team are left out"""
+    index = {}
+    for number, driver_info in drivers_data.items():
+        try:
+            index[number] = DriverRecord.create(number, driver_info['abbreviation'], teams_data[driver_info['team_key']]['name'])
+        except KeyError:
+            continue
+    return index
+
+def validate_driver_index(drivers_data: Dict[str, Dict[str, str]], teams_data: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Checks the drivers against the teams' `driver_numbers` lists (teams without the list are skipped),
+    returns a description of every problem found"""
+    problems = []
+    for number, driver_info in drivers_data.items():
+        team_key = driver_info.get('team_key')
+        if 'abbreviation' not in driver_info:
+            problems.append(f"Driver {number} has no abbreviation")
+        if team_key not in teams_data:
+            problems.append(f"Driver {number} has unknown team '{team_key}'")
+        elif 'driver_numbers' in teams_data[team_key] and number not in teams_data[team_key]['driver_numbers']:
+            problems.append(f"Driver {number} is not in the driver_numbers of '{team_key}'")
+    for team_key, team_info in teams_data.items():
+        for number in team_info.get('driver_numbers', ()):
+            if number not in drivers_data:
+                problems.append(f"Team '{team_key}' lists driver {number}, who is missing from drivers")
+            elif drivers_data[number].get('team_key') != team_key:
+                problems.append(f"Team '{team_key}' lists driver {number}, who drives for '{drivers_data[number].get('team_key')}'")
+    return problems
+
 @dataclass
 class SessionState:
     """Holds all the dynamic and static data for a session"""
@@ -38,6 +85,34 @@ class SessionState:
     # Calibration
     true_session_start_time: Optional[float] = None         # When the session start time is detected by the service
 
+    clock: Optional[Callable[[], float]] = field(default=None, repr=False)     # Monotonic clock in seconds, time.monotonic if not set (e.g. a replay's virtual clock)
+
+    timing_tower: TimingTower = field(default_factory=TimingTower, repr=False)      # Running order and timing of every car, from the TimingData deltas
+    followed_driver: Optional[str] = None       # Racing number of "my driver", whose position changes are published
+
+    driver_index: Dict[str, DriverRecord] = field(init=False, repr=False)     # Racing number -> DriverRecord, built from drivers_data and teams_data
+
+    def __post_init__(self):
+        self.build_driver_index()
+
+    def build_driver_index(self):
+        """(Re)builds the driver index, logging any inconsistencies in the driver and team data"""
+        for problem in validate_driver_index(self.drivers_data, self.teams_data):
+            logging.warning(f"DRS data: {problem}")
+        self.driver_index = build_driver_index(self.drivers_data, self.teams_data)
+
+    def driver(self, driver_number: str) -> DriverRecord:
+        """The driver with the racing number, an UNK driver of an UNKNOWN team if it's not in the data"""
+        record = self.driver_index.get(driver_number)
+        if record is None:
+            logging.warning(f"Could not find driver or team for {driver_number}, setting unknown")
+            record = DriverRecord.create(driver_number, "UNK", "UNKNOWN")
+        return record
+
+    def now(self) -> float:
+        """The current monotonic time in seconds, used for all session timing"""
+        return self.clock() if self.clock else time.monotonic()
+
     def set_race_state(self, state: str):
         """Sets the race state"""
         self.race_state = state
@@ -63,12 +138,14 @@ class SessionState:
         self.yellow_flags.clear()
 
     def set_session_lead(self, driver: str, driver_number: str, team: str):
-        """Updates the current session lead"""
+        """Updates the current session lead, also P1 of the timing tower if no Position patch told it yet"""
         self.current_session_lead.driver = driver
         self.current_session_lead.driver_number = driver_number
         self.current_session_lead.team = team
+        if driver_number in self.drivers_data:
+            self.timing_tower.seed(1, driver_number)
 
-    def set_fastest_lap(self, lap_time: timedelta, driver: str, team: str):
+    def set_fastest_lap(self, lap_time: int, driver: str, team: str):
         """Updates the fastest lap information"""
         self.fastest_lap_info.time = lap_time
         self.fastest_lap_info.driver = driver
@@ -79,7 +156,7 @@ class SessionState:
         next_segment = "Q2" if self.quali_session == "Q1" else "Q3"
 
         self.quali_session = next_segment
-        self.fastest_lap_info.time = timedelta(minutes=5)
+        self.fastest_lap_info.time = 300_000    # 5 minutes
         self.fastest_lap_info.driver = None
         self.fastest_lap_info.team = None
         self.cooldown_active = False
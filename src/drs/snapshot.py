@@ -0,0 +1,150 @@
+"""Snapshot - Saves the session state so a restarted service carries on where it left off
+
+A snapshot holds the `SessionState` (leader, flags, qualifying segment, calibration...), the publish delays, the
+messages still waiting in the publish queue and the cache position the state is up to date with. It's written
+when any of that changes (at most every `min_interval` seconds, so a busy feed doesn't fsync after every batch)
+and every `interval` seconds while the cache position moves on, to a temporary file that then replaces the
+snapshot, so a crash mid-write never leaves a broken snapshot behind. A change that came in between saves is
+still safe, the lines after the saved cache position are processed again on restart, and the service saves a
+last time on shutdown.
+
+Monotonic times don't survive a reboot, so they are stored as wall clock times and converted back on load.
+On restart the lines after the saved cache position are processed as usual, catching up on anything missed.
+"""
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .cache_tailer import CacheTailer
+from .mqtt_handler import MQTTHandler
+from .session_state import SessionState
+
+SNAPSHOT_VERSION = 1
+
+
+class Snapshotter:
+    """Saves and loads the snapshot file"""
+
+    def __init__(self, path: str, interval: float = 30.0, min_interval: float = 5.0, max_age: float = 4 * 3600):
+        self.path = path
+        self.interval = interval    # Seconds between saves when only the cache position moved on
+        self.min_interval = min_interval    # Seconds between saves when the state changed
+        self.max_age = max_age      # Older snapshots are from another session and ignored
+        self._last_saved: Optional[Dict[str, Any]] = None
+        self._last_saved_at = 0.0
+
+    # --- saving ---
+    def capture(self, state: SessionState, mqtt_handler: MQTTHandler, position: Optional[Tuple[int, int]]) -> Dict[str, Any]:
+        """The snapshot of the current state, monotonic times converted to wall clock times"""
+        state_to_wall = time.time() - state.now()
+        handler_to_wall_ns = time.time_ns() - mqtt_handler._clock()
+        to_wall = lambda monotonic: None if monotonic is None else monotonic + state_to_wall
+        return {
+            'state': {
+                'race_state': state.race_state,
+                'fastest_lap': [state.fastest_lap_info.time, state.fastest_lap_info.driver, state.fastest_lap_info.team],
+                'leader': [state.current_session_lead.driver, state.current_session_lead.driver_number, state.current_session_lead.team],
+                'yellow_flags': sorted(state.yellow_flags, key=str),
+                'quali_session': state.quali_session,
+                'session_end_time': to_wall(state.session_end_time),
+                'cooldown_active': state.cooldown_active,
+                'true_session_start_time': to_wall(state.true_session_start_time),
+                'timing_order': state.timing_tower.order(),
+            },
+            'delay': mqtt_handler.publish_delay.total_seconds(),
+            'sink_delays': mqtt_handler.sink_delays,
+            'pending': [[queued_at + handler_to_wall_ns, str(topic), payload, immediate, sinks]
+                        for queued_at, topic, payload, immediate, sinks in mqtt_handler.pending_messages()],
+            'position': list(position) if position else None,
+        }
+
+    def _changed(self, snapshot: Dict[str, Any]) -> bool:
+        """Whether anything but the cache position changed since the last save. Wall clock times
+        drift by a few µs between captures, so those are compared rounded"""
+        def comparable(snapshot):
+            state = dict(snapshot['state'])
+            for key in ('session_end_time', 'true_session_start_time'):
+                state[key] = None if state[key] is None else round(state[key], 1)
+            return state, snapshot['delay'], snapshot['sink_delays'], [(round(message[0], -8), *message[1:]) for message in snapshot['pending']]
+        return self._last_saved is None or comparable(snapshot) != comparable(self._last_saved)
+
+    def maybe_save(self, state: SessionState, mqtt_handler: MQTTHandler, tailer: Optional[CacheTailer], force: bool = False) -> bool:
+        """Saves the snapshot if the state changed over `min_interval` seconds after the last save, or the cache position
+        moved on over `interval` seconds ago. `force` saves anything not saved yet right away (e.g. on shutdown).
+        Returns True if it was saved"""
+        since_saved = time.monotonic() - self._last_saved_at
+        if not force and since_saved < self.min_interval:
+            return False
+        snapshot = self.capture(state, mqtt_handler, tailer.position if tailer else None)
+        if not self._changed(snapshot):
+            if snapshot['position'] == self._last_saved['position'] or not force and since_saved < self.interval:
+                return False
+        self.save(snapshot, state.session_type)
+        return True
+
+    def save(self, snapshot: Dict[str, Any], session_type: str) -> None:
+        """Writes the snapshot atomically"""
+        data = dict(snapshot, version=SNAPSHOT_VERSION, session_type=session_type, saved_at=time.time())
+        temporary_path = f"{self.path}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not save snapshot to '{self.path}': {e}")
+            return
+        self._last_saved = snapshot
+        self._last_saved_at = time.monotonic()
+
+    # --- loading ---
+    def load(self, session_type: str) -> Optional[Dict[str, Any]]:
+        """The saved snapshot, None if there isn't one or it's from another (or an old) session"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable snapshot '{self.path}': {e}")
+            return None
+
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('session_type') != session_type:
+            logging.info(f"Ignoring snapshot '{self.path}', it's from another session type or DRS version")
+            return None
+        age = time.time() - snapshot.get('saved_at', 0)
+        if age > self.max_age:
+            logging.info(f"Ignoring snapshot '{self.path}', it's {age / 3600:.1f} hours old")
+            return None
+        return snapshot
+
+    def restore(self, snapshot: Dict[str, Any], state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Restores the state, publish delay and publish queue of a loaded snapshot"""
+        wall_to_state = state.now() - time.time()
+        wall_to_handler_ns = mqtt_handler._clock() - time.time_ns()
+        to_monotonic = lambda wall: None if wall is None else wall + wall_to_state
+
+        saved = snapshot['state']
+        state.race_state = saved['race_state']
+        state.set_fastest_lap(*saved['fastest_lap'])
+        state.set_session_lead(*saved['leader'])
+        state.yellow_flags = set(saved['yellow_flags'])
+        state.quali_session = saved['quali_session']
+        state.session_end_time = to_monotonic(saved['session_end_time'])
+        state.cooldown_active = saved['cooldown_active']
+        state.true_session_start_time = to_monotonic(saved['true_session_start_time'])
+        state.timing_tower.restore_order(saved.get('timing_order', []))
+
+        if snapshot['delay'] != mqtt_handler.publish_delay.total_seconds():
+            mqtt_handler.set_delay(snapshot['delay'])
+        for sink, delay in snapshot.get('sink_delays', {}).items():
+            if sink in mqtt_handler.sinks and delay != mqtt_handler.sink_delays[sink]:
+                mqtt_handler.set_delay(delay, sink)
+        # Snapshots from before the sinks were saved hold messages for every sink
+        mqtt_handler.restore_pending_messages((queued_at + wall_to_handler_ns, topic, payload, immediate, saved_sinks[0] if saved_sinks else None)
+                                              for queued_at, topic, payload, immediate, *saved_sinks in snapshot['pending'])
+        logging.info(f"Restored snapshot from {time.ctime(snapshot['saved_at'])}: {state.race_state}, leader "
+                     f"{state.current_session_lead.driver}, {len(snapshot['pending'])} messages waiting")
@@ -0,0 +1,119 @@
+"""Telemetry - Decodes the CarData.z stream into NumPy arrays and detects DRS and top speed events
+
+CarData.z lines hold base64 of raw deflated JSON, a few samples (roughly 4 Hz) of the channels of every car:
+    {'Entries': [{'Utc': ..., 'Cars': {'1': {'Channels': {'0': rpm, '2': speed, '3': gear, '4': throttle, '5': brake, '45': drs}}}}]}
+
+Each line is inflated and its samples loaded into (samples x cars) arrays, a column per racing number in
+`SessionState.drivers_data`. Everything after that is a vectorised comparison over all cars at once:
+    * the DRS state of every car after the line (the last sample that has the car), published for the leader
+      when it changes. DRS channel values 10, 12 and 14 mean the flap is open, 8 that the car is eligible
+    * the top speed of every car, published when a car beats the top speed of the session
+"""
+import base64
+import json
+import logging
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .mqtt_handler import MQTTHandler
+from .mqtt_topics import MqttTopics
+from .session_state import SessionState
+
+SPEED_CHANNEL = '2'
+DRS_CHANNEL = '45'
+DRS_OPEN_VALUES = (10, 12, 14)
+TOP_SPEED_FLOOR = 250   # km/h, slower isn't announced as a top speed (e.g. the first laps out of the pits)
+MISSING = -1            # Value of a car without a sample
+
+
+def decode_compressed(payload: str) -> Any:
+    """Decodes the payload of a .z category: base64, raw deflate, JSON"""
+    return json.loads(zlib.decompress(base64.b64decode(payload), wbits=-15))
+
+def load_channels(entries: List[dict], slots: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """(speed, drs) arrays of samples x cars from the CarData entries, MISSING where a car has no sample"""
+    speed = np.full((len(entries), len(slots)), MISSING, dtype=np.int16)
+    drs = np.full((len(entries), len(slots)), MISSING, dtype=np.int16)
+    for row, entry in enumerate(entries):
+        for number, car in (entry.get('Cars') or {}).items():
+            slot = slots.get(number)
+            if slot is None:
+                continue
+            channels = car.get('Channels') or {}
+            speed[row, slot] = channels.get(SPEED_CHANNEL, MISSING)
+            drs[row, slot] = channels.get(DRS_CHANNEL, MISSING)
+    return speed, drs
+
+
+class CarTelemetry:
+    """Per car DRS state and top speed, kept up to date from CarData.z lines (register handle_car_data on the router)"""
+
+    def __init__(self):
+        self.numbers: List[str] = []            # Racing number of every column
+        self.slots: Dict[str, int] = {}         # Racing number -> column
+        self.drs_open = np.zeros(0, dtype=bool)
+        self.top_speeds = np.zeros(0, dtype=np.int16)   # km/h per car
+        self.session_top_speed = 0
+        self._published_drs: Optional[str] = None     # Last payload published on the DRS topic
+
+    def _build_slots(self, state: SessionState) -> None:
+        self.numbers = list(state.drivers_data)
+        self.slots = {number: slot for slot, number in enumerate(self.numbers)}
+        self.drs_open = np.zeros(len(self.numbers), dtype=bool)
+        self.top_speeds = np.zeros(len(self.numbers), dtype=np.int16)
+
+    def reset(self) -> None:
+        """Forgets the top speeds, e.g. for a new session"""
+        self.top_speeds[:] = 0
+        self.session_top_speed = 0
+
+    def handle_car_data(self, payload: str, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Handles a CarData.z payload"""
+        if len(self.numbers) != len(state.drivers_data):
+            self._build_slots(state)
+        try:
+            entries = decode_compressed(payload)['Entries']
+        except (ValueError, TypeError, KeyError, zlib.error) as e:
+            logging.debug(f"Could not decode CarData.z payload: {e}")
+            return
+        if not entries or not self.numbers:
+            return
+        speed, drs = load_channels(entries, self.slots)
+        self.update(speed, drs, state, mqtt_handler)
+
+    def update(self, speed: np.ndarray, drs: np.ndarray, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Takes in the (samples x cars) speed and DRS channels of a line and publishes what changed"""
+        # DRS of each car as of its last sample in the line, unchanged for cars without one
+        known = drs != MISSING
+        has_sample = known.any(axis=0)
+        last_row = len(drs) - 1 - np.argmax(known[::-1], axis=0)
+        last_drs = drs[last_row, np.arange(drs.shape[1])]
+        self.drs_open = np.where(has_sample, np.isin(last_drs, DRS_OPEN_VALUES), self.drs_open)
+
+        car_top_speeds = speed.max(axis=0)
+        self.top_speeds = np.maximum(self.top_speeds, car_top_speeds)
+        fastest = int(np.argmax(car_top_speeds))
+
+        if state.cooldown_active or not state.true_session_start_time:
+            return
+        if car_top_speeds[fastest] > max(self.session_top_speed, TOP_SPEED_FLOOR - 1):
+            self.session_top_speed = int(car_top_speeds[fastest])
+            driver = state.driver(self.numbers[fastest])
+            logging.info(f"New top speed of the session: {driver.abbreviation} {self.session_top_speed}km/h")
+            mqtt_handler.queue_message(MqttTopics.TOP_SPEED_TOPIC, json.dumps(
+                {"driver": driver.abbreviation, "driver_number": driver.driver_number, "team": driver.team, "speed": self.session_top_speed}))
+        self._publish_leader_drs(state, mqtt_handler)
+
+    def _publish_leader_drs(self, state: SessionState, mqtt_handler: MQTTHandler) -> None:
+        """Publishes the DRS state of the leader when it (or the leader) changes"""
+        slot = self.slots.get(state.current_session_lead.driver_number)
+        if slot is None:
+            return
+        driver = state.driver(self.numbers[slot])
+        payload = json.dumps({"driver": driver.abbreviation, "driver_number": driver.driver_number, "team": driver.team,
+                              "drs": "OPEN" if self.drs_open[slot] else "CLOSED"})
+        if payload != self._published_drs:
+            self._published_drs = payload
+            mqtt_handler.queue_message(MqttTopics.DRS_TOPIC, payload)
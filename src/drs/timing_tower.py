@@ -0,0 +1,156 @@
+"""Timing Tower - The running order and timing of every car, kept up to date from the TimingData deltas
+
+TimingData lines are partial updates, `{'Lines': {racing number: patch}}` where a patch only holds what changed
+for that car (its Position, GapToLeader, IntervalToPositionAhead, a sector, BestLapTime...). Each patch is merged
+field by field into the car's `CarTiming` (a fixed set of slots, not a nested dict), and the running order is a
+list indexed by position that is moved along with every Position patch, so P1, P3 or the whole order are read
+without sorting or scanning the cars.
+
+Position patches only come in when a car changes position, so a service that starts reading halfway through a
+session doesn't see most of the order. Until it does, positions are seeded from what else is known (the TopThree
+lines, the session leader). A seed only fills a position that's empty or was seeded itself, a position a Position
+patch has put a car at is left alone. Position patches always apply, also over seeded positions, so the seed of a car
+holds until the first Position patch that moves it or another car there.
+"""
+from typing import Any, Dict, List, Optional, Set
+
+SECTORS = 3
+
+
+class CarTiming:
+    """The timing of one car as shown on the timing tower. Times and gaps are kept as the feed's strings"""
+    __slots__ = ('number', 'position', 'gap_to_leader', 'interval', 'sectors', 'best_lap', 'last_lap', 'laps', 'in_pit', 'retired')
+
+    def __init__(self, number: str):
+        self.number = number
+        self.position: Optional[int] = None
+        self.gap_to_leader: Optional[str] = None    # e.g. '+1.234', 'LAP 12' for the leader or '1L'
+        self.interval: Optional[str] = None         # To the car ahead
+        self.sectors: List[Optional[str]] = [None] * SECTORS    # Sector times of the current (or last) lap
+        self.best_lap: Optional[str] = None
+        self.last_lap: Optional[str] = None
+        self.laps: Optional[int] = None
+        self.in_pit = False
+        self.retired = False
+
+    def __repr__(self) -> str:
+        return f"CarTiming({self.number}, P{self.position}, {self.gap_to_leader})"
+
+
+def _value(patch: Any) -> Any:
+    """The value of a timing field, which is either the value itself or {'Value': value, ...}"""
+    return patch.get('Value') if isinstance(patch, dict) else patch
+
+
+class TimingTower:
+    """Per car timing and the running order, see apply()"""
+
+    def __init__(self):
+        self.cars: Dict[str, CarTiming] = {}
+        self._order: List[Optional[str]] = []   # Racing number per position, P1 first
+        self._seeded: Set[int] = set()          # Positions only known from seed(), until a Position patch confirms them
+
+    def car(self, number: str) -> CarTiming:
+        """The timing of a car, added the first time it's asked for"""
+        car = self.cars.get(number)
+        if car is None:
+            car = self.cars[number] = CarTiming(number)
+        return car
+
+    def apply(self, lines: Dict[str, Any]) -> Set[int]:
+        """Merges the per car patches of a TimingData `Lines` update, returns the positions that changed car"""
+        changed = set()
+        for number, patch in lines.items():
+            if not isinstance(patch, dict):
+                continue
+            car = self.car(number)
+            for key, value in patch.items():
+                if key == 'Position':
+                    try:
+                        position = int(value)
+                    except (TypeError, ValueError):
+                        continue
+                    changed.update(self._move(car, position))
+                    self._seeded.discard(position)
+                elif key == 'GapToLeader':
+                    car.gap_to_leader = _value(value)
+                elif key == 'IntervalToPositionAhead':
+                    car.interval = _value(value)
+                elif key == 'Sectors':
+                    self._apply_sectors(car, value)
+                elif key == 'BestLapTime':
+                    car.best_lap = _value(value) or car.best_lap
+                elif key == 'LastLapTime':
+                    car.last_lap = _value(value) or car.last_lap
+                elif key == 'NumberOfLaps':
+                    car.laps = value
+                elif key == 'InPit':
+                    car.in_pit = bool(value)
+                elif key == 'Retired':
+                    car.retired = bool(value)
+        return changed
+
+    @staticmethod
+    def _apply_sectors(car: CarTiming, sectors: Any) -> None:
+        # A full update is a list of the sectors, a delta is {index: patch} of the ones that changed
+        items = enumerate(sectors) if isinstance(sectors, list) else sectors.items() if isinstance(sectors, dict) else ()
+        for index, sector in items:
+            try:
+                index = int(index)
+            except (TypeError, ValueError):
+                continue
+            value = _value(sector)
+            if 0 <= index < SECTORS and value is not None:
+                car.sectors[index] = value or None     # An empty value clears the sector at the start of a lap
+
+    def _move(self, car: CarTiming, position: int) -> List[int]:
+        """Puts the car at `position` in the order, returns the positions that changed car"""
+        if position < 1 or position == car.position and self._at(position) == car.number:
+            return []
+        changed = []
+        if car.position is not None and self._at(car.position) == car.number:
+            self._order[car.position - 1] = None    # Taken by whoever moved into it, in this or a later update
+            changed.append(car.position)
+        if len(self._order) < position:
+            self._order.extend([None] * (position - len(self._order)))
+        displaced = self._order[position - 1]
+        if displaced is not None and displaced != car.number and self.cars[displaced].position == position:
+            self.cars[displaced].position = None    # Until its own Position patch comes in
+        self._order[position - 1] = car.number
+        car.position = position
+        changed.append(position)
+        return changed
+
+    def seed(self, position: int, number: str) -> List[int]:
+        """Puts a car at `position` if it's empty or was only seeded, for positions learnt outside of TimingData.
+        Later Position patches replace it. Returns the positions that changed car"""
+        if position < 1 or self._at(position) is not None and position not in self._seeded:
+            return []
+        changed = self._move(self.car(number), position)
+        self._seeded.add(position)
+        return changed
+
+    def _at(self, position: int) -> Optional[str]:
+        return self._order[position - 1] if 0 < position <= len(self._order) else None
+
+    # --- queries ---
+    def at(self, position: int) -> Optional[CarTiming]:
+        """The car at `position` (1 is the leader), None if no car is known there"""
+        number = self._at(position)
+        return self.cars[number] if number is not None else None
+
+    def leader(self) -> Optional[CarTiming]:
+        return self.at(1)
+
+    def top(self, count: int) -> List[Optional[str]]:
+        """Racing numbers of P1 to P`count`, None where no car is known"""
+        return [self._at(position) for position in range(1, count + 1)]
+
+    def order(self) -> List[str]:
+        """Racing numbers in running order"""
+        return [number for number in self._order if number is not None]
+
+    def restore_order(self, numbers: List[str]) -> None:
+        """Sets the running order, e.g. from a snapshot"""
+        for position, number in enumerate(numbers, start=1):
+            self._move(self.car(number), position)
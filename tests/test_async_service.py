@@ -0,0 +1,77 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from queue import Queue
+import time
+
+from src.drs.async_service import AsyncMQTTHandler, run_service
+from src.drs.f1_utils import create_line_router
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}},
+}
+
+@pytest.fixture
+def published():
+    """Patches the paho client, returning the list of (monotonic time, topic, payload) it publishes"""
+    published = []
+    with patch('src.drs.mqtt_handler.mqtt.Client') as client_class:
+        client_class.return_value = MagicMock()
+        client_class.return_value.publish.side_effect = lambda topic, payload=None, qos=0, retain=False: published.append((time.monotonic(), topic, payload))
+        yield published
+
+def events(published):
+    return [(t, topic, payload) for t, topic, payload in published if not str(topic).startswith('f1/service')]
+
+# --- Tests ---
+def test_async_handler_publishes_on_timer(published):
+    """Tests that delayed messages are published by a loop timer, and a delay change re-arms it"""
+    async def scenario():
+        handler = AsyncMQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=5, command_queue=Queue())
+        queued_at = time.monotonic()
+        handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+        handler.queue_message(MqttTopics.LEADER_TOPIC, 'leader', immediate=True)
+        await asyncio.sleep(0.05)
+        assert [payload for _, _, payload in events(published)] == ['leader']
+
+        handler.set_delay(0.1)
+        await asyncio.sleep(0.15)
+        handler.disconnect()
+        return queued_at
+
+    queued_at = asyncio.run(scenario())
+
+    published_at, topic, payload = events(published)[1]
+    assert (topic, payload) == (MqttTopics.FLAG_TOPIC, 'yellow')
+    assert 0.1 <= published_at - queued_at < 0.2
+
+def test_run_service_processes_cache_lines(published, tmp_path):
+    """Tests the async runtime end to end, from a line written to the cache to the publish"""
+    cache_file = tmp_path / "livetiming_cache.txt"
+    cache_file.write_text("", encoding='utf-8')
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+    settings = dict(broker_ip='localhost', port=1883, username='u', password='p', delay=0)
+
+    async def scenario():
+        service = asyncio.create_task(run_service(state, create_line_router('race'), str(cache_file), settings))
+        await asyncio.sleep(0.05)
+        with open(cache_file, 'a', encoding='utf-8') as f:
+            f.write("['TopThree', {'Lines': {'0': {'RacingNumber': '1'}}}, '2025-07-06T14:49:09.888Z']\n")
+        for _ in range(100):
+            if len(events(published)) >= 2:     # The top three the line seeded and the leader
+                break
+            await asyncio.sleep(0.01)
+        service.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await service
+
+    asyncio.run(scenario())
+
+    assert state.current_session_lead.driver == 'VER'
+    assert (MqttTopics.LEADER_TOPIC, json.dumps({"driver": "VER", "driver_number": "1", "team": "Red Bull"})) in [(topic, payload) for _, topic, payload in events(published)]
@@ -0,0 +1,103 @@
+import os
+import pytest
+
+from src.drs.cache_index import CacheIndex, CHECKPOINT, LAP, STATUS
+from src.drs.cache_tailer import CacheTailer
+from src.drs.catch_up import catch_up
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}},
+}
+
+def session_lines(name: str, hour: int, laps: int = 0, leader: str = '1') -> list:
+    """A short session: SessionInfo, a start, some filler, laps and a leader"""
+    lines = [f"['SessionInfo', {{'Meeting': {{'Name': 'British Grand Prix'}}, 'Type': '{name.split(' ')[0]}', 'Name': '{name}'}}, '2025-07-05T{hour:02}:00:00.000Z']",
+             f"['SessionData', {{'StatusSeries': {{'1': {{'SessionStatus': 'Started'}}}}}}, '2025-07-05T{hour:02}:00:01.000Z']"]
+    for minute in range(1, 50):
+        lines.append(f"['Heartbeat', {{'Utc': 'x'}}, '2025-07-05T{hour:02}:{minute:02}:00.000Z']")
+        if minute <= laps:
+            lines.append(f"['SessionData', {{'Series': {{'{minute}': {{'Lap': {minute}}}}}}}, '2025-07-05T{hour:02}:{minute:02}:30.000Z']")
+    lines.append(f"['TopThree', {{'Lines': {{'0': {{'RacingNumber': '{leader}'}}}}}}, '2025-07-05T{hour:02}:55:00.000Z']")
+    lines.append(f"['SessionData', {{'StatusSeries': {{'2': {{'SessionStatus': 'Finished'}}}}}}, '2025-07-05T{hour:02}:59:00.000Z']")
+    return lines
+
+WEEKEND = session_lines('Sprint', 12, laps=20, leader='4') + session_lines('Race', 15, laps=40, leader='1')
+
+@pytest.fixture
+def cache_file(tmp_path):
+    path = tmp_path / "livetiming_cache.txt"
+    path.write_text('\n'.join(WEEKEND) + '\n', encoding='utf-8')
+    return path
+
+def offset_of(line: str) -> int:
+    """Byte offset of a line of WEEKEND in the cache"""
+    return len(''.join(text + '\n' for text in WEEKEND[:WEEKEND.index(line)]).encode('utf-8'))
+
+def line_at(path, offset: int) -> str:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.readline().decode('utf-8').rstrip('\n')
+
+# --- Tests ---
+def test_index_sessions_laps_and_times(cache_file):
+    """Tests that sessions, status changes, laps and checkpoints point at the right lines"""
+    index = CacheIndex(str(cache_file), spacing=1000)
+    index.sync()
+
+    assert [entry.value for entry in index.sessions()] == ['Sprint', 'Race']
+    race = index.session_offset('race')
+    assert race == offset_of(session_lines('Race', 15)[0])
+    assert index.session_offset() == race
+    assert index.session_offset('Qualifying') is None
+    assert [entry.value for entry in index.entries if entry.kind == STATUS] == ['Started', 'Finished'] * 2
+
+    assert "'Lap': 40" in line_at(cache_file, index.lap_offset(40, after=race))
+    assert index.lap_offset(40) == index.lap_offset(40, after=race)     # The sprint only has 20
+    assert index.lap_offset(41) is None
+    assert index.find(LAP, 5).offset < race
+
+    checkpoints = [entry for entry in index.entries if entry.kind == CHECKPOINT]
+    assert len(checkpoints) > 5
+    assert all(line_at(cache_file, entry.offset).endswith(f"'{entry.timestamp}']") for entry in checkpoints)
+    offset = index.offset_at('2025-07-05T15:30:00.000Z')
+    assert race < offset <= offset_of("['Heartbeat', {'Utc': 'x'}, '2025-07-05T15:30:00.000Z']")
+
+def test_index_updated_by_tailer(cache_file, tmp_path):
+    """Tests that the tailer keeps the index up to date, the index file is picked up again after a restart,
+    and a replaced cache gets a new index"""
+    with CacheTailer(str(cache_file), index=CacheIndex(str(cache_file), spacing=1000)) as tailer:
+        tailer.read_batch()     # Indexes what was there before the tailer started
+        with open(cache_file, 'a', encoding='utf-8') as f:
+            f.write("['SessionData', {'StatusSeries': {'3': {'SessionStatus': 'Aborted'}}}, '2025-07-05T16:00:00.000Z']\n")
+        tailer.read_batch()
+        entries = tailer.index.entries
+
+    complete = CacheIndex(str(cache_file), spacing=1000)
+    complete.sync()
+    assert entries == complete.entries
+    assert entries[-1].kind == STATUS and entries[-1].value == 'Aborted'
+
+    assert CacheIndex(str(cache_file), spacing=1000).sessions() == complete.sessions()
+
+    replacement = tmp_path / "replacement.txt"
+    replacement.write_text('\n'.join(session_lines('Qualifying', 14)) + '\n', encoding='utf-8')
+    os.replace(replacement, cache_file)
+    index = CacheIndex(str(cache_file), spacing=1000)
+    index.sync()
+    assert [entry.value for entry in index.sessions()] == ['Qualifying']
+
+def test_catch_up_current_session_only(cache_file):
+    """Tests that catch up with an index ignores the sessions earlier in the cache"""
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+    catch_up(str(cache_file), state, index=CacheIndex(str(cache_file)))
+    assert state.current_session_lead.driver == 'VER'
+
+    with open(cache_file, 'a', encoding='utf-8') as f:
+        f.write('\n'.join(session_lines('Race', 18, laps=3, leader='4')[:2]) + '\n')
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+    catch_up(str(cache_file), state, index=CacheIndex(str(cache_file)))
+    assert state.current_session_lead.driver is None     # No leader yet in the new session
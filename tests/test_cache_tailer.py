@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import pytest
+
+from src.drs.cache_tailer import CacheTailer
+
+# --- Fixtures ---
+
+@pytest.fixture
+def cache_file(tmp_path):
+    """Provides a cache file that already holds a line from before the service started"""
+    path = tmp_path / "livetiming_cache.txt"
+    path.write_text("['Heartbeat', {}, 'old']\n", encoding='utf-8')
+    return path
+
+@pytest.fixture
+def tailer(cache_file):
+    with CacheTailer(str(cache_file), poll_interval=0.05) as tailer:
+        yield tailer
+
+def append(path, text: str) -> None:
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+# --- Tests ---
+def test_starts_at_end_of_file(tailer: CacheTailer, cache_file):
+    """Tests that lines written before start are skipped and new lines are returned"""
+    assert tailer.read_batch() == []
+
+    append(cache_file, "['TopThree', {}, 'new']\n")
+    assert tailer.read_batch() == ["['TopThree', {}, 'new']"]
+    assert tailer.read_batch() == []
+
+def test_partial_line_is_held_back(tailer: CacheTailer, cache_file):
+    """Tests that a line is only returned once the writer has finished it"""
+    append(cache_file, "['TopThree', {'Li")
+    assert tailer.read_batch() == []
+
+    append(cache_file, "nes': {}}, 'new']\n['Heartbeat', {'U")
+    assert tailer.read_batch() == ["['TopThree', {'Lines': {}}, 'new']"]
+
+    append(cache_file, "tc': ''}, 'new']\n")
+    assert tailer.read_batch() == ["['Heartbeat', {'Utc': ''}, 'new']"]
+
+def test_truncated_file_is_read_from_start(tailer: CacheTailer, cache_file):
+    """Tests that truncation (livetiming client restarted without --append) is detected"""
+    cache_file.write_text("['Heartbeat', {}, 'a']\n", encoding='utf-8')
+
+    assert tailer.read_batch() == ["['Heartbeat', {}, 'a']"]
+
+def test_replaced_file_is_read_from_start(tailer: CacheTailer, cache_file):
+    """Tests that a new file at the same path (rotation) is picked up"""
+    replacement = cache_file.with_suffix('.new')
+    replacement.write_text("['SessionData', {}, 'rotated']\n['TopThree', {}, 'rotated']\n", encoding='utf-8')
+    os.replace(replacement, cache_file)
+
+    assert tailer.read_batch() == ["['SessionData', {}, 'rotated']", "['TopThree', {}, 'rotated']"]
+
+def test_wait_wakes_on_write(tailer: CacheTailer, cache_file):
+    """Tests that wait() returns well before its timeout when the cache is written to"""
+    writer = threading.Timer(0.05, append, args=(cache_file, "['TopThree', {}, 'new']\n"))
+    writer.start()
+
+    start = time.monotonic()
+    tailer.wait(timeout=5)
+    writer.join()
+
+    assert time.monotonic() - start < 1
+    assert tailer.read_batch() == ["['TopThree', {}, 'new']"]
+
+def test_wake_interrupts_wait(tailer: CacheTailer):
+    """Tests that wake() (used for incoming MQTT commands) interrupts wait()"""
+    threading.Timer(0.05, tailer.wake).start()
+
+    start = time.monotonic()
+    tailer.wait(timeout=5)
+
+    assert time.monotonic() - start < 1
+
+def test_backlog_is_read_in_chunks(cache_file):
+    """Tests that a backlog is split over several batches without losing or splitting lines"""
+    lines = [f"['TimingData', {{'Lines': {{'{i}': {{}}}}}}, 'ts']" for i in range(1000)]
+    with CacheTailer(str(cache_file), chunk_size=4096) as tailer:
+        append(cache_file, '\n'.join(lines) + '\n')
+
+        batches = []
+        while batch := tailer.read_batch():
+            batches.append(batch)
+
+        assert len(batches) > 1
+        assert [line for batch in batches for line in batch] == lines
+        assert tailer.offset == cache_file.stat().st_size
+
+def test_close_releases_file_descriptors(cache_file):
+    """Tests that closing the tailer also closes the inotify and wake pipe descriptors"""
+    tailer = CacheTailer(str(cache_file)).open()
+    descriptors = [fd for fd in (tailer.event_fileno(), tailer._wake_read, tailer._wake_write) if fd is not None]
+    tailer.close()
+
+    for fd in descriptors:
+        with pytest.raises(OSError):
+            os.fstat(fd)
+
+def test_wait_ignores_other_files(tailer: CacheTailer, cache_file):
+    """Tests that writes to other files in the directory (e.g. the cache index or snapshot) don't end wait() early"""
+    if tailer.event_fileno() is None:
+        pytest.skip("inotify unavailable")
+    writer = threading.Timer(0.05, append, args=(cache_file.with_name("drs_snapshot.json"), "{}"))
+    writer.start()
+
+    start = time.monotonic()
+    tailer.wait(timeout=0.3)
+    writer.join()
+
+    assert time.monotonic() - start >= 0.3
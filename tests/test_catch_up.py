@@ -0,0 +1,122 @@
+import json
+import pytest
+
+from src.drs.cache_tailer import CacheTailer
+from src.drs.catch_up import catch_up
+from src.drs.f1_utils import QUALI_RESET_DELAY
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}},
+}
+
+def new_state(session_type: str) -> SessionState:
+    return SessionState(session_type=session_type, drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+def lead_line(number: str, timestamp: str) -> str:
+    return f"['TopThree', {{'Lines': {{'0': {{'RacingNumber': '{number}'}}}}}}, '{timestamp}']"
+
+def lap_line(number: str, lap_time: str, timestamp: str) -> str:
+    return f"['TimingData', {{'Lines': {{'{number}': {{'LastLapTime': {{'Value': '{lap_time}', 'PersonalFastest': True}}}}}}}}, '{timestamp}']"
+
+def position_line(positions: dict, timestamp: str) -> str:
+    return str(['TimingData', {'Lines': {number: {'Position': str(position)} for number, position in positions.items()}}, timestamp])
+
+def flag_line(flag: str, timestamp: str, sector: int = 2) -> str:
+    return (f"['RaceControlMessages', {{'Messages': {{'1': {{'Category': 'Flag', 'Flag': '{flag}', 'Scope': 'Sector', "
+            f"'Sector': {sector}, 'Message': '{flag} IN TRACK SECTOR {sector}'}}}}}}, '{timestamp}']")
+
+HEARTBEAT = "['Heartbeat', {'Utc': '2025-07-06T14:00:00Z'}, '2025-07-06T14:00:00.000Z']"
+CAR_DATA = "['CarData.z', '7ZS9CsIwFIXf5c4d8t9FX0L8xVWpKEMprojI2avD', '2025-07-06T14:00:00.100Z']"
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return tmp_path / "livetiming_cache.txt"
+
+# --- Tests ---
+def test_catch_up_race(cache_file):
+    """Tests that flags, the last leader and the running order are rebuilt without publishing, and the tailer carries
+    on after the last complete line"""
+    lines = [
+        HEARTBEAT, CAR_DATA,
+        position_line({'1': 1, '4': 2}, '2025-07-06T14:00:30.000Z'),
+        lead_line('1', '2025-07-06T14:01:00.000Z'),
+        flag_line('YELLOW', '2025-07-06T14:02:00.000Z'),
+        position_line({'4': 1, '1': 2}, '2025-07-06T14:03:00.000Z'),
+        lead_line('4', '2025-07-06T14:03:00.000Z'),
+        flag_line('YELLOW', '2025-07-06T14:04:00.000Z', sector=7),
+        flag_line('CLEAR', '2025-07-06T14:05:00.000Z', sector=2),
+        CAR_DATA, HEARTBEAT,
+    ]
+    complete = '\n'.join(lines) + '\n'
+    cache_file.write_text(complete + "['TopThree', {'Lines': {'0': {'Racing", encoding='utf-8')
+    state = new_state('race')
+
+    result = catch_up(str(cache_file), state)
+
+    assert (state.race_state, state.yellow_flags) == ('YELLOW', {7})
+    assert state.current_session_lead.driver == 'NOR'
+    assert state.timing_tower.order() == ['4', '1']
+    assert result.lines == 6    # Three flags, the last leader and the position changes only
+    assert result.latest == {
+        MqttTopics.TOP_THREE_TOPIC: json.dumps([{"position": 1, "driver": "NOR", "driver_number": "4", "team": "McLaren"},
+                                                {"position": 2, "driver": "VER", "driver_number": "1", "team": "Red Bull"}]),
+        MqttTopics.LEADER_TOPIC: state.driver('4').leader_payload,
+        MqttTopics.FLAG_TOPIC: json.dumps({"flag": "YELLOW", "message": "YELLOW IN TRACK SECTOR 2"}),     # As published live
+    }
+    assert result.position[1] == len(complete.encode('utf-8'))
+
+    with cache_file.open('a', encoding='utf-8') as f:
+        f.write("Lines': {}}, 'x']\n")
+    with CacheTailer(str(cache_file), resume_from=result.position) as tailer:
+        assert tailer.read_batch() == ["['TopThree', {'Lines': {'0': {'RacingLines': {}}, 'x']"]
+
+def test_catch_up_qualifying_segments(cache_file):
+    """Tests that the fastest lap is rebuilt and reset for the next segment once the chequered flag is far enough back"""
+    lines = [
+        lap_line('1', '1:28.552', '2025-07-05T14:10:00.000Z'),
+        lap_line('4', '1:28.100', '2025-07-05T14:12:00.000Z'),
+        lap_line('1', '1:28.300', '2025-07-05T14:13:00.000Z'),
+        "['RaceControlMessages', {'Messages': {'14': {'Category': 'Flag', 'Flag': 'CHEQUERED', 'Scope': 'Track', 'Message': 'CHEQUERED FLAG'}}}, '2025-07-05T14:20:00.000Z']",
+        f"['SessionData', {{'StatusSeries': {{'4': {{'SessionStatus': 'Started'}}}}}}, '2025-07-05T14:{20 + QUALI_RESET_DELAY // 60 + 4}:00.000Z']",
+        lap_line('1', '1:27.900', f'2025-07-05T14:{20 + QUALI_RESET_DELAY // 60 + 6}:00.000Z'),
+    ]
+    cache_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    state = new_state('qualifying')
+
+    result = catch_up(str(cache_file), state)
+
+    assert state.quali_session == 'Q2'
+    assert not state.cooldown_active
+    assert (state.fastest_lap_info.time, state.fastest_lap_info.driver) == (87_900, 'VER')
+    assert result.latest == {MqttTopics.LEADER_TOPIC: state.driver('1').leader_payload}
+
+def test_catch_up_pending_qualifying_reset(cache_file):
+    """Tests that a chequered flag just before startup leaves the reset pending on the live clock"""
+    lines = [
+        lap_line('4', '1:28.100', '2025-07-05T14:12:00.000Z'),
+        "['RaceControlMessages', {'Messages': {'14': {'Category': 'Flag', 'Flag': 'CHEQUERED', 'Scope': 'Track', 'Message': 'CHEQUERED FLAG'}}}, '2025-07-05T14:20:00.000Z']",
+    ]
+    cache_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    state = new_state('qualifying')
+
+    catch_up(str(cache_file), state)
+
+    # The feed is long gone, so the chequered flag is way more than QUALI_RESET_DELAY ago on the live clock
+    assert state.quali_session == 'Q2'
+    assert state.fastest_lap_info.driver is None
+
+def test_catch_up_empty_cache(cache_file):
+    """Tests that an empty cache leaves the state alone and carries on from the start"""
+    cache_file.write_text('', encoding='utf-8')
+    state = new_state('race')
+
+    result = catch_up(str(cache_file), state)
+
+    assert result.position[1] == 0
+    assert result.latest == {}
+    assert state.race_state == 'GREEN'
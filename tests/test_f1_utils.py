@@ -5,7 +5,7 @@ import json
 from datetime import timedelta
 import time
 
-from src.drs.f1_utils import process_session_data_line, process_race_control_line, process_race_lead_line, process_lap_time_line
+from src.drs.f1_utils import process_session_data_line, process_race_control_line, process_race_lead_line, process_lap_time_line, parse_lap_time
 from src.drs.mqtt_topics import MqttTopics
 from src.drs.session_state import SessionState
 
@@ -49,7 +49,7 @@ def test_process_new_fastest_lap_lead_change_initial(state:SessionState, mock_mq
 
     # Asserts
     ## States
-    assert state.fastest_lap_info.time == timedelta(minutes=1, seconds=28, microseconds=552000)
+    assert state.fastest_lap_info.time == 88_552
     assert state.fastest_lap_info.driver == 'GAS'
     assert state.fastest_lap_info.team == 'Alpine'
     ## MQTT
@@ -61,14 +61,14 @@ def test_process_new_fastest_lap_lead_change(state:SessionState, mock_mqtt: Mock
     """Tests that a new fastest lap and leader is correctly identified when a fast lap has been already set (smaller margines)"""
     # New Fastest Lap
     state.session_type = 'pracitce'
-    state.set_fastest_lap(lap_time=timedelta(minutes=1, seconds=30), driver='GAS', team='Alpine')
+    state.set_fastest_lap(lap_time=90_000, driver='GAS', team='Alpine')
     
     new_fastest_lap_line = "['TimingData', {'Lines': {'55': {'NumberOfLaps': 3, 'Sectors': {'2': {'Value': '24.386'}}, 'Speeds': {'FL': {'Value': '250'}}, 'BestLapTime': {'Value': '1:28.552', 'Lap': 2}, 'LastLapTime': {'Value': '1:26.552', 'OverallFastest': True, 'PersonalFastest': True}}}}, '2025-07-05T10:38:19.212Z']"
 
     process_lap_time_line(new_fastest_lap_line, state, mock_mqtt)
     # Asserts
     ## States
-    assert state.fastest_lap_info.time == timedelta(minutes=1, seconds=26, microseconds=552000)
+    assert state.fastest_lap_info.time == 86_552
     assert state.fastest_lap_info.driver == 'SAI'
     assert state.fastest_lap_info.team == 'Williams'
 
@@ -80,14 +80,14 @@ def test_process_new_fastest_lap_lead_change(state:SessionState, mock_mqtt: Mock
 def test_slower_lap_registered_no_lead_change(state:SessionState, mock_mqtt: Mock):
     """Tests that a slower lap do not trigger any changes in lead time"""
     state.session_type = 'qualifying'
-    state.set_fastest_lap(lap_time=timedelta(minutes=1, seconds=20), driver='VER', team='Red Bull')
+    state.set_fastest_lap(lap_time=80_000, driver='VER', team='Red Bull')
     state.set_session_lead(driver='VER', driver_number='1', team='Red Bull')
     new_fastest_lap_line = "['TimingData', {'Lines': {'10': {'NumberOfLaps': 3, 'Sectors': {'2': {'Value': '24.386'}}, 'Speeds': {'FL': {'Value': '250'}}, 'BestLapTime': {'Value': '1:28.552', 'Lap': 2}, 'LastLapTime': {'Value': '1:28.552', 'OverallFastest': True, 'PersonalFastest': True}}}}, '2025-07-05T10:38:19.212Z']"
 
     # Execute
     process_lap_time_line(new_fastest_lap_line, state, mock_mqtt)
     
-    assert state.fastest_lap_info.time == timedelta(minutes=1, seconds=20)
+    assert state.fastest_lap_info.time == 80_000
     assert state.fastest_lap_info.driver == "VER"
     assert state.fastest_lap_info.team == "Red Bull"
     mock_mqtt.queue_message.assert_not_called()
@@ -110,8 +110,9 @@ def test_process_race_lead_line_new_leader(state: SessionState, mock_mqtt: Mock)
     assert state.current_session_lead.driver == "VER", "Should be VER for Verstappen"
     assert state.current_session_lead.team == "Red Bull", "Should be Red Bull"
 
-    ## Then check MQTT
-    mock_mqtt.queue_message.assert_called_once()
+    ## Then check MQTT, the top three it seeded comes first
+    assert [call.args[0] for call in mock_mqtt.queue_message.call_args_list] == [MqttTopics.TOP_THREE_TOPIC, MqttTopics.LEADER_TOPIC]
+    assert state.timing_tower.top(2) == ['1', '81']
     expected_payload = json.dumps({"driver" : "VER", "driver_number" : "1", "team" : "Red Bull"})
     mock_mqtt.queue_message.assert_called_with(MqttTopics.LEADER_TOPIC, expected_payload)
 
@@ -127,7 +128,7 @@ def test_qualifying_transitions(state: SessionState, mock_mqtt: Mock, freezer):
             if (time.monotonic() - state.session_end_time) > 180:
                 state.reset_for_next_quali_segment()
 
-    fast_lap_time = timedelta(minutes=1, seconds=28, microseconds=552000)
+    fast_lap_time = 88_552
     fast_lap_time_line = "['TimingData', {'Lines': {'10': {'NumberOfLaps': 3, 'Sectors': {'2': {'Value': '24.386'}}, 'Speeds': {'FL': {'Value': '250'}}, 'BestLapTime': {'Value': '1:28.552', 'Lap': 2}, 'LastLapTime': {'Value': '1:28.552', 'OverallFastest': True, 'PersonalFastest': True}}}}, '2025-07-05T10:38:19.212Z']"
     chequered_flag_line = "['RaceControlMessages', {'Messages': {'14': {'Utc': '2025-07-05T14:27:49', 'Category': 'Flag', 'Flag': 'CHEQUERED', 'Scope': 'Track', 'Message': 'CHEQUERED FLAG'}}}, '2025-07-05T14:27:49.153Z']"
 
@@ -288,4 +289,25 @@ def test_red_flag_ending_scenario(state: SessionState, mock_mqtt: Mock):
     ## MQTT
     mock_mqtt.queue_message.assert_called_once()
     expected_payload = json.dumps({"flag": "GREEN", "message": "GREEN FLAG, RED flag cleared"})
-    mock_mqtt.queue_message.assert_called_with(MqttTopics.FLAG_TOPIC, expected_payload)
\ No newline at end of file
+    mock_mqtt.queue_message.assert_called_with(MqttTopics.FLAG_TOPIC, expected_payload)
+
+## Lap time parsing
+@pytest.mark.parametrize("time_str, expected", [
+    ('1:28.552', 88_552),
+    ('0:59.001', 59_001),
+    ('58.3', 58_300),
+    ('1:30', 90_000),
+    ('1:02:03.456', 3_723_456),
+    ('1:28.5529', 88_552),
+    ('', None),
+    ('1:60.000', None),
+    ('1:28.', None),
+    ('-1:28.552', None),
+    ('1:2:3:4.5', None),
+    ('1:28.5a2', None),
+    (None, None),
+    ({'Value': '1:28.552'}, None),
+])
+def test_parse_lap_time(time_str, expected):
+    """Tests that lap times in all their formats are converted to integer milliseconds, and anything else to None"""
+    assert parse_lap_time(time_str) == expected
@@ -0,0 +1,95 @@
+import json
+import pytest
+
+from src.drs.f1_utils import create_line_router
+from src.drs.latency import LatencyTracker
+from src.drs.line_parser import parse_timestamp
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.replay import ReplayMQTTHandler, VirtualClock
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}},
+}
+
+MS = 1_000_000
+SECOND = 1_000_000_000
+FEED_TIMESTAMP = '2025-07-06T14:49:09.888Z'
+LEAD_LINE = f"['TopThree', {{'Lines': {{'0': {{'RacingNumber': '1'}}}}}}, '{FEED_TIMESTAMP}']"
+
+class StepClock:
+    """Wall clock starting at the feed timestamp, moving 1ms forward every time it's read"""
+
+    def __init__(self):
+        self.now_ns = int(parse_timestamp(FEED_TIMESTAMP) * 1e9)
+
+    def __call__(self) -> int:
+        self.now_ns += MS
+        return self.now_ns
+
+@pytest.fixture
+def wall_clock():
+    return StepClock()
+
+@pytest.fixture
+def tracker(wall_clock: StepClock):
+    return LatencyTracker(window=10, report_interval=0, clock=wall_clock)
+
+@pytest.fixture
+def replay_clock():
+    return VirtualClock()
+
+@pytest.fixture
+def handler(tracker: LatencyTracker, replay_clock: VirtualClock):
+    """Provides a broker-less MQTTHandler with a 5s delay, published messages are recorded"""
+    return ReplayMQTTHandler(delay=5, clock=replay_clock, latency=tracker)
+
+@pytest.fixture
+def state():
+    return SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+def latency_reports(handler: ReplayMQTTHandler) -> list:
+    return [json.loads(payload) for _, topic, payload in handler.published if topic == MqttTopics.LATENCY_TOPIC]
+
+# --- Tests ---
+def test_line_is_traced_through_every_stage(tracker, handler, state, wall_clock, replay_clock):
+    """Tests that a line producing an event is measured at every stage against its feed timestamp"""
+    router = create_line_router('race', tracker)
+    state.timing_tower.apply({'1': {'Position': '1'}})  # P1 already known, so the line only queues the leader
+
+    tracker.lines_read()                            # +1ms
+    router.dispatch(LEAD_LINE, state, handler)      # parse +2ms, queue +3ms, handle +4ms
+    wall_clock.now_ns += 5 * SECOND                 # The event waits out the publish delay
+    replay_clock.advance_to(replay_clock.monotonic_ns() + 5 * SECOND)
+    handler.publish_due()                           # publish +5ms, less the 5s delay
+
+    report = latency_reports(handler)[-1]
+    assert {stage: values['p50'] for stage, values in report.items()} == {
+        'read': 1.0, 'parse': 2.0, 'handle': 4.0, 'queue': 3.0, 'publish': 5.0,
+    }
+    assert report['publish']['samples'] == 1
+
+def test_untraced_events(tracker, handler, state):
+    """Tests that events queued outside of a line (e.g. --force-lead) and lines without handlers are not traced"""
+    router = create_line_router('race', tracker)
+    router.dispatch("['Heartbeat', {'Utc': '2025-07-06T14:49:09.888Z'}, '2025-07-06T14:49:09.888Z']", state, handler)
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'forced', immediate=True)
+    handler.publish_due()
+
+    assert [payload for _, topic, payload in handler.published] == ['forced']
+    assert tracker.percentiles() == {}
+
+def test_percentiles_over_rolling_window(tracker: LatencyTracker):
+    """Tests that only the last `window` samples count towards the percentiles"""
+    feed_ns = int(parse_timestamp(FEED_TIMESTAMP) * 1e9)
+    for _ in range(20):
+        tracker.start_line(FEED_TIMESTAMP)      # 1ms, 2ms, ... 20ms after the feed
+        tracker.end_line()
+    tracker._clock = lambda: feed_ns
+
+    parse = tracker.percentiles()['parse']
+    assert parse['samples'] == 10
+    assert (parse['p50'], parse['p95'], parse['p99']) == (31.0, 39.0, 39.0)
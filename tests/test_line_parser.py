@@ -0,0 +1,43 @@
+import ast
+import pytest
+
+from src.drs.line_parser import parse_line, parse_timestamp
+
+# --- Tests ---
+@pytest.mark.parametrize("line", [
+    # Real lines as written by the livetiming client
+    "['TimingData', {'Lines': {'10': {'NumberOfLaps': 3, 'Sectors': {'2': {'Value': '24.386'}}, 'Speeds': {'FL': {'Value': '250'}}, 'BestLapTime': {'Value': '1:28.552', 'Lap': 2}, 'LastLapTime': {'Value': '1:28.552', 'OverallFastest': True, 'PersonalFastest': True}}}}, '2025-07-05T10:38:19.212Z']",
+    "['RaceControlMessages', {'Messages': {'56': {'Utc': '2025-07-05T11:39:56', 'Category': 'Flag', 'Flag': 'YELLOW', 'Scope': 'Sector', 'Sector': 2, 'Message': 'YELLOW IN TRACK SECTOR 2'}}}, '2025-07-05T11:39:56.262Z']",
+    "['TopThree', {'Lines': {'1': {'RacingNumber': '81', 'DiffToAhead': '', 'DiffToLeader': ''}}}, '2025-07-06T14:49:09.888Z']",
+    # Keywords, numbers and nesting
+    "['WeatherData', {'AirTemp': 21.5, 'Rainfall': False, 'Drs': None, 'Laps': [1, -2, 3.25e-05, []], 'Deep': {'a': {'b': {}}}}, '2025-07-06T14:49:09.888Z']",
+    # Keywords inside strings must be left alone
+    "['RaceControlMessages', {'Message': 'True None False', 'Flag': 'None'}, 'x']",
+    # Things the fast path can't handle and must fall back on
+    "['RaceControlMessages', {'Message': \"DRIVER'S LAP DELETED\"}, 'x']",
+    "['Test', {'Message': 'LINE\\nBREAK'}, 'x']",
+    "['Test', {1: 'int key'}, 'x']",
+    "['Test', (1, 2), 'x']",
+])
+def test_parse_line_matches_literal_eval(line: str):
+    """Tests that the fast parser returns exactly what ast.literal_eval returns"""
+    parsed = parse_line(line)
+    expected = ast.literal_eval(line)
+
+    assert parsed == expected
+    assert [type(value) for value in parsed] == [type(value) for value in expected]
+
+@pytest.mark.parametrize("line", ["", "garbage", "['unterminated", "['TopThree', {'Lines': }, 'x']"])
+def test_parse_line_malformed(line: str):
+    """Tests that malformed lines raise the same errors as ast.literal_eval"""
+    with pytest.raises((ValueError, SyntaxError)):
+        parse_line(line)
+
+@pytest.mark.parametrize("timestamp, expected", [
+    ('2025-07-05T10:38:19.212Z', 1751711899.212),
+    ('2025-07-05T10:38:19Z', 1751711899.0),
+    ('2025-07-05T10:38:19.2123456Z', 1751711899.2123456),
+])
+def test_parse_timestamp(timestamp: str, expected: float):
+    """Tests that feed timestamps are converted to UTC epoch seconds"""
+    assert parse_timestamp(timestamp) == pytest.approx(expected)
@@ -0,0 +1,111 @@
+import pytest
+from unittest.mock import Mock
+import json
+
+from src.drs.f1_utils import create_line_router
+from src.drs.line_router import LineRouter, decode_line, peek_category
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {
+        "1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'},
+        "10" : {'abbreviation' : 'GAS', 'team_key' : 'alpine'},
+    },
+    "teams" : {
+        'red_bull' : {'name' : 'Red Bull'},
+        'alpine' : {'name' : 'Alpine'},
+    }
+}
+
+TOP_THREE_LINE = "['TopThree', {'Lines': {'0': {'RacingNumber': '1', 'Tla': 'VER'}}}, '2025-07-06T14:49:09.888Z']"
+TIMING_DATA_LINE = "['TimingData', {'Lines': {'10': {'LastLapTime': {'Value': '1:28.552', 'OverallFastest': True, 'PersonalFastest': True}}}}, '2025-07-05T10:38:19.212Z']"
+RED_FLAG_LINE = "['RaceControlMessages', {'Messages': {'50': {'Utc': '2025-07-05T11:33:58', 'Category': 'Flag', 'Flag': 'RED', 'Scope': 'Track', 'Message': 'RED FLAG'}}}, '2025-07-05T11:33:58.102Z']"
+
+@pytest.fixture
+def state():
+    """Provides a fresh race state"""
+    return SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+@pytest.fixture
+def mock_mqtt():
+    """Provides a fresh mock MQTT handler"""
+    return Mock()
+
+# --- Tests ---
+def test_decode_line():
+    """Tests that a line is decoded into category, payload and timestamp"""
+    category, payload, timestamp = decode_line(RED_FLAG_LINE)
+
+    assert category == 'RaceControlMessages'
+    assert payload['Messages']['50']['Flag'] == 'RED'
+    assert timestamp == '2025-07-05T11:33:58.102Z'
+
+@pytest.mark.parametrize("line", ["", "garbage", "['TopThree', {}]", "[1, {}, '2025-07-05T11:33:58.102Z']"])
+def test_decode_line_malformed(line: str):
+    """Tests that malformed lines are rejected instead of raising"""
+    assert decode_line(line) is None
+
+def test_dispatch_only_runs_category_handlers(state: SessionState, mock_mqtt: Mock):
+    """Tests that only the handlers for the line's category are called, with the decoded payload"""
+    router = LineRouter()
+    top_three_handler = Mock()
+    timing_data_handler = Mock()
+    router.register('TopThree', top_three_handler)
+    router.register('TimingData', timing_data_handler)
+
+    router.dispatch(TOP_THREE_LINE, state, mock_mqtt)
+
+    top_three_handler.assert_called_once_with({'Lines': {'0': {'RacingNumber': '1', 'Tla': 'VER'}}}, state, mock_mqtt)
+    timing_data_handler.assert_not_called()
+
+def test_race_router_sets_leader_and_flag(state: SessionState, mock_mqtt: Mock):
+    """Tests the race router end to end: TopThree sets the leader (and seeds the top three), TimingData only feeds the timing tower"""
+    router = create_line_router('race')
+
+    router.dispatch(TOP_THREE_LINE, state, mock_mqtt)
+    router.dispatch(TIMING_DATA_LINE, state, mock_mqtt)
+    router.dispatch(RED_FLAG_LINE, state, mock_mqtt)
+
+    assert state.current_session_lead.driver == 'VER'
+    assert state.race_state == 'RED'
+    assert mock_mqtt.queue_message.call_count == 3
+    mock_mqtt.queue_message.assert_any_call(MqttTopics.TOP_THREE_TOPIC, json.dumps([{"position": 1, "driver": "VER", "driver_number": "1", "team": "Red Bull"}]))
+    mock_mqtt.queue_message.assert_any_call(MqttTopics.LEADER_TOPIC, json.dumps({"driver": "VER", "driver_number": "1", "team": "Red Bull"}))
+
+def test_practice_router_uses_lap_times(state: SessionState, mock_mqtt: Mock):
+    """Tests that the non race router follows fastest laps and ignores TopThree"""
+    state.session_type = 'practice'
+    router = create_line_router('practice')
+
+    router.dispatch(TOP_THREE_LINE, state, mock_mqtt)
+    router.dispatch(TIMING_DATA_LINE, state, mock_mqtt)
+
+    assert state.current_session_lead.driver == 'GAS'
+    mock_mqtt.queue_message.assert_called_once_with(MqttTopics.LEADER_TOPIC, json.dumps({"driver": "GAS", "driver_number": "10", "team": "Alpine"}))
+
+@pytest.mark.parametrize("line, expected", [
+    (TOP_THREE_LINE, 'TopThree'),
+    ("['CarData.z', '7ZTBasdf==', '2025-07-06T14:49:09.888Z']", 'CarData.z'),
+    ("garbage", None),
+    ("['unterminated", None),
+])
+def test_peek_category(line: str, expected):
+    """Tests that the category is read from the start of the line"""
+    assert peek_category(line) == expected
+
+def test_dispatch_skips_unhandled_categories(state: SessionState, mock_mqtt: Mock, monkeypatch):
+    """Tests that lines without handlers are counted and never fully decoded"""
+    router = create_line_router('race')
+    decode_mock = Mock(side_effect=decode_line)
+    monkeypatch.setattr('src.drs.line_router.decode_line', decode_mock)
+
+    router.dispatch("['CarData.z', '7ZTBasdf==', '2025-07-06T14:49:09.888Z']", state, mock_mqtt)
+    router.dispatch("['Position.z', '7ZTBasdf==', '2025-07-06T14:49:09.888Z']", state, mock_mqtt)
+    router.dispatch("['CarData.z', '7ZTBasdf==', '2025-07-06T14:49:10.888Z']", state, mock_mqtt)
+    router.dispatch(TOP_THREE_LINE, state, mock_mqtt)
+
+    assert router.skip_counts == {'CarData.z': 2, 'Position.z': 1}
+    decode_mock.assert_called_once_with(TOP_THREE_LINE)
@@ -0,0 +1,235 @@
+import pytest
+from unittest.mock import MagicMock, Mock, patch
+from queue import Queue
+import threading
+import time
+
+from src.drs import f1_utils
+from src.drs.mqtt_handler import MQTTHandler, PublishSink
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.publish_scheduler import PublishScheduler
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MS = 1_000_000
+SECOND = 1_000_000_000
+
+class PublishRecorder:
+    """Stands in for client.publish, recording when each message was published"""
+
+    def __init__(self):
+        self.published = []
+        self.event = threading.Event()
+
+    def __call__(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((time.monotonic(), topic, payload, retain))
+        self.event.set()
+
+    def wait_for(self, count: int, timeout: float = 2.0) -> None:
+        deadline = time.monotonic() + timeout
+        while self.count_events() < count and time.monotonic() < deadline:
+            self.event.wait(0.01)
+            self.event.clear()
+
+    def count_events(self) -> int:
+        return len(self.events())
+
+    def events(self):
+        """Published events, leaving out the service topics"""
+        return [(t, topic, payload) for t, topic, payload, _ in self.published if not str(topic).startswith('f1/service')]
+
+@pytest.fixture
+def recorder():
+    return PublishRecorder()
+
+@pytest.fixture
+def handler(recorder: PublishRecorder):
+    """Provides an MQTTHandler with a short delay and a fake paho client"""
+    with patch('src.drs.mqtt_handler.mqtt.Client') as client_class:
+        client_class.return_value = MagicMock()
+        client_class.return_value.publish.side_effect = recorder
+        handler = MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0.2, command_queue=Queue())
+        yield handler
+        handler.disconnect()
+
+@pytest.fixture
+def clients():
+    """Patches the paho client, every client created gets its own mock (with client_id as the `name`)"""
+    clients = []
+    def create(client_id):
+        client = MagicMock(name=client_id)
+        client.published = []
+        client.publish.side_effect = lambda topic, payload=None, qos=0, retain=False, client=client: client.published.append((str(topic), payload))
+        clients.append(client)
+        return client
+    with patch('src.drs.mqtt_handler.mqtt.Client', side_effect=create):
+        yield clients
+
+def control_message(topic: str, command: str) -> Mock:
+    return Mock(topic=topic, payload=command.encode('utf-8'))
+
+# --- Tests ---
+def test_scheduler_orders_by_due_time():
+    """Tests that messages come out by due time, and in queue order when due at the same time"""
+    scheduler = PublishScheduler(delay_ns=10 * SECOND)
+    scheduler.push(2 * SECOND, 'b', 'late')
+    scheduler.push(1 * SECOND, 'a', 'first')
+    scheduler.push(1 * SECOND, 'a', 'second')
+    scheduler.push(5 * SECOND, 'c', 'immediate', immediate=True)
+
+    assert scheduler.next_due() == 5 * SECOND
+    assert scheduler.pop_due_messages(4 * SECOND) == []
+    assert scheduler.pop_due_messages(11 * SECOND) == [('main', 'c', 'immediate', None, False), ('main', 'a', 'first', None, False), ('main', 'a', 'second', None, False)]
+    assert scheduler.pop_due_messages(15 * SECOND) == [('main', 'b', 'late', None, False)]
+    assert scheduler.next_due() is None
+
+def test_scheduler_delay_change_retimes_queue():
+    """Tests that changing the delay moves messages that are already queued"""
+    scheduler = PublishScheduler(delay_ns=30 * SECOND)
+    scheduler.push(100 * SECOND, 'a', 'first')
+    scheduler.push(101 * SECOND, 'a', 'second')
+
+    scheduler.delay_ns = 20 * SECOND
+    assert scheduler.next_due() == 120 * SECOND
+    assert scheduler.pop_due_messages(120 * SECOND) == [('main', 'a', 'first', None, False)]
+
+    scheduler.delay_ns = 40 * SECOND
+    assert scheduler.pop_due_messages(140 * SECOND) == []
+    assert scheduler.next_due() == 141 * SECOND
+
+def test_scheduler_coalesces_superseded_messages():
+    """Tests that only the newest message of a coalescing topic is published when several fall due together"""
+    scheduler = PublishScheduler(delay_ns=30 * SECOND, coalesce_topics=[MqttTopics.LEADER_TOPIC], coalesce_window_ns=1 * SECOND)
+    scheduler.push(100_000 * MS, MqttTopics.LEADER_TOPIC, 'VER')
+    scheduler.push(100_200 * MS, MqttTopics.FLAG_TOPIC, 'YELLOW')
+    scheduler.push(100_500 * MS, MqttTopics.LEADER_TOPIC, 'NOR')
+    scheduler.push(100_600 * MS, MqttTopics.FLAG_TOPIC, 'GREEN')
+    scheduler.push(105_000 * MS, MqttTopics.LEADER_TOPIC, 'PIA')
+
+    assert [message[1:3] for message in scheduler.pop_due_messages(130_600 * MS)] == [(MqttTopics.FLAG_TOPIC, 'YELLOW'), (MqttTopics.LEADER_TOPIC, 'NOR'), (MqttTopics.FLAG_TOPIC, 'GREEN')]
+    assert [message[1:3] for message in scheduler.pop_due_messages(135_000 * MS)] == [(MqttTopics.LEADER_TOPIC, 'PIA')]
+    assert scheduler.coalesced_counts == {'f1/race/leader': 1}
+
+def test_immediate_message_is_published_right_away(handler: MQTTHandler, recorder: PublishRecorder):
+    """Tests that immediate messages skip the delay"""
+    queued_at = time.monotonic()
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'payload', immediate=True)
+    recorder.wait_for(1)
+
+    published_at, topic, payload = recorder.events()[0]
+    assert (topic, payload) == (MqttTopics.LEADER_TOPIC, 'payload')
+    assert published_at - queued_at < 0.1
+
+def test_delayed_message_is_published_on_time(handler: MQTTHandler, recorder: PublishRecorder):
+    """Tests that delayed messages are published at the delay, without polling jitter"""
+    queued_at = time.monotonic()
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'leader', immediate=True)
+    recorder.wait_for(2)
+
+    events = recorder.events()
+    assert [payload for _, _, payload in events] == ['leader', 'yellow']
+    assert 0.2 <= events[1][0] - queued_at < 0.3
+
+def test_set_delay_retimes_pending_messages(handler: MQTTHandler, recorder: PublishRecorder):
+    """Tests that a calibration right after an event applies to the event already waiting"""
+    queued_at = time.monotonic()
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+    handler.set_delay(0.05)
+    recorder.wait_for(1)
+
+    published_at, _, payload = recorder.events()[0]
+    assert payload == 'yellow'
+    assert 0.05 <= published_at - queued_at < 0.15
+    assert handler.publish_delay.total_seconds() == 0.05
+
+def test_unchanged_retained_messages_are_skipped(handler: MQTTHandler, recorder: PublishRecorder):
+    """Tests that a payload the broker already retains isn't published again unless forced, or after a reconnect"""
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'VER', immediate=True)
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'VER', immediate=True)
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'NOR', immediate=True)
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'NOR', immediate=True, force=True)
+    recorder.wait_for(3)
+    assert [payload for _, _, payload in recorder.events()] == ['VER', 'NOR', 'NOR']
+    assert handler.unchanged_counts == {'f1/race/leader': 1}
+
+    handler._on_connect(handler.client, None, None, 0)
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'NOR', immediate=True)
+    recorder.wait_for(4)
+    assert recorder.count_events() == 4
+
+def test_scheduler_sinks_share_one_queue():
+    """Tests that every sink gets each message at its own delay (the trace only for the main sink), and a message is only dropped once all sinks had it"""
+    scheduler = PublishScheduler(delay_ns=10 * SECOND, sinks=['main', 'satellite'])
+    scheduler.delays['satellite'] = 30 * SECOND
+    scheduler.push(100 * SECOND, 'a', 'first', trace='trace')
+    scheduler.push(101 * SECOND, 'b', 'second', force=True)
+    scheduler.push(105 * SECOND, 'c', 'immediate', immediate=True)
+
+    assert scheduler.pop_due_messages(111 * SECOND) == [('main', 'c', 'immediate', None, False), ('satellite', 'c', 'immediate', None, False),
+                                                        ('main', 'a', 'first', 'trace', False), ('main', 'b', 'second', None, True)]
+    assert len(scheduler) == 2
+    assert scheduler.next_due() == 130 * SECOND
+
+    scheduler.delays['satellite'] = 20 * SECOND     # Re-times only the satellite's queue
+    assert scheduler.pop_due_messages(120 * SECOND) == [('satellite', 'a', 'first', None, False)]
+    assert scheduler.pop_due_messages(121 * SECOND) == [('satellite', 'b', 'second', None, True)]
+    assert len(scheduler) == 0
+    assert scheduler.next_due() is None
+
+def test_scheduler_coalesces_per_sink():
+    """Tests that superseded messages are dropped for each sink on its own delay"""
+    scheduler = PublishScheduler(delay_ns=30 * SECOND, coalesce_topics=[MqttTopics.LEADER_TOPIC], coalesce_window_ns=1 * SECOND,
+                                 sinks=['main', 'stream'])
+    scheduler.delays['stream'] = 5 * SECOND
+    scheduler.push(100_000 * MS, MqttTopics.LEADER_TOPIC, 'VER')
+    scheduler.push(100_500 * MS, MqttTopics.LEADER_TOPIC, 'NOR')
+
+    assert scheduler.pop_due_messages(105_000 * MS) == []
+    assert scheduler.pop_due_messages(105_500 * MS) == [('stream', MqttTopics.LEADER_TOPIC, 'NOR', None, False)]
+    assert scheduler.pop_due_messages(130_000 * MS) == []
+    assert scheduler.pop_due_messages(130_500 * MS) == [('main', MqttTopics.LEADER_TOPIC, 'NOR', None, False)]
+    assert scheduler.coalesced_counts == {'f1/race/leader': 2}
+
+def test_handler_publishes_to_sinks(clients: list):
+    """Tests that events go to every sink's broker and topics at its own delay, and control subtopics calibrate one sink"""
+    command_queue = Queue()
+    handler = MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0.05, command_queue=command_queue,
+                          sinks=[PublishSink('satellite', delay=0.15, topic_prefix='satellite/'),
+                                 PublishSink('stream', delay=0, broker_ip='10.0.0.2')])
+    main_client, stream_client = clients
+    try:
+        assert stream_client.connect.call_args.args == ('10.0.0.2', 1883)
+        handler._on_message(main_client, None, control_message(f"{MqttTopics.CONTROL_TOPIC}/satellite", "ADJUST:-0.05"))
+        handler._on_message(main_client, None, control_message(MqttTopics.CONTROL_TOPIC, "ADJUST:0.05"))
+        handler._on_message(stream_client, None, control_message(MqttTopics.CONTROL_TOPIC, "CALIBRATE_START"))
+        handler._on_message(main_client, None, control_message(f"{MqttTopics.CONTROL_TOPIC}/nobody", "ADJUST:5"))
+        assert handler.sink_delays == pytest.approx({'main': 0.1, 'satellite': 0.1, 'stream': 0})
+        assert command_queue.get_nowait() == "CALIBRATE_START:stream"
+
+        handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+        deadline = time.monotonic() + 2
+        while len([topic for topic, _ in main_client.published if not topic.startswith('f1/service')]) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        handler.disconnect()
+
+    assert (MqttTopics.FLAG_TOPIC, 'yellow') in main_client.published
+    assert ('satellite/f1/race/flag_status', 'yellow') in main_client.published
+    assert ('satellite/f1/service/publishing_delay', 0.1) in main_client.published
+    assert (MqttTopics.FLAG_TOPIC, 'yellow') in stream_client.published
+    assert (MqttTopics.RUNNING_STATUS_TOPIC, 'OFF') in stream_client.published
+
+    state = SessionState(session_type='race', drivers_data={}, teams_data={})
+    state.set_true_session_start_time(state.now() - 42)
+    mqtt_handler = Mock()
+    f1_utils.handle_command("CALIBRATE_START:stream", state, mqtt_handler)
+    sink_delay, sink = mqtt_handler.set_delay.call_args.args
+    assert (round(sink_delay), sink) == (42, 'stream')
+
+def test_sink_needs_broker_or_prefix(clients: list):
+    """Tests that a sink on the main broker without a topic prefix is refused, it would overwrite the main topics"""
+    with pytest.raises(ValueError):
+        MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0, command_queue=Queue(),
+                    sinks=[PublishSink('satellite', delay=45)])
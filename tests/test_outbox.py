@@ -0,0 +1,125 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+from queue import Queue
+
+from src.drs.mqtt_handler import MQTTHandler
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.outbox import Outbox, DROP_NEWEST, DROP_OLDEST
+
+# --- Fixtures ---
+
+SECOND = 1_000_000_000
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self) -> int:
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def client():
+    """A fake paho client that can lose its connection"""
+    client = MagicMock()
+    client.connected = True
+    client.published = []
+    client.is_connected.side_effect = lambda: client.connected
+    client.publish.side_effect = lambda topic, payload=None, qos=0, retain=False: client.published.append((str(topic), payload))
+    return client
+
+@pytest.fixture
+def handler(client, clock):
+    """An MQTTHandler without delay, publishing only when publish_due() is called"""
+    with patch('src.drs.mqtt_handler.mqtt.Client', return_value=client), patch.object(MQTTHandler, '_publisher_loop'):
+        handler = MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0, command_queue=Queue(),
+                              clock=clock, outbox=Outbox(replay_rate=2.0))
+        yield handler
+        handler.disconnect()
+
+def events(client) -> list:
+    return [(topic, payload) for topic, payload in client.published if not topic.startswith('f1/service')]
+
+# --- Tests ---
+def test_outbox_keeps_latest_per_topic_and_bounds():
+    """Tests that state topics keep only their newest message, and the policies when the outbox is full"""
+    outbox = Outbox(max_messages=3, policies={'log': DROP_OLDEST, MqttTopics.FLAG_TOPIC: DROP_NEWEST})
+    outbox.put('main', MqttTopics.LEADER_TOPIC, 'VER')
+    outbox.put('main', 'log', 'a')
+    outbox.put('main', MqttTopics.LEADER_TOPIC, 'NOR')     # Replaces VER, and moves to the back
+    outbox.put('main', 'log', 'b')
+    assert outbox.superseded == {'f1/race/leader': 1}
+
+    outbox.put('main', 'log', 'c')      # Full, drops the oldest (log a)
+    assert not outbox.put('main', MqttTopics.FLAG_TOPIC, 'RED')    # Full, refused
+    assert outbox.stats()['dropped'] == {'log': 1, 'f1/race/flag_status': 1}
+    assert outbox.take(0, lambda sink: True) == [('main', 'f1/race/leader', 'NOR')]     # Rate limited to one at first
+    assert outbox.take(10 * SECOND, lambda sink: True) == [('main', 'log', 'b')]
+    assert outbox.stats()['depth'] == 1
+
+def test_outbox_replays_in_order_on_reconnect(handler, client, clock):
+    """Tests that messages published while disconnected are held, and replayed in order at the replay rate once
+    connected again, with newer messages queued behind them"""
+    client.connected = False
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'VER')
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'YELLOW')
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'NOR')
+    handler.publish_due()
+    assert events(client) == []
+    assert handler.outbox_stats['depth'] == 2
+    with handler._condition:
+        assert handler._next_wake(clock.now) is None    # Nothing to do until the broker is back
+
+    client.connected = True
+    handler._on_connect(client, None, None, 0)
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'GREEN')
+    handler.publish_due()
+    assert events(client) == [('f1/race/flag_status', 'YELLOW')]
+    with handler._condition:
+        assert handler._next_wake(clock.now) == SECOND // 2
+
+    for clock.now in (SECOND, 2 * SECOND):     # No bursts, one message per half second
+        handler.publish_due()
+    assert events(client) == [('f1/race/flag_status', 'YELLOW'), ('f1/race/leader', 'NOR'), ('f1/race/flag_status', 'GREEN')]
+    stats = json.loads(dict(client.published)[MqttTopics.OUTBOX_TOPIC])
+    assert stats == {'depth': 0, 'held': 4, 'replayed': 3, 'dropped': {}, 'superseded': {'f1/race/leader': 1}}
+
+def test_outbox_spill_file_survives_restart(tmp_path):
+    """Tests that held messages are loaded again from the spill file, which is emptied once they're replayed"""
+    spill = tmp_path / "outbox.jsonl"
+    outbox = Outbox(spill_path=str(spill))
+    outbox.put('main', MqttTopics.LEADER_TOPIC, 'VER')
+    outbox.put('main', MqttTopics.LEADER_TOPIC, 'NOR')
+    outbox.put('satellite', MqttTopics.FLAG_TOPIC, 'RED')
+
+    restarted = Outbox(spill_path=str(spill), replay_rate=100.0)
+    assert len(restarted) == 2
+    assert restarted.take(SECOND, lambda sink: sink == 'main') == [('main', 'f1/race/leader', 'NOR')]
+    assert restarted.holds('satellite')
+    assert restarted.take(2 * SECOND, lambda sink: True) == [('satellite', 'f1/race/flag_status', 'RED')]
+    assert spill.read_text() == ''
+
+    Outbox(spill_path=str(spill)).put('main', MqttTopics.LEADER_TOPIC, 'PIA')
+    assert len(Outbox(spill_path=str(spill), max_age=-1)) == 0     # Too old to still be worth publishing
+    assert not spill.exists()
+
+def test_outbox_drops_spilled_messages_for_unknown_sinks(tmp_path, client, clock):
+    """Tests that messages spilled for a sink that's no longer configured are dropped instead of breaking the publisher"""
+    spill = tmp_path / "outbox.jsonl"
+    outbox = Outbox(spill_path=str(spill))
+    outbox.put('gone', MqttTopics.FLAG_TOPIC, 'RED')
+    outbox.put('main', MqttTopics.LEADER_TOPIC, 'NOR')
+
+    with patch('src.drs.mqtt_handler.mqtt.Client', return_value=client), patch.object(MQTTHandler, '_publisher_loop'):
+        handler = MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0, command_queue=Queue(),
+                              clock=clock, outbox=Outbox(spill_path=str(spill)))
+    assert len(handler.outbox) == 1
+    assert 'gone' not in spill.read_text()
+
+    handler.publish_due()
+    assert (MqttTopics.LEADER_TOPIC, 'NOR') in client.published
+    assert not handler._sink_connected('gone')
@@ -0,0 +1,96 @@
+import json
+import pytest
+from unittest.mock import MagicMock, Mock, patch
+from queue import Queue
+import time
+
+from src.drs.f1_utils import create_line_router
+from src.drs.line_router import LineRouter
+from src.drs.mqtt_handler import MQTTHandler
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.profiler import Profiler
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}},
+}
+
+LEAD_LINE = "['TopThree', {'Lines': {'0': {'RacingNumber': '1'}}}, '2025-07-06T14:49:09.888Z']"
+
+@pytest.fixture
+def profiler(tmp_path):
+    return Profiler(output_dir=str(tmp_path), sample_interval=0.001)
+
+@pytest.fixture
+def state():
+    return SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+@pytest.fixture
+def published():
+    """Patches the paho client, returning the list of (topic, payload) it publishes"""
+    published = []
+    with patch('src.drs.mqtt_handler.mqtt.Client') as client_class:
+        client_class.return_value = MagicMock()
+        client_class.return_value.publish.side_effect = lambda topic, payload=None, qos=0, retain=False: published.append((topic, payload))
+        yield published
+
+def control_message(command: str) -> Mock:
+    return Mock(topic=MqttTopics.CONTROL_TOPIC, payload=command.encode('utf-8'))
+
+def busy_wait(seconds: float) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+# --- Tests ---
+def test_router_timings_only_when_enabled(profiler: Profiler, state: SessionState):
+    """Tests that parse and handler timings are recorded per category only while profiling is on"""
+    router = create_line_router('race', profiler=profiler)
+    router.dispatch(LEAD_LINE, state, Mock())
+    assert profiler.timings() == {}
+
+    profiler.start()
+    router.dispatch(LEAD_LINE, state, Mock())
+    router.dispatch(LEAD_LINE, state, Mock())
+    timings = profiler.stop()
+    router.dispatch(LEAD_LINE, state, Mock())
+
+    assert set(timings) == {'TopThree'}
+    assert set(timings['TopThree']) == {'parse', 'handle_race_lead'}
+    assert timings['TopThree']['parse']['count'] == 2
+    assert timings['TopThree']['handle_race_lead']['count'] == 2
+    assert state.current_session_lead.driver == 'VER'
+
+def test_profile_commands(profiler: Profiler, published: list):
+    """Tests PROFILE:ON/OFF over the control topic, with the timings published when profiling stops"""
+    handler = MQTTHandler(broker_ip='localhost', port=1883, username='u', password='p', delay=0, command_queue=Queue(), profiler=profiler)
+    router = LineRouter(profiler=profiler)
+    router.register('TopThree', Mock(__name__='handler'))
+
+    handler._on_message(None, None, control_message("PROFILE:ON"))
+    assert profiler.enabled
+    router.dispatch(LEAD_LINE, Mock(), handler)
+    handler._on_message(None, None, control_message("PROFILE:OFF"))
+    handler.disconnect()
+
+    assert not profiler.enabled
+    topic, payload = [message for message in published if message[0] == MqttTopics.PROFILE_TOPIC][0]
+    assert json.loads(payload)['TopThree']['handler']['count'] == 1
+
+def test_sampling_writes_collapsed_stacks(profiler: Profiler, tmp_path):
+    """Tests that sampling writes `frame;frame count` lines including the code that was running"""
+    path = profiler.start_sampling(0.2)
+    assert profiler.start_sampling(0.2) is None     # Only one run at a time
+    busy_wait(0.2)
+    profiler._sampler.join()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+    assert any(line.startswith('MainThread;') and 'busy_wait (test_profiler.py)' in line for line in lines)
@@ -0,0 +1,92 @@
+import base64
+import json
+import pytest
+import zlib
+from unittest.mock import Mock
+
+from src.drs import f1_utils
+from src.drs.line_router import decode_line
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.proximity import BattleDetector
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {
+        "1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'},
+        "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'},
+        "16" : {'abbreviation' : 'LEC', 'team_key' : 'ferrari'},
+        "81" : {'abbreviation' : 'PIA', 'team_key' : 'mclaren'},
+    },
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}, 'ferrari' : {'name' : 'Ferrari'}},
+}
+
+@pytest.fixture
+def state():
+    """Provides a started race running VER, NOR, LEC, PIA, following LEC"""
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"], followed_driver='16')
+    state.set_true_session_start_time(state.now())
+    state.timing_tower.restore_order(['1', '4', '16', '81'])
+    return state
+
+@pytest.fixture
+def mock_mqtt():
+    """Provides a fresh mock MQTT handler"""
+    return Mock()
+
+def position_line(*frames: dict) -> str:
+    """A Position.z line, every frame is {racing number: metres along the X axis}"""
+    positions = [{'Timestamp': '2025-07-06T14:00:00.000Z',
+                  'Entries': {number: {'Status': 'OnTrack', 'X': int(x * 10), 'Y': 0, 'Z': 0} for number, x in frame.items()}}
+                 for frame in frames]
+    compressor = zlib.compressobj(wbits=-15)
+    payload = base64.b64encode(compressor.compress(json.dumps({'Position': positions}).encode()) + compressor.flush()).decode()
+    return str(['Position.z', payload, '2025-07-06T14:00:00.100Z'])
+
+def published(mock_mqtt: Mock, topic: str) -> list:
+    return [json.loads(call.args[1]) for call in mock_mqtt.queue_message.call_args_list if call.args[0] == topic]
+
+# --- Tests ---
+def test_pairwise_distances(state: SessionState, mock_mqtt: Mock):
+    """Tests that every frame gives the distances between all cars, unknown for cars that are missing"""
+    detector = BattleDetector()
+    detector.handle_position(decode_line(position_line({'1': 0, '4': 30, '16': 70}))[1], state, mock_mqtt)
+    distances = dict(((a, b), detector.distances[detector.slots[a], detector.slots[b]]) for a in ('1', '4', '16', '81') for b in ('1', '4', '16', '81'))
+    assert (distances[('1', '4')], distances[('4', '16')], distances[('16', '1')]) == pytest.approx((30, 40, 70))
+    assert distances[('1', '81')] != distances[('1', '81')]     # NaN
+
+def test_lead_battle_with_hysteresis(state: SessionState, mock_mqtt: Mock):
+    """Tests that the lead battle only starts and ends after enough frames past the distances, not in between"""
+    router = f1_utils.create_line_router('race', battles=BattleDetector(start_distance=50, end_distance=90, frames=2))
+    router.dispatch(position_line({'1': 0, '4': 40}, {'1': 0, '4': 100}), state, mock_mqtt)     # Close for one frame only
+    router.dispatch(position_line({'1': 0, '4': 45}, {'1': 0, '4': 48}), state, mock_mqtt)      # Starts
+    router.dispatch(position_line({'1': 0, '4': 80}, {'1': 0, '4': 95}, {'1': 0, '4': 85}), state, mock_mqtt)   # Between the distances
+    router.dispatch(position_line({'1': 0, '4': 95}, {'1': 0, '4': 120}), state, mock_mqtt)     # Ends
+
+    battles = published(mock_mqtt, MqttTopics.LEAD_BATTLE_TOPIC)
+    assert [(battle['state'], battle['distance']) for battle in battles] == [('ON', 48.0), ('OFF', 120.0)]
+    assert [driver['driver'] for driver in battles[0]['drivers']] == ['VER', 'NOR']
+
+def test_driver_battle_and_caution(state: SessionState, mock_mqtt: Mock):
+    """Tests that the followed driver battles the closer of the cars around them, and battles end under a yellow"""
+    router = f1_utils.create_line_router('race', battles=BattleDetector(frames=1))
+    router.dispatch(position_line({'1': 0, '4': 500, '16': 560, '81': 580}), state, mock_mqtt)
+    state.set_race_state('YELLOW')
+    router.dispatch(position_line({'1': 0, '4': 500, '16': 560, '81': 580}), state, mock_mqtt)
+
+    battles = published(mock_mqtt, MqttTopics.DRIVER_BATTLE_TOPIC)
+    assert [(battle['state'], [driver['driver'] for driver in battle['drivers']]) for battle in battles] == [('ON', ['LEC', 'PIA']), ('OFF', ['LEC', 'PIA'])]
+    assert published(mock_mqtt, MqttTopics.LEAD_BATTLE_TOPIC) == []
+
+def test_battles_without_position_patches(mock_mqtt: Mock):
+    """Tests that battles are found when DRS started reading after the last Position patch, from the TopThree order only"""
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"], followed_driver='16')
+    state.set_true_session_start_time(state.now())
+    router = f1_utils.create_line_router('race', battles=BattleDetector(frames=3))
+    router.dispatch(str(['TopThree', {'Lines': {'0': {'RacingNumber': '1'}, '1': {'RacingNumber': '4'}, '2': {'RacingNumber': '16'}}}, '2025-07-06T14:00:00.000Z']), state, mock_mqtt)
+    router.dispatch(str(['TimingData', {'Lines': {'4': {'GapToLeader': '+0.3'}}}, '2025-07-06T14:00:00.050Z']), state, mock_mqtt)
+    router.dispatch(position_line(*[{'1': 0, '4': 20, '16': 400}] * 6), state, mock_mqtt)
+
+    assert [[driver['driver'] for driver in battle['drivers']] for battle in published(mock_mqtt, MqttTopics.LEAD_BATTLE_TOPIC)] == [['VER', 'NOR']]
+    assert published(mock_mqtt, MqttTopics.DRIVER_BATTLE_TOPIC) == []
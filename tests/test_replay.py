@@ -0,0 +1,87 @@
+import json
+import pytest
+
+from src.drs.f1_utils import QUALI_RESET_DELAY, create_line_router
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.replay import ReplayMQTTHandler, VirtualClock, replay_lines
+from src.drs.session_state import SessionState
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}},
+}
+
+START_NS = 1_000_000_000_000
+SECOND = 1_000_000_000
+
+def leader_line(number: str, timestamp: str) -> str:
+    return f"['TopThree', {{'Lines': {{'0': {{'RacingNumber': '{number}'}}}}}}, '{timestamp}']"
+
+def lap_line(number: str, lap_time: str, timestamp: str) -> str:
+    return f"['TimingData', {{'Lines': {{'{number}': {{'LastLapTime': {{'Value': '{lap_time}'}}}}}}}}, '{timestamp}']"
+
+def flag_line(flag: str, timestamp: str) -> str:
+    return f"['RaceControlMessages', {{'Messages': {{'1': {{'Category': 'Flag', 'Flag': '{flag}', 'Scope': 'Track', 'Message': '{flag} FLAG'}}}}}}, '{timestamp}']"
+
+def replay(session_type: str, lines: list, delay: float = 0, **kwargs):
+    """Replays the lines with a fresh state and handler, returning the state and the events published"""
+    clock = VirtualClock(START_NS)
+    state = SessionState(session_type=session_type, drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"], clock=clock.monotonic)
+    handler = ReplayMQTTHandler(delay=delay, clock=clock, **kwargs)
+    stats = replay_lines(lines, state, create_line_router(session_type), handler, clock)
+    events = [(t - START_NS, topic, payload) for t, topic, payload in stats.published if not topic.startswith('f1/service')]
+    return state, stats, events
+
+# --- Tests ---
+def test_replay_publishes_at_feed_time_plus_delay():
+    """Tests that messages go out `delay` seconds of feed time after their line"""
+    lines = [
+        leader_line('1', '2025-07-06T14:00:00.000Z'),
+        leader_line('4', '2025-07-06T14:00:10.500Z'),
+        flag_line('YELLOW', '2025-07-06T14:01:00.000Z'),
+    ]
+
+    state, stats, events = replay('race', lines, delay=5)
+
+    assert stats.lines == 3
+    assert stats.feed_seconds == pytest.approx(60)
+    events = [event for event in events if event[1] != MqttTopics.TOP_THREE_TOPIC]
+    assert [(t, str(topic)) for t, topic, _ in events] == [
+        (5 * SECOND, MqttTopics.LEADER_TOPIC),
+        (int(15.5 * SECOND), MqttTopics.LEADER_TOPIC),
+        (65 * SECOND, MqttTopics.FLAG_TOPIC),
+    ]
+    assert events[1][2] == json.dumps({"driver": "NOR", "driver_number": "4", "team": "McLaren"})
+    assert state.current_session_lead.driver == 'NOR'
+
+def test_replay_coalesces_on_feed_time():
+    """Tests that coalescing uses the feed's timing, not how fast the replay runs"""
+    lines = [
+        leader_line('1', '2025-07-06T14:00:00.000Z'),
+        leader_line('4', '2025-07-06T14:00:00.200Z'),
+        leader_line('1', '2025-07-06T14:00:05.000Z'),
+    ]
+
+    _, _, events = replay('race', lines, delay=2, coalesce_topics=[MqttTopics.LEADER_TOPIC], coalesce_window=1.0)
+
+    assert [json.loads(payload)['driver'] for _, topic, payload in events if topic == MqttTopics.LEADER_TOPIC] == ['NOR', 'VER']
+
+def test_replay_quali_segment_reset():
+    """Tests that the qualifying reset happens QUALI_RESET_DELAY of feed time after the chequered flag"""
+    lines = [
+        lap_line('1', '1:28.552', '2025-07-05T14:00:00.000Z'),
+        flag_line('CHEQUERED', '2025-07-05T14:10:00.000Z'),
+        lap_line('4', '1:29.000', f'2025-07-05T14:{10 + QUALI_RESET_DELAY // 60 - 1}:00.000Z'),
+    ]
+
+    state, _, _ = replay('qualifying', lines)
+    assert state.quali_session == 'Q1'
+    assert state.cooldown_active
+
+    lines.append(lap_line('4', '1:29.000', f'2025-07-05T14:{10 + QUALI_RESET_DELAY // 60 + 1}:00.000Z'))
+    state, _, events = replay('qualifying', lines)
+    assert state.quali_session == 'Q2'
+    assert state.fastest_lap_info.driver == 'NOR'
+    assert json.loads(events[-1][2])['driver'] == 'NOR'
@@ -0,0 +1,53 @@
+import json
+import pytest
+from pathlib import Path
+
+from src.drs.session_state import SessionState, validate_driver_index
+
+# --- Fixtures ---
+
+DRS_DATA_FILE = Path(__file__).parent.parent / "data" / "drs_data.json"
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}},
+}
+
+@pytest.fixture
+def drs_data():
+    """The real driver and team data"""
+    with open(DRS_DATA_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# --- Tests ---
+def test_driver_index_payloads(drs_data: dict):
+    """Tests that the pre-serialised leader payloads are exactly what used to be built for every lead change"""
+    state = SessionState(session_type='race', drivers_data=drs_data["drivers"], teams_data=drs_data["teams"])
+
+    assert set(state.driver_index) == set(drs_data["drivers"])
+    for number, driver_info in drs_data["drivers"].items():
+        team_name = drs_data["teams"][driver_info['team_key']]['name']
+        record = state.driver(number)
+        assert (record.abbreviation, record.team) == (driver_info['abbreviation'], team_name)
+        assert record.leader_payload == json.dumps({"driver": driver_info['abbreviation'], "driver_number": number, "team": team_name})
+
+def test_unknown_driver():
+    """Tests that a racing number missing from the data gives an UNK driver of an UNKNOWN team"""
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+    record = state.driver('99')
+    assert (record.abbreviation, record.team) == ("UNK", "UNKNOWN")
+    assert record.leader_payload == json.dumps({"driver": "UNK", "driver_number": "99", "team": "UNKNOWN"})
+
+def test_validate_driver_index(drs_data: dict):
+    """Tests that the real data is consistent, and inconsistencies against driver_numbers are reported"""
+    assert validate_driver_index(drs_data["drivers"], drs_data["teams"]) == []
+    assert validate_driver_index(MOCK_DRS_DATA["drivers"], MOCK_DRS_DATA["teams"]) == []     # No driver_numbers to check against
+
+    drivers = {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'haas'}}
+    teams = {'red_bull' : {'name' : 'Red Bull', 'driver_numbers' : ["1", "22", "4"]}}
+    assert validate_driver_index(drivers, teams) == [
+        "Driver 4 has unknown team 'haas'",
+        "Team 'red_bull' lists driver 22, who is missing from drivers",
+        "Team 'red_bull' lists driver 4, who drives for 'haas'",
+    ]
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+import pytest
+
+from src.drs.cache_tailer import CacheTailer
+from src.drs.mqtt_handler import PublishSink
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.replay import ReplayMQTTHandler, VirtualClock
+from src.drs.session_state import SessionState
+from src.drs.snapshot import Snapshotter
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}},
+}
+
+SECOND = 1_000_000_000
+
+def new_state(session_type: str = 'qualifying') -> SessionState:
+    return SessionState(session_type=session_type, drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+
+def new_handler(delay: float = 30) -> ReplayMQTTHandler:
+    return ReplayMQTTHandler(delay=delay, clock=VirtualClock(time.monotonic_ns()))
+
+@pytest.fixture
+def snapshots(tmp_path):
+    return Snapshotter(str(tmp_path / "drs_snapshot.json"), interval=30)
+
+@pytest.fixture
+def cache_file(tmp_path):
+    path = tmp_path / "livetiming_cache.txt"
+    path.write_text("['Heartbeat', {}, 'a']\n['Heartbeat', {}, 'b']\n", encoding='utf-8')
+    return path
+
+# --- Tests ---
+def test_snapshot_round_trip(snapshots: Snapshotter, cache_file):
+    """Tests that the state, delay, publish queue and cache position come back as they were saved"""
+    state = new_state()
+    state.set_race_state('YELLOW')
+    state.add_sector_to_yellow_flags(4)
+    state.set_fastest_lap(88_552, 'VER', 'Red Bull')
+    state.set_session_lead('VER', '1', 'Red Bull')
+    state.quali_session = 'Q2'
+    state.set_cooldown_active(True)
+    state.set_session_end_time(state.now() - 100)
+    state.set_true_session_start_time(state.now() - 1000)
+    state.timing_tower.apply({'1': {'Position': '1'}, '16': {'Position': '2'}})
+    handler = new_handler(delay=42.5)
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+    handler.queue_message(MqttTopics.LEADER_TOPIC, 'leader', immediate=True)
+    with CacheTailer(str(cache_file), from_end=True) as tailer:
+        position = tailer.position
+        assert snapshots.maybe_save(state, handler, tailer)
+
+    restored_state, restored_handler = new_state(), new_handler()
+    snapshot = snapshots.load('qualifying')
+    snapshots.restore(snapshot, restored_state, restored_handler)
+
+    assert (restored_state.race_state, restored_state.yellow_flags, restored_state.quali_session, restored_state.cooldown_active) == ('YELLOW', {4}, 'Q2', True)
+    assert restored_state.fastest_lap_info == state.fastest_lap_info
+    assert restored_state.current_session_lead == state.current_session_lead
+    assert restored_state.timing_tower.order() == ['1', '16']
+    assert restored_state.now() - restored_state.session_end_time == pytest.approx(100, abs=0.1)
+    assert restored_state.now() - restored_state.true_session_start_time == pytest.approx(1000, abs=0.1)
+    assert restored_handler.publish_delay.total_seconds() == 42.5
+    assert [(str(topic), payload, immediate) for _, topic, payload, immediate, _ in restored_handler.pending_messages()] == [
+        (MqttTopics.FLAG_TOPIC, 'yellow', False), (MqttTopics.LEADER_TOPIC, 'leader', True),
+    ]
+    assert tuple(snapshot['position']) == position
+    assert not os.path.exists(snapshots.path + '.tmp')
+
+def test_snapshot_pending_only_for_waiting_sinks(snapshots: Snapshotter):
+    """Tests that a message one sink already published is restored only for the sinks still waiting for it"""
+    def sink_handler(clock: VirtualClock) -> ReplayMQTTHandler:
+        return ReplayMQTTHandler(delay=10, clock=clock, sinks=[PublishSink('satellite', 30, topic_prefix='satellite/')])
+    clock = VirtualClock(time.monotonic_ns())
+    handler = sink_handler(clock)
+    handler.queue_message(MqttTopics.FLAG_TOPIC, 'yellow')
+    clock.advance_to(clock.monotonic_ns() + 10 * SECOND)
+    handler.publish_due()
+    assert [topic for _, topic, _ in handler.published] == [MqttTopics.FLAG_TOPIC]
+    snapshots.maybe_save(new_state(), handler, None)
+
+    restored_clock = VirtualClock(time.monotonic_ns())
+    restored_handler = sink_handler(restored_clock)
+    snapshots.restore(snapshots.load('qualifying'), new_state(), restored_handler)
+    assert [sinks for *_, sinks in restored_handler.pending_messages()] == [['satellite']]
+    restored_clock.advance_to(restored_clock.monotonic_ns() + 30 * SECOND)
+    restored_handler.publish_due()
+    assert [topic for _, topic, _ in restored_handler.published] == ['satellite/f1/race/flag_status']
+
+def test_snapshot_only_saved_on_change(snapshots: Snapshotter):
+    """Tests that an unchanged state isn't written again, and a change is once `min_interval` has passed (or forced)"""
+    state, handler = new_state(), new_handler()
+    assert snapshots.maybe_save(state, handler, None)
+    snapshots._last_saved_at -= snapshots.min_interval
+    assert not snapshots.maybe_save(state, handler, None)
+
+    state.set_race_state('YELLOW')
+    assert snapshots.maybe_save(state, handler, None)
+    state.set_race_state('RED')
+    assert not snapshots.maybe_save(state, handler, None)     # Too soon after the last save
+    assert snapshots.maybe_save(state, handler, None, force=True)
+    assert not snapshots.maybe_save(state, handler, None, force=True)
+    with open(snapshots.path, 'r', encoding='utf-8') as f:
+        assert json.load(f)['state']['race_state'] == 'RED'
+
+def test_snapshot_ignored_for_other_sessions(snapshots: Snapshotter):
+    """Tests that snapshots of another session type, old snapshots and broken files aren't loaded"""
+    snapshots.maybe_save(new_state('race'), new_handler(), None)
+    assert snapshots.load('race') is not None
+    assert snapshots.load('qualifying') is None
+
+    snapshots.max_age = 0
+    assert snapshots.load('race') is None
+
+    with open(snapshots.path, 'w', encoding='utf-8') as f:
+        f.write('{"state": ')
+    assert Snapshotter(snapshots.path).load('race') is None
+
+def test_tailer_resumes_at_position(cache_file):
+    """Tests that a tailer continues from an earlier position of the same file, and ignores it for another file"""
+    with CacheTailer(str(cache_file), from_end=False) as tailer:
+        assert tailer.read_batch() == ["['Heartbeat', {}, 'a']", "['Heartbeat', {}, 'b']"]
+        inode, _ = tailer.position
+    resume_after_first_line = (inode, len("['Heartbeat', {}, 'a']\n"))
+
+    with CacheTailer(str(cache_file), resume_from=resume_after_first_line) as tailer:
+        assert tailer.read_batch() == ["['Heartbeat', {}, 'b']"]
+
+    with CacheTailer(str(cache_file), resume_from=(inode + 1, 0)) as tailer:
+        assert tailer.read_batch() == []
@@ -0,0 +1,70 @@
+import base64
+import json
+import pytest
+import zlib
+from unittest.mock import Mock
+
+from src.drs import f1_utils
+from src.drs.line_parser import parse_line
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.session_state import SessionState
+from src.drs.telemetry import CarTelemetry, decode_compressed
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {"1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'}, "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'}},
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}},
+}
+
+@pytest.fixture
+def state():
+    """Provides a race that has started"""
+    state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+    state.set_true_session_start_time(state.now())
+    return state
+
+@pytest.fixture
+def mock_mqtt():
+    """Provides a fresh mock MQTT handler"""
+    return Mock()
+
+def car_data_line(*samples: dict) -> str:
+    """A CarData.z line, every sample is {racing number: (speed, drs)}"""
+    entries = [{'Utc': '2025-07-06T14:00:00.000Z', 'Cars': {number: {'Channels': {'0': 11000, '2': speed, '45': drs}} for number, (speed, drs) in sample.items()}}
+               for sample in samples]
+    compressor = zlib.compressobj(wbits=-15)
+    payload = base64.b64encode(compressor.compress(json.dumps({'Entries': entries}).encode()) + compressor.flush()).decode()
+    return str(['CarData.z', payload, '2025-07-06T14:00:00.100Z'])
+
+def payload_of(line: str) -> str:
+    return parse_line(line)[1]
+
+def published(mock_mqtt: Mock, topic: str) -> list:
+    return [json.loads(call.args[1]) for call in mock_mqtt.queue_message.call_args_list if call.args[0] == topic]
+
+# --- Tests ---
+def test_top_speed_of_the_session(state: SessionState, mock_mqtt: Mock):
+    """Tests that only a new session top speed (above the floor) is published, and the per car top speeds"""
+    telemetry = CarTelemetry()
+    router = f1_utils.create_line_router('race', telemetry=telemetry)
+    router.dispatch(car_data_line({'1': (200, 0), '4': (180, 0)}), state, mock_mqtt)
+    router.dispatch(car_data_line({'1': (310, 0), '4': (325, 0)}, {'1': (318, 0)}), state, mock_mqtt)
+    router.dispatch(car_data_line({'1': (320, 0), '4': (322, 0)}), state, mock_mqtt)
+    router.dispatch(car_data_line({'4': (331, 0)}), state, mock_mqtt)
+
+    assert [(event['driver'], event['speed']) for event in published(mock_mqtt, MqttTopics.TOP_SPEED_TOPIC)] == [('NOR', 325), ('NOR', 331)]
+    assert dict(zip(telemetry.numbers, telemetry.top_speeds.tolist())) == {'1': 320, '4': 331}
+
+def test_leader_drs_open_and_closed(state: SessionState, mock_mqtt: Mock):
+    """Tests that DRS changes are published for the leader only, from the last sample of the car in a line"""
+    assert decode_compressed(payload_of(car_data_line({'1': (290, 8)})))['Entries'][0]['Cars']['1']['Channels']['45'] == 8
+    telemetry = CarTelemetry()
+    state.current_session_lead.driver_number = '1'
+    telemetry.handle_car_data(payload_of(car_data_line({'1': (290, 8), '4': (290, 12)})), state, mock_mqtt)
+    telemetry.handle_car_data(payload_of(car_data_line({'1': (290, 8)}, {'1': (295, 12), '4': (290, 0)})), state, mock_mqtt)
+    telemetry.handle_car_data(payload_of(car_data_line({'4': (300, 14)})), state, mock_mqtt)     # No sample for the leader
+    telemetry.handle_car_data(payload_of(car_data_line({'1': (250, 1)})), state, mock_mqtt)
+
+    assert [(event['driver'], event['drs']) for event in published(mock_mqtt, MqttTopics.DRS_TOPIC)] == [('VER', 'CLOSED'), ('VER', 'OPEN'), ('VER', 'CLOSED')]
+    assert telemetry.drs_open.tolist() == [False, True]
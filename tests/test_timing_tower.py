@@ -0,0 +1,93 @@
+import json
+import pytest
+from unittest.mock import Mock
+
+from src.drs.f1_utils import create_line_router
+from src.drs.mqtt_topics import MqttTopics
+from src.drs.session_state import SessionState
+from src.drs.timing_tower import TimingTower
+
+# --- Fixtures ---
+
+MOCK_DRS_DATA = {
+    "drivers": {
+        "1" : {'abbreviation' : 'VER', 'team_key' : 'red_bull'},
+        "4" : {'abbreviation' : 'NOR', 'team_key' : 'mclaren'},
+        "16" : {'abbreviation' : 'LEC', 'team_key' : 'ferrari'},
+        "81" : {'abbreviation' : 'PIA', 'team_key' : 'mclaren'},
+    },
+    "teams" : {'red_bull' : {'name' : 'Red Bull'}, 'mclaren' : {'name' : 'McLaren'}, 'ferrari' : {'name' : 'Ferrari'}},
+}
+
+@pytest.fixture
+def state():
+    """Provides a fresh race state, following PIA"""
+    return SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"], followed_driver='81')
+
+@pytest.fixture
+def mock_mqtt():
+    """Provides a fresh mock MQTT handler"""
+    return Mock()
+
+def timing_line(lines: dict) -> str:
+    return str(['TimingData', {'Lines': lines}, '2025-07-06T14:10:00.000Z'])
+
+def published(mock_mqtt: Mock, topic: str) -> list:
+    return [json.loads(call.args[1]) for call in mock_mqtt.queue_message.call_args_list if call.args[0] == topic]
+
+# --- Tests ---
+def test_tower_merges_patches():
+    """Tests that partial updates are merged per car, sectors as a full list or by index"""
+    tower = TimingTower()
+    tower.apply({'1': {'Position': '1', 'GapToLeader': 'LAP 5', 'Sectors': [{'Value': '30.1'}, {'Value': '40.2'}, {'Value': '20.3'}]},
+                 '4': {'Position': '2', 'GapToLeader': '+1.2', 'IntervalToPositionAhead': {'Value': '+1.2', 'Catching': True}}})
+    tower.apply({'1': {'Sectors': {'0': {'Value': '29.9', 'PersonalFastest': True}, '1': {'Value': ''}}, 'BestLapTime': {'Value': '1:30.100', 'Lap': 4}},
+                 '4': {'GapToLeader': '+0.8', 'NumberOfLaps': 5}})
+
+    leader = tower.leader()
+    assert leader.number == '1'
+    assert leader.sectors == ['29.9', None, '20.3']
+    assert leader.best_lap == '1:30.100'
+    assert (tower.at(2).gap_to_leader, tower.at(2).interval, tower.at(2).laps) == ('+0.8', '+1.2', 5)
+    assert tower.at(3) is None
+
+def test_tower_order_follows_position_patches():
+    """Tests that overtakes move the order along, whichever car's patch comes in first"""
+    tower = TimingTower()
+    assert tower.apply({'1': {'Position': '1'}, '4': {'Position': '2'}, '16': {'Position': '3'}}) == {1, 2, 3}
+    assert tower.apply({'16': {'Position': '2'}, '4': {'Position': '3'}}) == {2, 3}
+    assert tower.order() == ['1', '16', '4']
+
+    assert tower.apply({'4': {'Position': '1'}}) == {1, 3}     # 1 and 16 only move down in the next update
+    assert tower.top(3) == ['4', '16', None]
+    tower.apply({'1': {'Position': '2'}, '16': {'Position': '3'}})
+    assert tower.order() == ['4', '1', '16']
+    assert [tower.cars[number].position for number in ('4', '1', '16')] == [1, 2, 3]
+
+def test_timing_data_publishes_top_three_and_followed_driver(state: SessionState, mock_mqtt: Mock):
+    """Tests that the top three is published when it changes, and the followed driver when its position does"""
+    router = create_line_router('race')
+    router.dispatch(timing_line({'1': {'Position': '1'}, '4': {'Position': '2'}, '16': {'Position': '3'}, '81': {'Position': '4', 'GapToLeader': '+9.1'}}), state, mock_mqtt)
+    router.dispatch(timing_line({'1': {'GapToLeader': 'LAP 2'}}), state, mock_mqtt)
+    router.dispatch(timing_line({'81': {'Position': '3', 'IntervalToPositionAhead': {'Value': '+0.4'}}, '16': {'Position': '4'}}), state, mock_mqtt)
+
+    top_threes = published(mock_mqtt, MqttTopics.TOP_THREE_TOPIC)
+    assert [[car['driver'] for car in top_three] for top_three in top_threes] == [['VER', 'NOR', 'LEC'], ['VER', 'NOR', 'PIA']]
+    assert top_threes[0][1] == {"position": 2, "driver": "NOR", "driver_number": "4", "team": "McLaren"}
+    assert [(driver['position'], driver['interval']) for driver in published(mock_mqtt, MqttTopics.DRIVER_TOPIC)] == [(4, None), (3, '+0.4')]
+
+def test_tower_seeded_until_position_patches(state: SessionState, mock_mqtt: Mock):
+    """Tests that TopThree and the leader fill in positions no Position patch told about, but never override one"""
+    router = create_line_router('race')
+    router.dispatch(str(['TopThree', {'Lines': {'0': {'RacingNumber': '1'}, '1': {'RacingNumber': '4'}, '2': {'RacingNumber': '16'}}}, '2025-07-06T14:10:00.000Z']), state, mock_mqtt)
+    assert state.timing_tower.top(3) == ['1', '4', '16']
+    assert [[car['driver'] for car in top_three] for top_three in published(mock_mqtt, MqttTopics.TOP_THREE_TOPIC)] == [['VER', 'NOR', 'LEC']]
+
+    router.dispatch(timing_line({'81': {'Position': '3'}}), state, mock_mqtt)
+    router.dispatch(str(['TopThree', {'Lines': {'1': {'RacingNumber': '16'}, '2': {'RacingNumber': '4'}}}, '2025-07-06T14:10:01.000Z']), state, mock_mqtt)
+    assert state.timing_tower.top(3) == ['1', '16', '81']     # P2 was only seeded, P3 came from TimingData
+
+    tower_state = SessionState(session_type='race', drivers_data=MOCK_DRS_DATA["drivers"], teams_data=MOCK_DRS_DATA["teams"])
+    tower_state.set_session_lead('NOR', '4', 'McLaren')
+    tower_state.set_session_lead('FORCE', '0', 'McLaren')      # --force-lead isn't a car
+    assert tower_state.timing_tower.order() == ['4']
@@ -0,0 +1,109 @@
+"""Replays a recorded livetiming cache through the DRS processors and publish queue
+
+Usage:
+    python tools/replay_session.py race path/to/livetiming_cache.txt               # as fast as possible
+    python tools/replay_session.py race path/to/livetiming_cache.txt --speed 1     # real time
+    python tools/replay_session.py qualifying cache.txt --speed 20 --publish       # 20x, publishing to the broker
+    python tools/replay_session.py race weekend_cache.txt --session race --lap 40  # from lap 40 of the race
+
+--session, --lap and --from use the cache index (`<cache file>.idx`, built on first use) to seek straight there.
+
+Without --publish nothing is sent anywhere, the published messages are printed as a timeline at the end.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+try:
+    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.append(PROJECT_ROOT)
+    import config
+    from src.drs.cache_index import CacheIndex
+    from src.drs.f1_utils import create_line_router
+    from src.drs.replay import ReplayMQTTHandler, VirtualClock, replay_lines
+    from src.drs.session_state import SessionState
+except ImportError as e:
+    logging.error(f"Could not import the DRS modules ({e}).\n Please ensure this script is in a subdirectory (e.g. 'tools/') of your main project")
+    sys.exit(1)
+
+SESSION_TYPES = ['practice', 'qualifying', 'race']
+
+
+def read_lines(cache_file: str, offset: int = 0):
+    """Yields the lines of the cache file from byte `offset` without newlines"""
+    with open(cache_file, 'r', encoding='utf-8', errors='replace') as f:
+        f.seek(offset)
+        for line in f:
+            yield line.rstrip('\n')
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded livetiming cache through DRS")
+    parser.add_argument('session_type', choices=SESSION_TYPES, help="The type of session that was recorded")
+    parser.add_argument('cache_file', help="Recorded livetiming cache file")
+    parser.add_argument('--speed', type=float, default=0.0, help="Playback speed, 1 for real time, 0 (default) for unthrottled")
+    parser.add_argument('--delay', type=float, default=config.PUBLISH_DELAY, help="Publish delay in seconds (default from config.py)")
+    parser.add_argument('--publish', action='store_true', help="Publish to the MQTT broker from mqtt_config.py")
+    parser.add_argument('--session', help="Start at the (last) session of this name, e.g. race, 'sprint qualifying', 'practice 3'")
+    parser.add_argument('--lap', type=int, help="Start at this lap (of the --session, if given)")
+    parser.add_argument('--from', dest='from_time', help="Start at this feed timestamp, e.g. 2025-07-06T14:30:00")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    offset = 0
+    if args.session or args.lap or args.from_time:
+        index = CacheIndex(args.cache_file)
+        index.sync()
+        if args.session:
+            offset = index.session_offset(args.session)
+            if offset is None:
+                print(f"No session '{args.session}' in the cache, it has: {[entry.value for entry in index.sessions()]}")
+                return
+        if args.lap:
+            lap_offset = index.lap_offset(args.lap, after=offset)
+            if lap_offset is None:
+                print(f"No lap {args.lap} in the cache")
+                return
+            offset = lap_offset
+        if args.from_time:
+            offset = max(offset, index.offset_at(args.from_time))
+
+    with open(os.path.join(PROJECT_ROOT, 'data', 'drs_data.json'), 'r', encoding='utf-8') as f:
+        drs_data = json.load(f)
+
+    clock = VirtualClock()
+    state = SessionState(session_type=args.session_type, teams_data=drs_data.get("teams", {}),
+                         drivers_data=drs_data.get("drivers", {}), clock=clock.monotonic)
+    router = create_line_router(args.session_type)
+
+    broker_settings = {}
+    if args.publish:
+        import mqtt_config
+        broker_settings = dict(broker_ip=mqtt_config.MQTT_BROKER_IP, port=mqtt_config.MQTT_PORT,
+                               username=mqtt_config.MQTT_USERNAME, password=mqtt_config.MQTT_PASSWORD)
+    mqtt_handler = ReplayMQTTHandler(delay=args.delay, clock=clock, coalesce_topics=config.COALESCE_TOPICS,
+                                     coalesce_window=config.COALESCE_WINDOW, **broker_settings)
+
+    try:
+        stats = replay_lines(read_lines(args.cache_file, offset), state, router, mqtt_handler, clock, speed=args.speed)
+    except KeyboardInterrupt:
+        print("Replay stopped by user.")
+        return
+    finally:
+        mqtt_handler.disconnect()
+
+    print(f"{'session time':>12}  topic / payload")
+    for published_ns, topic, payload in stats.published:
+        seconds = int((published_ns - stats.clock_start_ns) / 1e9)
+        print(f"{seconds // 3600:>4}:{seconds // 60 % 60:02}:{seconds % 60:02}    {topic} {payload}")
+
+    print(f"\n{stats.lines} lines covering {stats.feed_seconds / 60:.1f} min of session replayed in {stats.wall_seconds:.2f}s "
+          f"({stats.lines_per_second:,.0f} lines/s, {stats.speedup:,.0f}x real time)")
+    print(f"{len(stats.published)} messages published, superseded messages dropped: {mqtt_handler.coalesced_counts}")
+    print(f"Lines skipped by category: {router.skip_counts}")
+
+
+if __name__ == '__main__':
+    main()